@@ -0,0 +1,170 @@
+"""
+Unit conversions of the TofConverter on whole numpy arrays.
+
+Every unit x is related to the neutron energy E in meV by E = a * x**p. The factor a and the power p of
+each unit are in the table UNITS (the factor of Q, d-spacing and TOF also depends on the scattering
+angle or the flight path), so a conversion is two array operations:
+
+    convert([1.0, 2.0, 4.0], 'Wavelength (Angstroms)', 'Energy  (meV)')
+
+The units are named as in the GUI, or by the short names of SHORTNAMES. From the command line:
+
+    python convertUnits.py -i wavelength -o energy 1.0 2.0 4.0
+    python convertUnits.py -i tof -o energy -l 11.6 --file peaks.xye --column 0 --output peaks_meV.xye
+"""
+import math
+import os
+import sys
+import numpy
+
+#conversion constants to the energy in meV
+e2lam = 81.787
+e2nu = 4.139
+e2v = 0.0000052276
+e2k = 2.0717
+e2t = 0.086165
+e2cm = 0.123975
+
+#(factor,power) of E = factor * x**power. None for the units that need the scattering angle or flight path
+UNITS = {
+	'Energy  (meV)': (1.0, 1),
+	'Wavelength (Angstroms)': (e2lam, -2),
+	'Nu (THz)': (e2nu, 1),
+	'Velocity (m/s)': (e2v, 2),
+	'Momentum ( k Angstroms^-1)': (e2k, 2),
+	'Temperature (K)': (e2t, 1),
+	'Energy (cm^-1)': (e2cm, 1),
+	'Momentum transfer (Q Angstroms^-1)': (None, 2),
+	'd-Spacing (Angstroms)': (None, -2),
+	'Time of flight (microseconds)': (None, -2),
+	}
+
+SHORTNAMES = {
+	'energy': 'Energy  (meV)',
+	'wavelength': 'Wavelength (Angstroms)',
+	'nu': 'Nu (THz)',
+	'velocity': 'Velocity (m/s)',
+	'k': 'Momentum ( k Angstroms^-1)',
+	'temperature': 'Temperature (K)',
+	'cm-1': 'Energy (cm^-1)',
+	'q': 'Momentum transfer (Q Angstroms^-1)',
+	'd': 'd-Spacing (Angstroms)',
+	'tof': 'Time of flight (microseconds)',
+	}
+
+def unitName(unit):
+	"""The GUI name of a unit given by its GUI or short name"""
+	if UNITS.has_key(unit):
+		return unit
+	if SHORTNAMES.has_key(unit.lower()):
+		return SHORTNAMES[unit.lower()]
+	raise ValueError("Unknown unit '%s', use one of: %s" % (unit, ', '.join(sorted(SHORTNAMES.keys()))))
+
+def unitFactor(unit, twotheta=-1.0, flightpath=-1.0, direction='from'):
+	"""
+	(factor,power) of E = factor * x**power for the unit.
+	twotheta is the scattering angle in degrees (Q and d-spacing) and flightpath the flight path in metres (TOF).
+	"""
+	unit = unitName(unit)
+	factor, power = UNITS[unit]
+	if factor is not None:
+		return factor, power
+	if unit == 'Time of flight (microseconds)':
+		if flightpath < 0.0:
+			raise RuntimeError("Flight path >= 0 is required for conversion %s TOF" % direction)
+		return e2v * (1000000 * flightpath) ** 2, power
+	if twotheta <= 0.0:
+		if unit == 'Momentum transfer (Q Angstroms^-1)':
+			raise RuntimeError("Theta > 0 is required for conversion %s Q" % direction)
+		raise RuntimeError("Theta > 0 is required for conversion %s d-Spacing" % direction)
+	sin2 = math.sin(math.radians(twotheta) / 2.0) ** 2
+	if unit == 'Momentum transfer (Q Angstroms^-1)':
+		return e2k / (4.0 * sin2), power
+	return e2lam / (4.0 * sin2), power
+
+def toEnergy(values, unit, twotheta=-1.0, flightpath=-1.0):
+	"""Energies in meV of the values in the unit"""
+	factor, power = unitFactor(unit, twotheta, flightpath, 'from')
+	values = numpy.asarray(values, dtype=float)
+	if power == 1:
+		return factor * values
+	return factor * values ** power
+
+def fromEnergy(energy, unit, twotheta=-1.0, flightpath=-1.0):
+	"""Values in the unit of the energies in meV"""
+	factor, power = unitFactor(unit, twotheta, flightpath, 'to')
+	energy = numpy.asarray(energy, dtype=float)
+	if power == 1:
+		return energy / factor
+	return (energy / factor) ** (1.0 / power)
+
+def convert(values, inunit, outunit, twotheta=-1.0, flightpath=-1.0):
+	"""
+	Convert an array (or a single value) from inunit to outunit.
+	Returns a numpy array, or a float for a single value.
+	"""
+	errors = numpy.seterr(divide='ignore', invalid='ignore')
+	try:
+		result = fromEnergy(toEnergy(values, inunit, twotheta, flightpath), outunit, twotheta, flightpath)
+	finally:
+		numpy.seterr(**errors)
+	if result.ndim == 0:
+		return float(result)
+	return result
+
+def convertFile(infile, outfile, inunit, outunit, column=0, twotheta=-1.0, flightpath=-1.0):
+	"""
+	Convert a column of a CSV (comma separated, *.csv) or XYE (white space separated) file, and write the
+	file with the column converted to outfile. Lines starting with # are kept as the header.
+	"""
+	delimiter = ',' if infile.lower().endswith('.csv') else None
+	header = []
+	f = open(infile, 'r')
+	for line in f:
+		if not line.startswith('#'):
+			break
+		header.append(line[1:].rstrip('\n'))
+	f.close()
+	data = numpy.loadtxt(infile, delimiter=delimiter, comments='#', ndmin=2)
+	data[:, column] = convert(data[:, column], inunit, outunit, twotheta, flightpath)
+	f = open(outfile, 'w')
+	for line in header:
+		f.write('#' + line + '\n')
+	numpy.savetxt(f, data, fmt='%.10g', delimiter=delimiter or ' ')
+	f.close()
+	return data
+
+def main(argv):
+	from optparse import OptionParser
+	parser = OptionParser(usage="%prog -i UNIT -o UNIT [options] [VALUE ...]\n\nUnits: " + ', '.join(sorted(SHORTNAMES.keys())))
+	parser.add_option('-i', '--input-unit', dest='inunit', help="unit of the values")
+	parser.add_option('-o', '--output-unit', dest='outunit', help="unit to convert to")
+	parser.add_option('-t', '--twotheta', dest='twotheta', type='float', default=-1.0, help="scattering angle in degrees (Q, d-spacing)")
+	parser.add_option('-l', '--flightpath', dest='flightpath', type='float', default=-1.0, help="flight path in metres (TOF)")
+	parser.add_option('-f', '--file', dest='infile', help="convert a column of a CSV or XYE file instead of VALUEs")
+	parser.add_option('-c', '--column', dest='column', type='int', default=0, help="column of the file to convert (default 0)")
+	parser.add_option('--output', dest='outfile', help="file to write (default: the input file name with _converted)")
+	options, args = parser.parse_args(argv[1:])
+	if options.inunit is None or options.outunit is None:
+		parser.error("both the input and the output units are required")
+	try:
+		if options.infile is not None:
+			outfile = options.outfile
+			if outfile is None:
+				root, ext = os.path.splitext(options.infile)
+				outfile = root + '_converted' + ext
+			convertFile(options.infile, outfile, options.inunit, options.outunit, options.column, options.twotheta, options.flightpath)
+			print "Written " + outfile
+		else:
+			if len(args) == 0:
+				args = sys.stdin.read().split()
+			result = convert([float(a) for a in args], options.inunit, options.outunit, options.twotheta, options.flightpath)
+			for value in result:
+				print repr(value)
+	except (ValueError, RuntimeError, IOError), e:
+		print >> sys.stderr, "convertUnits: " + str(e)
+		return 1
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv))
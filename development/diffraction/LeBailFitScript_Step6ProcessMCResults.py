@@ -18,6 +18,9 @@ datadict = {
 
 """-------------------------------------------------------------------------------------"""
 
+import os
+import MonteCarloHistory
+
 _PARAMETERSPOOL = ["Zero", "Dtt1", "Zerot", "Dtt1t", "Dtt2t", "Width", "Tcross",
         "LatticeConstant", 
         "Alph0", "Alph1", "Beta0", "Beta1",
@@ -597,8 +600,10 @@ def parseBestParameterFile(paramfname):
 
     return parameterdicts
 
-def parseRandomWalkResult(infofiles, paramfiles):
+def parseRandomWalkResult(infofiles, paramfiles, checkpointfiles=None):
     """ Parse the output files
+    Walks without a best-parameter file (still running or crashed) are parsed from
+    their checkpoint files (MonteCarloHistory) if given
     """
     # 0. Return data structure.  dictionary (seed) of lists (rank of chi2) of dicitonary (parameter/value)
     rwparamdict = {}
@@ -610,6 +615,17 @@ def parseRandomWalkResult(infofiles, paramfiles):
         parameterdicts = parseBestParameterFile(paramfname)
         rwparamdict[seed] = parameterdicts
 
+    # 2. Parse unfinished walks
+    if checkpointfiles is not None:
+        for seed in sorted(checkpointfiles.keys()):
+            if rwparamdict.has_key(seed):
+                continue
+            parameterdicts = MonteCarloHistory.readBestParameters(checkpointfiles[seed])
+            if len(parameterdicts) > 0:
+                print "Random seed %d is not finished.  Use its last checkpoint." % (seed)
+                rwparamdict[seed] = parameterdicts
+        # ENDFOR
+
     return rwparamdict
 
 
@@ -635,6 +651,7 @@ def main(argv):
 
     infofiles = {}
     paramfiles = {}
+    checkpointfiles = {}
 
     for seed in seeds:
         infofname = "%soutput_seed%d.txt" % (directory, seed)
@@ -655,8 +672,12 @@ def main(argv):
         except IOError:
             print "[Warning] Best-parameter file %s for random seed %d cannot be opened." % (paramfname, seed)
 
+        checkpointfname = MonteCarloHistory.checkpointFileNames(directory, seed)[1]
+        if os.path.exists(checkpointfname):
+            checkpointfiles[seed] = checkpointfname
+
     # ----- Parse Information and parameter files ----
-    rwparamdict = parseRandomWalkResult(infofiles, paramfiles)
+    rwparamdict = parseRandomWalkResult(infofiles, paramfiles, checkpointfiles)
 
     # ----- Reproduce the result -----
     reproduceResults(rwparamdict, bankid, runnumber, numoutputs = 3)
@@ -20,6 +20,7 @@ import os
 import sys
 import shutil
 import time
+import MonteCarloHistory
 sys.path.append("/home/wzz/Mantid/Code/debug/bin")
 
 from MantidFramework import mtd
@@ -206,11 +207,15 @@ class LeBailMonteCarlo:
 
         # ---- MC Variables ----
         self.StepSizeFactor = 1.0
+        # Temperature of the walk: acceptance ratio of a worse chi2 is exp(-dchi2/(chi2*T))
+        self.temperature = 1.0
 
 	# ---- MC records ----
-	self.recordChi2 = []  # Current Chi2
-	self.recordCase = []  # Case (cal/fit)
-	self.recordTake = []  # Decision
+        # Current Chi2, case (cal/fit) and decision of each iteration
+        self.history = MonteCarloHistory.MonteCarloHistory()
+        # Write history and state for resuming every N iterations (0 for never)
+        self.checkpointinterval = 10
+        self.checkpointdir = "./"
 
 	self.curchi2 = 1.0E10
         self.bestchi2 = 1.0E100
@@ -776,17 +781,38 @@ class LeBailMonteCarlo:
 
     #********************** MC Codes  ****************************************
     #
-    def randomWalk(self, seed, maxIteration=100, startiteration=1):
+    def randomWalk(self, seed, maxIteration=100, startiteration=1, resume=False):
         """ Change parameters randomly on one random seed
         Inputs
          - seed:  random seed
+         - resume:  continue from the last checkpoint of the walk with the seed if there is one
 
         Return:
          - iteration:  number of interation of this random walk
                        -1  starting values are wrong! 
         """
+        iteration = None
+        if resume is True:
+            iteration = self.resumeRandomWalk(seed)
+        if iteration is None:
+            self.startRandomWalk(seed)
+            iteration = startiteration+1
+
+        startiteration = iteration
+        iteration = self.walk(seed, iteration, maxIteration)
+        # Final state of the walk, unless walk() has just saved it
+        if self.checkpointinterval > 0 and iteration > startiteration and (iteration-1) % self.checkpointinterval != 0:
+            self.writeCheckpoint(seed, iteration)
+        self.writeWalkResult(seed, maxIteration, iteration)
+
+        return iteration
+
+
+    def startRandomWalk(self, seed):
+        """ Fit the starting configuration and seed the random number generator
+        """
         # 1. Work on the input configuration
-        print "\n==========  MC Iteration %d of %d ===============\n" % (0, maxIteration)
+        print "\n==========  MC Iteration %d ===============\n" % (0)
 
         # a) Do a simple LeBail Fit 
         result = self.doLeBailFit(True)
@@ -817,12 +843,91 @@ class LeBailMonteCarlo:
             self.storeResult(self.parameterdict, 0, self.calwsname)
         # ENDIF
 
-        startiteration += 1
-
         # 2. Start random number
         random.seed(seed) 
         self.lastupdate = 0
-    
+
+        # 3. Start a new history file
+        historyfilename = MonteCarloHistory.checkpointFileNames(self.checkpointdir, seed)[0]
+        if os.path.exists(historyfilename):
+            os.remove(historyfilename)
+
+        return
+
+
+    def resumeRandomWalk(self, seed):
+        """ Resume a random walk from its last checkpoint
+
+        Return: the next iteration to walk, or None if there is no checkpoint
+        """
+        historyfilename, checkpointfilename = MonteCarloHistory.checkpointFileNames(self.checkpointdir, seed)
+        state = MonteCarloHistory.readCheckpoint(checkpointfilename)
+        if state is None:
+            return None
+
+        # 1. Current configuration
+        for parname in self.parameternames:
+            self.parameterdict[parname].value = state["parameters"][parname]
+            self.parameterdict[parname].newvalue = state["parameters"][parname]
+            self.parameterdict[parname].valuechange = False
+            self.updatePeakParameterTableValue(InputWorkspace=self.peakparamwsname, OutputWorkspace=self.peakparamwsname,
+                    Column='Value', ParameterNames=[parname], NewFloatValue=state["parameters"][parname])
+        # ENDFOR
+
+        # 2. MC variables and records
+        for key in ["curchi2", "bestchi2", "bestchi2step", "bestresults", "bestchi2s", "numvisitstore",
+                "StepSizeFactor", "temperature", "lastupdate"]:
+            setattr(self, key, state[key])
+        random.setstate(state["randomstate"])
+        self.history = MonteCarloHistory.loadHistory(historyfilename, state["numrecords"])
+
+        # 3. Drop records written after the checkpoint
+        if os.path.getsize(historyfilename) > state["numrecords"]*MonteCarloHistory.HISTORYDTYPE.itemsize:
+            os.remove(historyfilename)
+            self.history.numsaved = 0
+            self.history.flush(historyfilename)
+
+        print "Resume random walk with seed %d from iteration %d.  Chi2 = %.5E" % (seed, state["iteration"], self.curchi2)
+
+        return state["iteration"]
+
+
+    def writeCheckpoint(self, seed, iteration):
+        """ Append the new history records to the history file and save the state to resume
+        the walk from iteration (the next iteration to walk)
+        """
+        historyfilename, checkpointfilename = MonteCarloHistory.checkpointFileNames(self.checkpointdir, seed)
+        self.history.flush(historyfilename)
+
+        parameters = {}
+        for parname in self.parameternames:
+            parameters[parname] = self.parameterdict[parname].value
+
+        state = {
+                "iteration": iteration,
+                "numrecords": len(self.history),
+                "parameters": parameters,
+                "curchi2": self.curchi2,
+                "bestchi2": self.bestchi2,
+                "bestchi2step": self.bestchi2step,
+                "bestresults": self.bestresults,
+                "bestchi2s": self.bestchi2s,
+                "numvisitstore": self.numvisitstore,
+                "StepSizeFactor": self.StepSizeFactor,
+                "temperature": self.temperature,
+                "lastupdate": self.lastupdate,
+                "randomstate": random.getstate()
+                }
+        MonteCarloHistory.writeCheckpoint(checkpointfilename, state)
+
+        return
+
+
+    def walk(self, seed, startiteration, maxIteration):
+        """ Walk from iteration startiteration to maxIteration (inclusive)
+
+        Return: the next iteration
+        """
         # 3. Start MC random walk
 	iteration = startiteration
         while iteration <= maxIteration:
@@ -865,23 +970,11 @@ class LeBailMonteCarlo:
                 # ENDIF
             # ENDIFELSE
 
-	    self.recordChi2.append(self.curchi2)
-	    self.recordCase.append(case)
-	    self.recordTake.append(acceptnewvalues)
+            self.history.append(iteration, self.curchi2, case, acceptnewvalues)
 
             if acceptnewvalues is True:
                 self.lastupdate = iteration
 
-            # Y. Write temp file to update situation
-            wbuf = "Current Iteration : %d    Last Update:  %d   Random Seed = %d\n" % (iteration, self.lastupdate, seed)
-            maxi = min(11, len(self.recordChi2)+1)
-            for i in xrange(1, maxi): 
-                wbuf += "Iteration %d,  Chi2 = %.5E,  Case = %d, Taken = %s\n" % (iteration+1-i, self.recordChi2[-i], 
-                        self.recordCase[-i], str(self.recordTake[-i]))
-            ofile = open("realtimerecord.txt", "w")
-            ofile.write(wbuf)
-            ofile.close()
-            
             # X. If no update for a certain amount of cycle, i.e., stuck in local min, 
             if iteration-self.lastupdate > _MAXNONUPDATE:
                 # Increase step size by 2.0 and recount
@@ -890,10 +983,20 @@ class LeBailMonteCarlo:
             elif iteration == self.lastupdate and self.StepSizeFactor > 1.0:
                 # If there is change, then move step size factor back to 1.0 
                 self.StepSizeFactor = 1.0
+
+            # Y. Save history and state
+            if self.checkpointinterval > 0 and iteration % self.checkpointinterval == 0:
+                self.writeCheckpoint(seed, iteration+1)
             
             iteration += 1
         # ENDWHILE
 
+        return iteration
+
+
+    def writeWalkResult(self, seed, maxIteration, iteration):
+        """ Print the best results and write the MC history and best parameter files
+        """
         # Process output
         print "\n\n==========  MC Result Until Iteration %d ===============\n" % (iteration)
 	print "Walk %d Steps. Best Chi2 = %f @ Step %d" % (maxIteration, self.bestchi2, self.bestchi2step)
@@ -904,8 +1007,9 @@ class LeBailMonteCarlo:
 
         # MC history file
         wbuf = ""
-        for i in xrange(len(self.recordChi2)):
-            wbuf += "%i\t\t%f\t\t%s\t%d\n" % (i, self.recordChi2[i], self.recordCase[i], self.recordTake[i])
+        records = self.history.array()
+        for i in xrange(len(records)):
+            wbuf += "%i\t\t%f\t\t%s\t%d\n" % (i, records["chi2"][i], records["case"][i], records["take"][i])
         rfilename = "montecarlo_record_seed%s_iter%d.dat" % (seed, iteration)
         rfile = open(rfilename, "w")
         rfile.write(wbuf)
@@ -942,7 +1046,26 @@ class LeBailMonteCarlo:
         pfile.write(wbuf)
         pfile.close()
     
-        return iteration
+        return
+
+
+    def getResult(self, seed, iteration):
+        """ Summarize the walk in a dictionary which can be sent to other processes
+
+        Return: dictionary with seed, bankid, iterations, bestchi2, bestchi2step,
+                bestresults (chi2: (parameters, step)) and history (numpy records of iteration, chi2, case, take)
+        """
+        result = {
+                "seed": seed,
+                "bankid": self.bankid,
+                "iterations": iteration,
+                "bestchi2": self.bestchi2,
+                "bestchi2step": self.bestchi2step,
+                "bestresults": self.bestresults,
+                "history": self.history.array().copy()
+                }
+
+        return result
 
 
     
@@ -1043,7 +1166,7 @@ class LeBailMonteCarlo:
 
 	# 2. MC selection
         deltachi2 = newchi2 - self.curchi2
-        ratio = math.exp(-1.*deltachi2/self.curchi2)
+        ratio = math.exp(-1.*deltachi2/(self.curchi2*self.temperature))
         if ratio > 1.0: 
             errmsg = "Ratio is larger than 1.  Chi2(old) = %f, Chi2(new) = %f!!!, Weird not ruled out in previous filters.  But won't affect result!" % \
                     (self.curchi2, self.newfitchi2) 
@@ -1354,22 +1477,13 @@ class LeBailMonteCarlo:
   
 
 #--------------------------------------------------------------------------
-def main(argv):
-    """ Main
-    """
-    """ ****************   Global Setup  ******************** """
-    if len(argv) < 3:
-        print "%s [Bank ID] [Random Seed] [Max Iteration]" % (argv[0])          
-        return
-
-    else:
-        bankid = int(argv[1])
-        randomseed = int(argv[2])
-        if len(argv) >= 4:
-            maxiteration = int(argv[3])
-        else: 
-            maxiteration = 20
+def createMonteCarlo(bankid, parameterstofit=None):
+    """ Create and initialize the Le Bail Monte Carlo of a bank
 
+    Arguments
+     - bankid           :  bank ID
+     - parameterstofit  :  (blurred) names of parameters to walk; default alph*, beta*, sig*
+    """
     datadict = { 
             1: {"run": 10808},
             2: {"run": 10809},
@@ -1377,17 +1491,10 @@ def main(argv):
             }
 
     runnumber = datadict[bankid]["run"]
-    
-    # bankid = 2
-    # runnumber = 10809
-    
-    parameterstofit = ["alph*", "beta*", "sig*"]
-    curiteration = 0
-    lastiteration = 0
-    
-    """ ****************   Execution  ******************** """
-    globalrecord = []
-    
+
+    if parameterstofit is None:
+        parameterstofit = ["alph*", "beta*", "sig*"]
+
     # 1. Init LeBail
     mc = LeBailMonteCarlo(bankid, runnumber)
     mc.initLeBailFit() 
@@ -1398,37 +1505,71 @@ def main(argv):
     for parname in mc.parametersToFit:
         wbuf += " %s, " % (parname)
     print wbuf
+
+    return mc
+
+
+def runRandomWalk(bankid, randomseed, maxiteration=20, parameterstofit=None, resume=False):
+    """ Run one random walk in the current process
+
+    Arguments
+     - bankid        :  bank ID
+     - randomseed    :  random seed of the walk
+     - maxiteration  :  number of MC iterations
+     - parameterstofit :  (blurred) names of parameters to walk; default alph*, beta*, sig*
+     - resume        :  continue from the last checkpoint of the walk if there is one
+
+    Return: dictionary of LeBailMonteCarlo.getResult() plus walltime and cputime (seconds)
+    """
+    curiteration = 0
+
+    # CPU time of all threads of this process (Mantid algorithms are multi-threaded)
+    starttimes = os.times()
+    startwall = time.time()
+
+    mc = createMonteCarlo(bankid, parameterstofit)
    
     # 3. Random walk 
-    if curiteration == 0:
-        calinitconfig = True
-    else:
-        calinitconfig = False
-    
-    lastieration = curiteration
-    curiteration = mc.randomWalk(randomseed, maxiteration, curiteration)
+    lastiteration = curiteration
+    curiteration = mc.randomWalk(randomseed, maxiteration, curiteration, resume)
     
     if curiteration < 0:
         raise NotImplementedError("No random walk. Starting parameters are too bad. ")
     
-    if lastieration == curiteration:
+    if lastiteration == curiteration:
         raise NotImplementedError("Coding error!")
-    
-    bestchi2 = mc.bestchi2
-    bestchi2step = mc.bestchi2step
-    
-    globalrecord.append( (bestchi2, bestchi2step, lastiteration, curiteration) )
-    
-    
-    # print "---------------------------  Global Result  ------------------------"
-    # index = 0
-    # for tup in globalrecord:
-    #     bc = tup[0]
-    #     bs = tup[1]
-    #     it0 = tup[2]
-    #     itf = tup[3]
-    #     print "Round %d:  Best Chi2 = %.5E   @ Step = %d   Iteration: from %d to %d" % (index, bc, bs, it0, itf)
-    #     index += 1
+
+    endtimes = os.times()
+
+    result = mc.getResult(randomseed, curiteration)
+    result["walltime"] = time.time() - startwall
+    result["cputime"] = (endtimes[0] - starttimes[0]) + (endtimes[1] - starttimes[1])
+
+    return result
+
+
+def main(argv):
+    """ Main
+    """
+    """ ****************   Global Setup  ******************** """
+    if len(argv) < 3:
+        print "%s [Bank ID] [Random Seed] [Max Iteration]" % (argv[0])          
+        return
+
+    else:
+        bankid = int(argv[1])
+        randomseed = int(argv[2])
+        if len(argv) >= 4:
+            maxiteration = int(argv[3])
+        else: 
+            maxiteration = 20
+
+    """ ****************   Execution  ******************** """
+    result = runRandomWalk(bankid, randomseed, maxiteration)
+
+    print "Seed %d:  Best Chi2 = %.5E   @ Step = %d   Iterations = %d   Wall time = %.1f s   CPU time = %.1f s" % (
+            result["seed"], result["bestchi2"], result["bestchi2step"], result["iterations"],
+            result["walltime"], result["cputime"])
 
     return
 
@@ -0,0 +1,202 @@
+################################################################################
+#  Monte Carlo history and checkpoints of the Le Bail Fit random walk
+#  (LeBailRandomWalk_Parallel.py)
+#
+#  - The history (iteration, chi2, case, taken) of a walk is kept in a numpy
+#    record array and appended to a binary file mchistory_seed[SEED].bin at
+#    each checkpoint.  The file is never rewritten.
+#  - The state to resume the walk (current parameters, best results, random
+#    generator state, ...) is written to mccheckpoint_seed[SEED].pkl at each
+#    checkpoint.
+#  - The progress of a running (or crashed) walk can be read with readProgress()
+#    or by running this script:  python MonteCarloHistory.py [Directory] [Seed]
+#
+#  Does not need Mantid, so that it can be used by the post-processing scripts.
+################################################################################
+import os
+import cPickle
+import numpy
+
+HISTORYDTYPE = numpy.dtype([("iteration", "<i4"), ("chi2", "<f8"), ("case", "i1"), ("take", "?")])
+
+
+class MonteCarloHistory:
+    """ Growable record array of the history of a random walk
+    """
+    def __init__(self, capacity=1024):
+        """ Initialization
+        """
+        self.records = numpy.zeros(capacity, dtype=HISTORYDTYPE)
+        self.size = 0
+        # Number of records already written to the history file
+        self.numsaved = 0
+
+        return
+
+    def __len__(self):
+        """ Number of records
+        """
+        return self.size
+
+    def append(self, iteration, chi2, case, taken):
+        """ Append the record of one iteration
+        """
+        if self.size == len(self.records):
+            newrecords = numpy.zeros(2*len(self.records), dtype=HISTORYDTYPE)
+            newrecords[:self.size] = self.records
+            self.records = newrecords
+
+        self.records[self.size] = (iteration, chi2, case, taken)
+        self.size += 1
+
+        return
+
+    def array(self):
+        """ Records as a numpy record array (a view, not a copy)
+        """
+        return self.records[:self.size]
+
+    def last(self, num):
+        """ The last num records, latest first
+        """
+        return self.records[max(0, self.size-num):self.size][::-1]
+
+    def flush(self, historyfilename):
+        """ Append the records not yet saved to the history file
+        """
+        if self.numsaved == self.size:
+            return
+
+        hfile = open(historyfilename, "ab")
+        self.records[self.numsaved:self.size].tofile(hfile)
+        hfile.close()
+        self.numsaved = self.size
+
+        return
+
+
+def checkpointFileNames(directory, seed):
+    """ Return: (history file name, checkpoint file name) of the walk with the seed
+    """
+    historyfilename = os.path.join(directory, "mchistory_seed%d.bin" % (seed))
+    checkpointfilename = os.path.join(directory, "mccheckpoint_seed%d.pkl" % (seed))
+
+    return (historyfilename, checkpointfilename)
+
+
+def loadHistory(historyfilename, numrecords=None):
+    """ Load a history file.  Records beyond numrecords (written after the last
+    checkpoint of a crashed walk) are dropped
+
+    Return: MonteCarloHistory
+    """
+    records = numpy.fromfile(historyfilename, dtype=HISTORYDTYPE)
+    if numrecords is not None:
+        records = records[:numrecords]
+
+    history = MonteCarloHistory(max(1024, len(records)))
+    history.records[:len(records)] = records
+    history.size = len(records)
+    history.numsaved = len(records)
+
+    return history
+
+
+def writeCheckpoint(checkpointfilename, state):
+    """ Write the state dictionary of a walk.  The file is replaced in one step
+    so that a crash does not leave a half written checkpoint
+    """
+    tempfilename = checkpointfilename + ".tmp"
+    cfile = open(tempfilename, "wb")
+    cPickle.dump(state, cfile, cPickle.HIGHEST_PROTOCOL)
+    cfile.close()
+    os.rename(tempfilename, checkpointfilename)
+
+    return
+
+
+def readCheckpoint(checkpointfilename):
+    """ Read the state dictionary of a walk
+
+    Return: dictionary or None if there is no checkpoint
+    """
+    if os.path.exists(checkpointfilename) is False:
+        return None
+
+    cfile = open(checkpointfilename, "rb")
+    state = cPickle.load(cfile)
+    cfile.close()
+
+    return state
+
+
+def readBestParameters(checkpointfilename):
+    """ Best parameters of a walk from its checkpoint in the format of
+    LeBailFitScript_Step6ProcessMCResults.parseBestParameterFile()
+
+    Return: list (sorted by chi2) of dictionaries (parameter/value, plus Chi2 and Step)
+    """
+    state = readCheckpoint(checkpointfilename)
+    if state is None:
+        return []
+
+    parameterdicts = []
+    for chi2 in sorted(state["bestresults"].keys()):
+        simpardict, step = state["bestresults"][chi2]
+        parameterdict = dict(simpardict)
+        parameterdict["Chi2"] = chi2
+        parameterdict["Step"] = float(step)
+        parameterdicts.append(parameterdict)
+
+    return parameterdicts
+
+
+def readProgress(directory, seed, numlast=10):
+    """ Progress of a walk from its checkpoint and history files
+
+    Return: dictionary with iteration (next iteration to walk), lastupdate, curchi2,
+            bestchi2, bestchi2step and last (numpy records of the last iterations, latest first)
+            or None if the walk has no checkpoint
+    """
+    historyfilename, checkpointfilename = checkpointFileNames(directory, seed)
+    state = readCheckpoint(checkpointfilename)
+    if state is None:
+        return None
+
+    progress = {}
+    for key in ["iteration", "lastupdate", "curchi2", "bestchi2", "bestchi2step"]:
+        progress[key] = state[key]
+    history = loadHistory(historyfilename, state["numrecords"])
+    progress["last"] = history.last(numlast)
+
+    return progress
+
+
+def main(argv):
+    """ Main: print the progress of a walk
+    """
+    if len(argv) < 3:
+        print "%s [Directory] [Random Seed]" % (argv[0])
+        return
+
+    directory = argv[1]
+    seed = int(argv[2])
+
+    progress = readProgress(directory, seed)
+    if progress is None:
+        print "No checkpoint for random seed %d in %s" % (seed, directory)
+        return
+
+    print "Current Iteration : %d    Last Update:  %d   Random Seed = %d" % (progress["iteration"]-1,
+            progress["lastupdate"], seed)
+    print "Best Chi2 = %.5E @ Step %d" % (progress["bestchi2"], progress["bestchi2step"])
+    for record in progress["last"]:
+        print "Iteration %d,  Chi2 = %.5E,  Case = %d, Taken = %s" % (record["iteration"], record["chi2"],
+                record["case"], str(record["take"]))
+
+    return
+
+
+if __name__ == "__main__":
+    import sys
+    main(sys.argv)
@@ -1,12 +1,34 @@
+################################################################################
+#  Run the Le Bail Fit random walks of LeBailRandomWalk_Parallel.py for a set
+#  of random seeds on a pool of worker processes.
+#
+#  - Each worker process starts Mantid once and runs its walks in-process via
+#    LeBailRandomWalk_Parallel.runRandomWalk().  Results come back over a queue.
+#  - Every finished walk is appended to the result file straight away.  Seeds
+#    already in the result file are skipped when the script is run again (resume).
+#    Unfinished walks continue from their last checkpoint (see MonteCarloHistory.py).
+#  - Ctrl-C, or creating the cancel file, stops the run.  Finished walks are kept
+#    in the result file and walks in progress keep their last checkpoint.
+#  - CPU utilisation (CPU time of the walks / (wall time x number of processes))
+#    is reported at the end.
+#  - mode = "tempering" runs one replica-exchange (parallel tempering) walk
+#    instead: one walker process per temperature.  After every exchangeinterval
+#    iterations, walkers at neighbouring temperatures swap temperatures with the
+#    Metropolis probability used by LeBailMonteCarlo.makeMCChoice().
+#    The walkers save their checkpoints in temperingcheckpointdir, apart from
+#    those of the independent walks.
+#
+#  To run on a cluster with slurm, submit this script itself, e.g.
+#     srun -p QUEUE --cpus-per-task=20 python RunLeBailFitMCParallel.py
+################################################################################
 import os
 import sys
-import threading
 import time
-sys.path.append("/home/wzz/Mantid/Code/debug/bin")
-
-from MantidFramework import mtd
-mtd.initialise()
-from mantidsimple import *
+import cPickle
+import math
+import random
+import multiprocessing
+import Queue
 
 #************************************************
 bankid = 1
@@ -14,54 +36,332 @@ maxiteration = 10
 seeds = range(0, 20)
 
 max_processes = 20
-slurm_queue_name = None
+resultfilename = "lebailmc_results_bank%d.pkl" % (bankid)
+cancelfilename = "STOP_LEBAILMC"
+
+# "independent": one walk per seed;  "tempering": replica exchange
+mode = "independent"
+# Temperatures of the replica exchange walkers (one process each).  1.0 is the normal walk.
+temperatures = [1.0, 1.5, 2.25, 3.4, 5.1, 7.6]
+exchangeinterval = 2
+temperingseed = 0
+# Checkpoints of the replica exchange walkers.  Not the directory of the independent walks:
+# their seeds overlap and an independent walk would resume from a hot replica
+temperingcheckpointdir = "tempering_checkpoints"
 #************************************************
 
-# slurm_queue_name = VALID_QUEUE_NAME  This option is to run on a cluster with a slurm set up 
 
-import sys
-myscriptname = sys.argv[0]
+def loadResults(resultfilename):
+    """ Load the results of the finished random walks
+
+    Return: dictionary (key = seed, value = result dictionary of runRandomWalk())
+    """
+    results = {}
+    if os.path.exists(resultfilename) is False:
+        return results
+
+    rfile = open(resultfilename, "rb")
+    while True:
+        try:
+            result = cPickle.load(rfile)
+        except EOFError:
+            break
+        except Exception:
+            # Half written record from an interrupted run
+            print "[Warning] Result file %s is truncated.  Ignore the last record." % (resultfilename)
+            break
+        results[result["seed"]] = result
+    # ENDWHILE
+    rfile.close()
+
+    return results
+
+
+def appendResult(resultfilename, result):
+    """ Append the result of one random walk to the result file
+    """
+    rfile = open(resultfilename, "ab")
+    cPickle.dump(result, rfile, cPickle.HIGHEST_PROTOCOL)
+    rfile.close()
+
+    return
+
+
+def walkWorker(taskqueue, resultqueue, bankid, maxiteration):
+    """ Worker process: run random walks until the sentinel (None) is received.
+    The output of the walk of each seed goes to output_seed[SEED].txt
+    """
+    # Mantid is started here, once for all walks of this process
+    import LeBailRandomWalk_Parallel as lbwalk
+
+    while True:
+        seed = taskqueue.get()
+        if seed is None:
+            break
+
+        outputfile = open("output_seed%d.txt" % (seed), "w")
+        stdout = sys.stdout
+        sys.stdout = outputfile
+        try:
+            try:
+                result = lbwalk.runRandomWalk(bankid, seed, maxiteration, resume=True)
+            except Exception, e:
+                print "[Error] Random walk with seed %d failed: %s" % (seed, str(e))
+                result = {"seed": seed, "bankid": bankid, "error": str(e)}
+        finally:
+            sys.stdout = stdout
+            outputfile.close()
+
+        resultqueue.put(result)
+    # ENDWHILE
+
+    return
+
+
+def runWalks(bankid, seeds, maxiteration, numprocesses, resultfilename, cancelfilename=None):
+    """ Run the random walks of the seeds not in the result file yet
+
+    Return: dictionary (key = seed, value = result dictionary) of all finished walks
+    """
+    # 1. Resume
+    results = loadResults(resultfilename)
+    todoseeds = [seed for seed in seeds if results.has_key(seed) is False]
+    print "%d of %d seeds are finished already.  %d to run." % (len(seeds)-len(todoseeds), len(seeds), len(todoseeds))
+    if len(todoseeds) == 0:
+        return results
+
+    # 2. Start workers
+    numprocesses = min(numprocesses, len(todoseeds))
+    taskqueue = multiprocessing.Queue()
+    resultqueue = multiprocessing.Queue()
+    for seed in todoseeds:
+        taskqueue.put(seed)
+    for i in xrange(numprocesses):
+        taskqueue.put(None)
+
+    workers = []
+    for i in xrange(numprocesses):
+        worker = multiprocessing.Process(target=walkWorker, args=(taskqueue, resultqueue, bankid, maxiteration))
+        worker.start()
+        workers.append(worker)
+
+    # 3. Collect results
+    starttime = time.time()
+    cputime = 0.0
+    numdone = 0
+    numfailed = 0
+    cancelled = False
+    try:
+        while numdone < len(todoseeds):
+            if cancelfilename is not None and os.path.exists(cancelfilename):
+                print "Cancel file %s found.  Stop." % (cancelfilename)
+                cancelled = True
+                break
+
+            try:
+                result = resultqueue.get(timeout=1.0)
+            except Queue.Empty:
+                if len([worker for worker in workers if worker.is_alive()]) == 0:
+                    print "[Error] All worker processes exited with %d walks unfinished." % (len(todoseeds)-numdone)
+                    break
+                continue
+
+            numdone += 1
+            if result.has_key("error"):
+                numfailed += 1
+                print "Seed %d failed: %s.  (%d of %d done)" % (result["seed"], result["error"], numdone, len(todoseeds))
+                continue
+
+            appendResult(resultfilename, result)
+            results[result["seed"]] = result
+            cputime += result["cputime"]
+            print "Seed %d: Best Chi2 = %.5E @ Step %d.  Wall = %.1f s, CPU = %.1f s.  (%d of %d done)" % (result["seed"],
+                    result["bestchi2"], result["bestchi2step"], result["walltime"], result["cputime"], numdone, len(todoseeds))
+        # ENDWHILE
+    except KeyboardInterrupt:
+        print "Interrupted.  Stop."
+        cancelled = True
+
+    # 4. Shut down
+    if cancelled is True or numdone < len(todoseeds):
+        for worker in workers:
+            worker.terminate()
+    for worker in workers:
+        worker.join()
+
+    walltime = time.time() - starttime
+    print "Finished %d walks (%d failed) with %d processes in %.1f s." % (numdone-numfailed, numfailed, numprocesses, walltime)
+    if walltime > 0.0:
+        print "CPU time = %.1f s.  CPU utilisation = %.1f%%" % (cputime, 100.0*cputime/(walltime*numprocesses))
+
+    return results
+
+
+def exchangeProbability(chi2a, temperaturea, chi2b, temperatureb):
+    """ Probability to swap the temperatures of two walkers.  As in makeMCChoice() chi2 is
+    measured relative to the current chi2 (here the lower of the two), so that a walker
+    at temperature T accepts a worse chi2 with probability exp(-dchi2/(chi2*T))
+    """
+    chi2ref = min(chi2a, chi2b)
+    if chi2ref <= 0.0:
+        return 1.0
+
+    exponent = (1.0/temperaturea - 1.0/temperatureb) * (chi2a - chi2b)/chi2ref
+    if exponent >= 0.0:
+        return 1.0
+
+    return math.exp(exponent)
+
+
+def temperingWorker(conn, bankid, seed, checkpointdir):
+    """ Worker process of a replica exchange walk.  Its checkpoints go to checkpointdir.
+    Commands received on the pipe:
+     - ("walk", numsteps, temperature):  walk numsteps iterations; reply (curchi2, next iteration)
+     - ("finish", ):  write the result files; reply the result dictionary
+    Errors are replied as ("error", message)
+    """
+    outputfile = open("output_tempering_seed%d.txt" % (seed), "w")
+    sys.stdout = outputfile
+    try:
+        import LeBailRandomWalk_Parallel as lbwalk
+
+        starttimes = os.times()
+        mc = lbwalk.createMonteCarlo(bankid)
+        mc.checkpointdir = checkpointdir
+        mc.startRandomWalk(seed)
+        iteration = 1
+
+        while True:
+            command = conn.recv()
+            if command[0] == "walk":
+                mc.temperature = command[2]
+                iteration = mc.walk(seed, iteration, iteration+command[1]-1)
+                conn.send((mc.curchi2, iteration))
+
+            elif command[0] == "finish":
+                mc.writeWalkResult(seed, iteration-1, iteration)
+                endtimes = os.times()
+                result = mc.getResult(seed, iteration)
+                result["cputime"] = (endtimes[0] - starttimes[0]) + (endtimes[1] - starttimes[1])
+                conn.send(result)
+                break
+        # ENDWHILE
+    except Exception, e:
+        print "[Error] Replica exchange walker with seed %d failed: %s" % (seed, str(e))
+        conn.send(("error", str(e)))
+    finally:
+        sys.stdout = sys.__stdout__
+        outputfile.close()
+
+    return
+
+
+def runTempering(bankid, temperatures, maxiteration, exchangeinterval, seed, cancelfilename=None,
+        checkpointdir=temperingcheckpointdir):
+    """ Run a replica exchange walk with one walker process per temperature.
+    Walker i uses random seed seed+i.  The walkers save their checkpoints in checkpointdir
+
+    Return: list of the result dictionaries of the walkers
+    """
+    numwalkers = len(temperatures)
+    exchangerandom = random.Random(seed)
+
+    # 1. Start walkers
+    temperatures = sorted(temperatures)
+    walkertemperatures = list(temperatures)  # temperature of each walker
+    if os.path.isdir(checkpointdir) is False:
+        os.makedirs(checkpointdir)
+    walkers = []
+    for i in xrange(numwalkers):
+        parentconn, childconn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=temperingWorker, args=(childconn, bankid, seed+i, checkpointdir))
+        process.start()
+        walkers.append((process, parentconn))
+
+    # 2. Walk and exchange
+    starttime = time.time()
+    iteration = 1
+    numtried = 0
+    numswapped = 0
+    failed = False
+    try:
+        while iteration <= maxiteration:
+            if cancelfilename is not None and os.path.exists(cancelfilename):
+                print "Cancel file %s found.  Stop." % (cancelfilename)
+                break
 
-class MyThread(threading.Thread):
+            numsteps = min(exchangeinterval, maxiteration-iteration+1)
+            for i in xrange(numwalkers):
+                walkers[i][1].send(("walk", numsteps, walkertemperatures[i]))
+            chi2s = []
+            for i in xrange(numwalkers):
+                reply = walkers[i][1].recv()
+                if reply[0] == "error":
+                    raise RuntimeError("Walker %d failed: %s" % (i, reply[1]))
+                chi2s.append(reply[0])
+            iteration += numsteps
 
-    def setCommand(self, command=""):
-        self.command = command
+            # Swap temperatures of neighbours, alternating even and odd pairs
+            bytemperature = sorted(xrange(numwalkers), key=lambda i: walkertemperatures[i])
+            for ipair in xrange((iteration/exchangeinterval) % 2, numwalkers-1, 2):
+                walkera = bytemperature[ipair]
+                walkerb = bytemperature[ipair+1]
+                probability = exchangeProbability(chi2s[walkera], walkertemperatures[walkera],
+                        chi2s[walkerb], walkertemperatures[walkerb])
+                numtried += 1
+                if exchangerandom.random() < probability:
+                    numswapped += 1
+                    walkertemperatures[walkera], walkertemperatures[walkerb] = \
+                            walkertemperatures[walkerb], walkertemperatures[walkera]
+            # ENDFOR
 
-    def run(self):
-        # print "STARTING PROCESS: %s" % (self.command)
-        os.system(self.command)
+            coldest = bytemperature[0]
+            print "Iteration %d:  Chi2 (T = %.2f) = %.5E.  Lowest Chi2 = %.5E.  Swaps accepted %d of %d" % (iteration-1,
+                    temperatures[0], chi2s[coldest], min(chi2s), numswapped, numtried)
+        # ENDWHILE
+    except KeyboardInterrupt:
+        print "Interrupted.  Stop."
+        failed = True
+    except RuntimeError, e:
+        print "[Error] %s" % (str(e))
+        failed = True
 
+    # 3. Collect results
+    results = []
+    if failed is False:
+        for process, conn in walkers:
+            conn.send(("finish", ))
+        for process, conn in walkers:
+            result = conn.recv()
+            if isinstance(result, dict):
+                results.append(result)
+    for process, conn in walkers:
+        if failed is True:
+            process.terminate()
+        process.join()
 
-joblist = []
-active_list = []
-script = "LeBailRandomWalk_Parallel.py"
-# script = "testscript.py"
-for seed in seeds:
-    joblist.append( MyThread() )
-    outputfile = "output_seed%d.txt" % (seed)
-    cmd = 'python %s %d %d %d > %s' % (script, bankid, seed, maxiteration, outputfile)
+    walltime = time.time() - starttime
+    cputime = sum([result["cputime"] for result in results])
+    print "Replica exchange with %d walkers finished in %.1f s." % (numwalkers, walltime)
+    if walltime > 0.0 and len(results) > 0:
+        print "CPU time = %.1f s.  CPU utilisation = %.1f%%" % (cputime, 100.0*cputime/(walltime*numwalkers))
 
-    if slurm_queue_name is not None:
-        # This section is for running on a cluster 
-        console_file = "./" + str(seed) + "_output.txt"
-        cmd = "srun -p " + slurm_queue_name + ' --cpus-per-task=3 -J ' + myscriptname + ' -o ' + console_file + ' ' + cmd
-        print cmd
+    return results
 
-    joblist[-1].setCommand(cmd)
 
-all_done = False
-while not all_done:
-    if len(joblist) > 0 and len(active_list) < max_processes:
-        nextthread = joblist.pop(0)
-        active_list.append(nextthread)
-        nextthread.start()
-    time.sleep(0.1)
+if __name__ == "__main__" and mode == "tempering":
+    results = runTempering(bankid, temperatures, maxiteration, exchangeinterval, temperingseed, cancelfilename)
 
-    for thread in active_list:
-        if not thread.isAlive():
-            active_list.remove(thread)
-            print "Remove thread.  Active List Size = %d " % (len(active_list))
+    print "---------------------------  Global Result  ------------------------"
+    for result in sorted(results, key=lambda result: result["bestchi2"]):
+        print "Walker (seed %d):  Best Chi2 = %.5E   @ Step = %d" % (result["seed"], result["bestchi2"],
+                result["bestchi2step"])
 
-    if len(joblist) == 0 and len(active_list) == 0:
-        all_done = True
+elif __name__ == "__main__":
+    results = runWalks(bankid, seeds, maxiteration, max_processes, resultfilename, cancelfilename)
 
+    print "---------------------------  Global Result  ------------------------"
+    for seed in sorted(results.keys()):
+        result = results[seed]
+        print "Seed %d:  Best Chi2 = %.5E   @ Step = %d   Iterations = %d" % (seed, result["bestchi2"],
+                result["bestchi2step"], result["iterations"])
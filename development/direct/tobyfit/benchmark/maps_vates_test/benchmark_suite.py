@@ -0,0 +1,172 @@
+"""
+Timed benchmark of the resolution convolution against the TobyFit (and Horace) calculations of fake_crystal.py.
+
+Each lattice/coordinate case is simulated for every number of Monte Carlo loops and every number of threads
+given, and the wall time, CPU time, peak memory and the accuracy against the reference .sqw files are recorded.
+Every case is run in a new Python process, so that its peak memory does not depend on the cases run before it.
+The results are written as JSON (one record per case) so that runs on different versions can be compared:
+
+    python benchmark_suite.py --mc-loops 10,50,100 --threads 1,4,8 --output results.json
+    python benchmark_suite.py --baseline results_old.json --output results.json
+
+With --baseline the cases that are slower (by more than --time-tolerance), use more memory (by more than
+--memory-tolerance) or are less accurate than in the baseline are reported and the exit status is 1.
+"""
+from mantid.simpleapi import *
+from mantid.api import FrameworkManager
+from mantid.kernel import config
+import mantid
+import fake_crystal
+
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+def set_threads(nthreads):
+    '''Number of threads used by the Mantid algorithms'''
+    config['MultiThreaded.MaxCores'] = str(nthreads)
+    try:
+        FrameworkManager.setNumOMPThreads(nthreads)
+    except AttributeError:
+        pass
+
+def peak_memory_mb():
+    '''Peak resident memory of the process so far, MB (the high-water mark, it never goes down)'''
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return maxrss / (1024. * 1024.)
+    return maxrss / 1024.
+
+def run_case(spe, crystal_system, coord, mc_loops, nthreads, repeat=1, programs=('tobyfit', 'horace')):
+    '''Times the simulation of one case (best of repeat) and compares it with the reference calculations.
+    The peak memory is that of the process, see run_case_process'''
+    set_threads(nthreads)
+    memory_before = peak_memory_mb()
+    params = fake_crystal.simulation_params(crystal_system, mc_loops)
+    walltimes = []
+    cputimes = []
+    for i in range(repeat):
+        start_cpu = sum(os.times()[:4])
+        start = time.time()
+        simul = fake_crystal.simulate_case(spe, params, crystal_system, coord)
+        walltimes.append(time.time() - start)
+        cputimes.append(sum(os.times()[:4]) - start_cpu)
+    record = {'crystal_system': crystal_system, 'coordinate': coord, 'mc_loops': mc_loops,
+              'threads': nthreads, 'repeat': repeat, 'wall_time': min(walltimes),
+              'cpu_time': min(cputimes), 'peak_memory_mb': peak_memory_mb(),
+              'case_memory_mb': peak_memory_mb() - memory_before}
+    for program in programs:
+        if not os.path.exists(fake_crystal.reference_file(crystal_system, coord, program)):
+            continue
+        results = fake_crystal.compare_case(simul, crystal_system, coord, program, keep_mtx=False)
+        record[program] = results
+        record[program + '_max_rel_err'] = max([r['max_rel_err'] for r in results])
+        record[program + '_equal'] = all([r['equal'] for r in results])
+    DeleteWorkspace(simul)
+    return record
+
+def run_case_process(crystal_system, coord, mc_loops, nthreads, repeat=1):
+    '''Runs one case (run_case) in a new Python process and returns its record. peak_memory_mb is then
+    the peak of this case alone (with the loaded data) and case_memory_mb its increase during the case'''
+    handle, output = tempfile.mkstemp(suffix='.json')
+    os.close(handle)
+    try:
+        command = [sys.executable, os.path.abspath(__file__), '--case', '%s,%s,%d,%d' % (crystal_system, coord, mc_loops, nthreads),
+                   '--repeat', str(repeat), '--output', output]
+        status = subprocess.call(command)
+        if status != 0:
+            raise RuntimeError('%s %s, %d MC loops, %d threads failed with exit status %d' % (crystal_system, coord, mc_loops, nthreads, status))
+        record = json.load(open(output))
+    finally:
+        os.remove(output)
+    return record
+
+def case_key(record):
+    return (record['crystal_system'], record['coordinate'], record['mc_loops'], record['threads'])
+
+def compare_with_baseline(records, baseline, time_tolerance, memory_tolerance):
+    '''Lines describing the cases slower, using more memory or less accurate than in the baseline'''
+    previous = dict([(case_key(r), r) for r in baseline['cases']])
+    regressions = []
+    for record in records:
+        old = previous.get(case_key(record))
+        if old is None:
+            continue
+        name = '%s %s, %d MC loops, %d threads' % case_key(record)
+        if record['wall_time'] > old['wall_time'] * (1.0 + time_tolerance):
+            regressions.append('%s: %.2f s, was %.2f s' % (name, record['wall_time'], old['wall_time']))
+        if 'case_memory_mb' in old and record['peak_memory_mb'] > old['peak_memory_mb'] * (1.0 + memory_tolerance):
+            regressions.append('%s: peak memory %.1f MB, was %.1f MB' % (name, record['peak_memory_mb'], old['peak_memory_mb']))
+        for program in ('tobyfit', 'horace'):
+            key = program + '_max_rel_err'
+            if key in record and key in old and record[key] > old[key] and not record[program + '_equal']:
+                regressions.append('%s: max. relative error against %s %.3g, was %.3g' % (name, program, record[key], old[key]))
+    return regressions
+
+def int_list(value):
+    return [int(v) for v in value.split(',')]
+
+def main(argv):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--lattices', default=','.join(sorted(fake_crystal.LATTICES.keys())), help='comma separated crystal systems')
+    parser.add_option('--coordinates', default=','.join(fake_crystal.COORDINATES), help='comma separated Q coordinates (h,k,l)')
+    parser.add_option('--mc-loops', dest='mc_loops', default='10', help='comma separated numbers of Monte Carlo loops')
+    parser.add_option('--threads', default=str(config['MultiThreaded.MaxCores'] or 1), help='comma separated numbers of threads')
+    parser.add_option('--repeat', type='int', default=1, help='time each case REPEAT times and keep the best')
+    parser.add_option('--output', default='tobyfit_benchmark.json', help='JSON file of the results')
+    parser.add_option('--baseline', help='JSON file of previous results to check for regressions')
+    parser.add_option('--time-tolerance', dest='time_tolerance', type='float', default=0.1,
+                      help='relative slow down reported as a regression (default 0.1)')
+    parser.add_option('--memory-tolerance', dest='memory_tolerance', type='float', default=0.1,
+                      help='relative increase of the peak memory reported as a regression (default 0.1)')
+    parser.add_option('--case', help='run the single case LATTICE,COORDINATE,MC_LOOPS,THREADS in this process and write its record to --output')
+    options, args = parser.parse_args(argv[1:])
+
+    if options.case:
+        crystal_system, coord, mc_loops, nthreads = options.case.split(',')
+        start = time.time()
+        spe = fake_crystal.load_spe()
+        setup_time = time.time() - start
+        record = run_case(spe, crystal_system, coord, int(mc_loops), int(nthreads), options.repeat)
+        record['setup_time'] = setup_time
+        output = open(options.output, 'w')
+        json.dump(record, output)
+        output.close()
+        return 0
+
+    records = []
+    for crystal_system in options.lattices.split(','):
+        for coord in options.coordinates.split(','):
+            for mc_loops in int_list(options.mc_loops):
+                for nthreads in int_list(options.threads):
+                    record = run_case_process(crystal_system, coord, mc_loops, nthreads, options.repeat)
+                    records.append(record)
+                    print '%-10s %s  MC loops %4d  threads %2d  wall %8.2f s  cpu %8.2f s  peak memory %8.1f MB  max rel. err %s' % \
+                        (crystal_system, coord, mc_loops, nthreads, record['wall_time'], record['cpu_time'],
+                         record['peak_memory_mb'], record.get('tobyfit_max_rel_err', 'n/a'))
+
+    results = {'mantid_version': mantid.__version__, 'host': socket.gethostname(), 'platform': platform.platform(),
+               'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'cases': records}
+    output = open(options.output, 'w')
+    json.dump(results, output, indent=1, sort_keys=True)
+    output.close()
+    print 'Results written to ' + options.output
+
+    if options.baseline:
+        baseline = json.load(open(options.baseline))
+        regressions = compare_with_baseline(records, baseline, options.time_tolerance, options.memory_tolerance)
+        for line in regressions:
+            print 'REGRESSION ' + line
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
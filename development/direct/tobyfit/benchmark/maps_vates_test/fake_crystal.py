@@ -3,6 +3,7 @@ import tobyfit
 reload(tobyfit)
 
 import math
+import numpy as np
 import os
 import sys
 
@@ -16,6 +17,7 @@ def run_comparision(name, ws1, ws2, rel_errs, keep_mtx=True):
     nbins = 41
     if not hasattr(rel_errs, '__len__'):
         rel_errs = [rel_errs] * 4
+    results = []
     for i in range(4):
         print "Binning dimension %d to %d bins" % (i, nbins)
         as_matrix = to_matrix_ws(ws1,i, nbins)
@@ -24,10 +26,22 @@ def run_comparision(name, ws1, ws2, rel_errs, keep_mtx=True):
         as_matrix = to_matrix_ws(ws2,i, nbins)
         ws2_matrix = RenameWorkspace(as_matrix, OutputWorkspace='ws2_matrix_' + name  + '_' + str(i))
         status = CompareWorkspaces(ws1_matrix, ws2_matrix, Tolerance=rel_errs[i],ToleranceRelErr=True)
+        results.append({'dimension': i, 'equal': bool(status[0]), 'rel_err_tolerance': rel_errs[i],
+                        'max_rel_err': max_relative_difference(ws1_matrix.readY(0), ws2_matrix.readY(0))})
         if not keep_mtx:
             DeleteWorkspace(ws1_matrix)
             DeleteWorkspace(ws2_matrix)
         print 'Dimension %d signals equal (within rel. error of %.3f) = %r'% (i, rel_errs[i], status[0])
+    return results
+
+def max_relative_difference(y1, y2):
+    '''Largest |y1-y2|/|y1| over the bins where y1 is not zero'''
+    y1 = np.asarray(y1)
+    y2 = np.asarray(y2)
+    nonzero = y1 != 0
+    if not nonzero.any():
+        return 0.0
+    return float(np.max(np.abs(y1[nonzero] - y2[nonzero]) / np.abs(y1[nonzero])))
 
 def to_matrix_ws(ws, non_integrated, nbins):
     kwargs = {'AxisAligned': True}
@@ -54,109 +68,94 @@ def to_matrix_ws(ws, non_integrated, nbins):
 #============================================================
 # Reduction
 #============================================================
-# Use same detector parmeters as tobyfit
-parfile_path =  os.path.join(THIS_DIR, '4to1_102.par')
-datfile_path =  os.path.join(THIS_DIR, '4to1_102.dat')
-if not os.path.exists(datfile_path):
-    tobyfit.translate_par_file(parfile_path, datfile_path)
-
-nxs_file = 'map24076_ei50.nxs'
-nxs_filepath = os.path.join(DATA_ETC, nxs_file)
-if os.path.exists(nxs_filepath):
-    if 'spe' in AnalysisDataService:
-        spe = mtd['spe']
+def load_spe():
+    '''The reduced MAPS data, with the TobyFit detector parameters'''
+    # Use same detector parmeters as tobyfit
+    parfile_path =  os.path.join(THIS_DIR, '4to1_102.par')
+    # Only converted again if the content of the .par file changes
+    datfile_path = tobyfit.cached_detector_dat(parfile_path)
+
+    nxs_file = 'map24076_ei50.nxs'
+    nxs_filepath = os.path.join(DATA_ETC, nxs_file)
+    if os.path.exists(nxs_filepath):
+        if 'spe' in AnalysisDataService:
+            spe = mtd['spe']
+        else:
+            spe = LoadNexusProcessed(Filename=nxs_filepath, OutputWorkspace='spe')
     else:
-        spe = LoadNexusProcessed(Filename=nxs_filepath)
-else:
-    reduction_script = os.path.join(DATA_ETC, 'reduction.py')
-    execfile(reduction_script)
-    output_ws = 'converted_to_energy_transfer_ws'
-    spe = RenameWorkspace(output_ws)
-
-    # Preparations to match TobyFit
-    #   - clear mask flags
-    #   - use the same .par file positions
-    #   - convert the data to point data so that we get the same MD boundaries (I suspect ConvertToMD should do this)
-    #   - move the moderator instrument component back to it's IDF position for the the resolution calculation
-    UpdateInstrumentFromFile(spe, Filename=datfile_path,AsciiHeader="spectrum,R,theta,phi")
-    spe = ConvertToPointData(InputWorkspace=spe)
-    base_moderator = spe.getInstrument().getBaseInstrument().getSource()
-    mod_pos = base_moderator.getPos()
-    MoveInstrumentComponent(spe,ComponentName=base_moderator.getName(),X=mod_pos.getX(),
-                            Y=mod_pos.getY(),Z=mod_pos.getZ(),RelativePosition=False)
-    SaveNexusProcessed(InputWorkspace=spe, Filename=nxs_file)
-    DeleteWorkspace('SR_CurrentMasking')
-    DeleteWorkspace('WB_CurrentMasking')
-    DeleteWorkspace('WB_MAP024019_norm_white')
-ClearMaskFlag(spe)
+        reduction_script = os.path.join(DATA_ETC, 'reduction.py')
+        execfile(reduction_script, {})
+        output_ws = 'converted_to_energy_transfer_ws'
+        spe = RenameWorkspace(output_ws, OutputWorkspace='spe')
+
+        # Preparations to match TobyFit
+        #   - clear mask flags
+        #   - use the same .par file positions
+        #   - convert the data to point data so that we get the same MD boundaries (I suspect ConvertToMD should do this)
+        #   - move the moderator instrument component back to it's IDF position for the the resolution calculation
+        UpdateInstrumentFromFile(spe, Filename=datfile_path,AsciiHeader="spectrum,R,theta,phi")
+        spe = ConvertToPointData(InputWorkspace=spe, OutputWorkspace='spe')
+        base_moderator = spe.getInstrument().getBaseInstrument().getSource()
+        mod_pos = base_moderator.getPos()
+        MoveInstrumentComponent(spe,ComponentName=base_moderator.getName(),X=mod_pos.getX(),
+                                Y=mod_pos.getY(),Z=mod_pos.getZ(),RelativePosition=False)
+        SaveNexusProcessed(InputWorkspace=spe, Filename=nxs_file)
+        DeleteWorkspace('SR_CurrentMasking')
+        DeleteWorkspace('WB_CurrentMasking')
+        DeleteWorkspace('WB_MAP024019_norm_white')
+    ClearMaskFlag(spe)
+    return spe
 
 #============================================================
 # Simulation
 #============================================================
-params = {}
-params['ei'] = 50
-params['uvec'] = [0,0,1]
-params['vvec'] = [1,0,0]
-params['psi'] = 0.0
-params['omega'] = 0.0
-params['resolution_params'] = 'MCLoopMin=10,MCLoopMax=10,MCType=1,ForegroundOnly=1'
-params['foreground_model'] = 'QCoordinate'
+# a, b, c, alpha, beta, gamma
+LATTICES = {
+    'cubic': (5., 5., 5., 90.0, 90.0, 90.0),
+    'tetragonal': (3., 3., 10., 90.0, 90.0, 90.0),
+    'hexagonal': (3., 3., 10., 90.0, 90.0, 120.0),
+}
+COORDINATES = ['h', 'k', 'l']
+REL_ERRS = {'h': 1e-3, 'k': [1e-3,1e-3,1e-2,1e-3], 'l': 1e-3}
+
+def simulation_params(crystal_system, mc_loops=10):
+    params = {}
+    params['ei'] = 50
+    params['uvec'] = [0,0,1]
+    params['vvec'] = [1,0,0]
+    params['psi'] = 0.0
+    params['omega'] = 0.0
+    params['resolution_params'] = 'MCLoopMin=%d,MCLoopMax=%d,MCType=1,ForegroundOnly=1' % (mc_loops, mc_loops)
+    params['foreground_model'] = 'QCoordinate'
+    (params['alatt'], params['blatt'], params['clatt'],
+     params['alpha'], params['beta'], params['gamma']) = LATTICES[crystal_system]
+    return params
+
+def reference_file(crystal_system, coord, program='tobyfit'):
+    '''The .sqw file calculated by TobyFit or Horace for the case'''
+    if program == 'horace':
+        return os.path.join(THIS_DIR, 'fake_%s_Horace_%s.sqw' % (crystal_system, coord))
+    return os.path.join(THIS_DIR, 'fake_%s_%s.sqw' % (crystal_system, coord))
+
+def simulate_case(spe, params, crystal_system, coord):
+    params = dict(params)
+    params['foreground_params'] = 'Coord=' + coord.upper()
+    return tobyfit.run_simulation('fake_' + crystal_system + '_' + coord + '_mt', spe, **params)
+
+def compare_case(simul, crystal_system, coord, program='tobyfit', keep_mtx=True):
+    '''Compares the simulation with the TobyFit (or Horace) calculation. Returns the results of run_comparision'''
+    filename = reference_file(crystal_system, coord, program)
+    sqw = tobyfit.load_sqw_cached(filename, OutputWorkspace=os.path.basename(filename), Q3DFrames='Q_lab')
+    return run_comparision(coord, sqw, simul, rel_errs=REL_ERRS[coord], keep_mtx=keep_mtx)
 
 def compare_with_tobyfit(spe, params, crystal_system):
-    # === H ===
-    print 'Comparing %s lattice, Q_H' % crystal_system
-    params['foreground_params'] = 'Coord=H'
-    fake_name = 'fake_' + crystal_system
-    simul = tobyfit.run_simulation(fake_name + '_h_mt', spe, **params)
-    # Load tobyfit comparison
-    filename = fake_name + '_h.sqw'
-    sqw = LoadSQW(os.path.join(THIS_DIR, filename), Q3DFrames='Q_lab', OutputWorkspace=filename)
-    run_comparision('h',sqw, simul, rel_errs=1e-3)
-
-    # === K ===
-    print 'Comparing %s lattice, Q_H' % crystal_system
-    params['foreground_params'] = 'Coord=K'
-    fake_name = 'fake_' + crystal_system
-    simul =  tobyfit.run_simulation(fake_name + '_k_mt', spe, **params)
-    # Load tobyfit comparison
-    filename = fake_name + '_k.sqw'
-    sqw = LoadSQW(os.path.join(THIS_DIR, filename), Q3DFrames='Q_lab', OutputWorkspace=filename)
-    run_comparision('k', sqw, simul, rel_errs=[1e-3,1e-3,1e-2,1e-3])
-
-    # === L ===
-    print 'Comparing %s lattice, Q_H' % crystal_system
-    params['foreground_params'] = 'Coord=L'
-    fake_name = 'fake_' + crystal_system
-    simul = tobyfit.run_simulation(fake_name + '_l_mt', spe, **params)
-    # Load tobyfit comparison
-    filename = fake_name + '_l.sqw'
-    sqw = LoadSQW(os.path.join(THIS_DIR, filename), Q3DFrames='Q_lab', OutputWorkspace=filename)
-    run_comparision('l',sqw, simul, rel_errs=1e-3)
+    for coord in COORDINATES:
+        print 'Comparing %s lattice, Q_%s' % (crystal_system, coord.upper())
+        simul = simulate_case(spe, params, crystal_system, coord)
+        compare_case(simul, crystal_system, coord)
 #end
 
-# ================ CUBIC =================
-params['alatt'] = 5.
-params['blatt'] = 5.
-params['clatt'] = 5.
-params['alpha'] = 90.0
-params['beta'] = 90.0
-params['gamma'] = 90.0
-compare_with_tobyfit(spe, params, 'cubic')
-
-# ============== TETRAGONAL =================
-params['alatt'] = 3.
-params['blatt'] = 3.
-params['clatt'] = 10.
-params['alpha'] = 90.0
-params['beta'] = 90.0
-params['gamma'] = 90.0
-compare_with_tobyfit(spe, params, 'tetragonal')
-
-# ============== HEXAGONAL =================
-params['alatt'] = 3.
-params['blatt'] = 3.
-params['clatt'] = 10.
-params['alpha'] = 90.0
-params['beta'] = 90.0
-params['gamma'] = 120.0
-compare_with_tobyfit(spe, params, 'hexagonal')
\ No newline at end of file
+if __name__ == '__main__':
+    spe = load_spe()
+    for crystal_system in ['cubic', 'tetragonal', 'hexagonal']:
+        compare_with_tobyfit(spe, simulation_params(crystal_system), crystal_system)
@@ -3,8 +3,29 @@ import mantid
 from mantid.kernel import funcreturns as _funcreturns
 from mantid.simpleapi import *
 
+import hashlib
+import numpy as np
+import os
+
 RESOLUTION_MODEL = 'TobyFitResolutionModel'
 
+# Converted detector files and loaded SQW files are kept here, named by the hash of the original file
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.tobyfit_cache')
+
+# Name of the workspace of each loaded SQW file hash. Kept over reload(tobyfit) so that workspaces
+# still in the ADS are not loaded again
+try:
+    _sqw_workspaces
+except NameError:
+    _sqw_workspaces = {}
+
+# md5 of the files hashed in this session, keyed by (path, size, modification time), so that a
+# multi-GB .sqw file is only read through once per session
+try:
+    _file_hashes
+except NameError:
+    _file_hashes = {}
+
 def run_simulation(fake_name, spe, **params):
     # Use the name of the variable that this function is assigned to as the output name
     output_workspace = fake_name
@@ -49,19 +70,99 @@ def run_simulation(fake_name, spe, **params):
     return simulated
 # --------------------------------------------------------------------------------------------------------------------------
 
-def translate_par_file(parfile_in, detector_dat):
-    '''Translates a TobyFit .par file to a format Mantid can understand
+def file_hash(filename):
+    '''md5 of the whole content of a file, computed once per session for each size and modification time'''
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime)
+    if key not in _file_hashes:
+        md5 = hashlib.md5()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), ''):
+                md5.update(block)
+        _file_hashes[key] = md5.hexdigest()
+    return _file_hashes[key]
+
+def _cache_path(filename, extension, digest=None):
+    '''Path in CACHE_DIR for the converted content of filename'''
+    if digest is None:
+        digest = file_hash(filename)
+    if not os.path.isdir(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(CACHE_DIR, '%s_%s%s' % (stem, digest, extension))
+
+def read_detector_file(filename, r=None):
+    '''Reads a TobyFit .par or .phx file into an (ndet, 6) array with the .par columns
+    R,theta,-phi,width,height,spectrum. The array is cached as .npy so that the text is only parsed once.
+    A .phx file (columns: -,-,theta,-phi,dtheta,dphi,spectrum) has no distances, they are set to r
+    '''
+    is_phx = filename.lower().endswith('.phx')
+    digest = file_hash(filename)
+    if is_phx:
+        digest += '_r%s' % r
+    cached = _cache_path(filename, '.npy', digest)
+    if os.path.exists(cached):
+        return np.load(cached)
+    # First line is the number of detectors
+    columns = np.loadtxt(filename, skiprows=1, ndmin=2)
+    if is_phx:
+        if r is None:
+            raise ValueError("A sample-detector distance is required to convert the .phx file " + filename)
+        detectors = np.empty((columns.shape[0], 6))
+        detectors[:,0] = r
+        detectors[:,1:6] = columns[:,2:7]
+    else:
+        detectors = columns[:,:6]
+    np.save(cached, detectors)
+    return detectors
+
+def write_detector_dat(detectors, detector_dat):
+    '''Writes the detectors array of read_detector_file in the format of UpdateInstrumentFromFile
+    with AsciiHeader="spectrum,R,theta,phi"
+    '''
+    table = np.column_stack((detectors[:,5], detectors[:,0], detectors[:,1], -detectors[:,2]))
+    np.savetxt(detector_dat, table, fmt="%d  %.4f    %.4f    %.4f")
+
+def translate_par_file(parfile_in, detector_dat, r=None):
+    '''Translates a TobyFit .par (or .phx, see read_detector_file) file to a format Mantid can understand
     TobyFit columns: R,theta,-phi,-,-,spectrum
     First line is skipped
     '''
-    parfile = open(parfile_in, 'r')
-    datfile = open(detector_dat, 'w')
-    for line in parfile:
-        columns = line.split()
-        if len(columns) != 6:
-            continue
-        spectrum = columns[5]
-        r, theta, neg_phi = columns[:3]
-        datfile.write("%s  %s    %s    %.4f\n" % (spectrum, r, theta, -float(neg_phi)))
+    write_detector_dat(read_detector_file(parfile_in, r), detector_dat)
+
+def cached_detector_dat(parfile_in, r=None):
+    '''Path of the translation of the .par/.phx file to a Mantid detector file, converted only if the
+    content of the .par/.phx file has not been converted before
+    '''
+    digest = file_hash(parfile_in)
+    if r is not None:
+        digest += '_r%s' % r
+    detector_dat = _cache_path(parfile_in, '.dat', digest)
+    if not os.path.exists(detector_dat):
+        translate_par_file(parfile_in, detector_dat + '.tmp', r)
+        os.rename(detector_dat + '.tmp', detector_dat)
+    return detector_dat
+
+def load_sqw_cached(filename, OutputWorkspace, **kwargs):
+    '''LoadSQW that only loads a given .sqw content once: the workspace is reused while it is in the ADS,
+    and saved with SaveMD in CACHE_DIR to be loaded with LoadMD in later sessions
+    '''
+    digest = file_hash(filename) + '_' + '_'.join('%s=%s' % item for item in sorted(kwargs.items()))
+    digest = hashlib.md5(digest).hexdigest()
+    name = _sqw_workspaces.get(digest)
+    if name is not None and name in mtd:
+        if name != OutputWorkspace:
+            return CloneMDWorkspace(InputWorkspace=name, OutputWorkspace=OutputWorkspace)
+        return mtd[name]
+    cached = _cache_path(filename, '.nxs', digest)
+    if os.path.exists(cached):
+        sqw = LoadMD(Filename=cached, OutputWorkspace=OutputWorkspace)
+    else:
+        sqw = LoadSQW(Filename=filename, OutputWorkspace=OutputWorkspace, **kwargs)
+        SaveMD(InputWorkspace=sqw, Filename=cached + '.tmp')
+        os.rename(cached + '.tmp', cached)
+    _sqw_workspaces[digest] = OutputWorkspace
+    return sqw
     
 # --------------------------------------------------------------------------------------------------------------------------
@@ -19,6 +19,9 @@ fit_options = ncs.FitOptions()
 fit_options.smooth_points = None
 fit_options.bad_data_error = 1e6
 fit_options.background_order = None # None to switch off
+# Compute the reduced chi-squared from the constrained fit rather than running a
+# second unconstrained fit. Parameter errors then come from the constrained fit
+fit_options.fast_chisq = False
 
 # Mass options
 mass1 = {'value':1.0079, 'widths':[2,5,7], 'function':'GramCharlier',
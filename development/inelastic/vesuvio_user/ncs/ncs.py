@@ -13,6 +13,10 @@ if mantid.__gui__:
 
 MTD_VER3 = (mantid.__version__[0] == "3")
 
+# (input workspace, name of the copy) of the copies of the input data with the TOF axis
+# in seconds, keyed on the name of the input workspace
+_seconds_views = {}
+
 #----------------------------------------------------------------------------------------
 def preprocess(data_ws, options):
     """Runs a set of preprocessing steps on the workspace
@@ -36,6 +40,9 @@ def preprocess(data_ws, options):
     if options.has_been_set("bad_data_error"):
         mask_data(data_ws, options.bad_data_error)
 
+    # The data may have changed so any copy in seconds is out of date
+    clear_seconds_cache(data_ws)
+
     return data_ws
 
 #----------------------------------------------------------------------------------------
@@ -138,6 +145,7 @@ def _run_fit_impl(data_ws, fit_options, simulation=False):
     from mantid.simpleapi import RenameWorkspace, mtd
 
     _display_info(fit_options,simulation)
+    fast_chisq = fit_options.fast_chisq and not simulation
 
     if simulation:
         # Just set what we have been given
@@ -149,15 +157,22 @@ def _run_fit_impl(data_ws, fit_options, simulation=False):
         function_str = fit_options.create_function_str()
         constraints = fit_options.create_constraints_str()
         ties = fit_options.create_ties_str()
-        _do_fit(function_str, data_ws, fit_options.workspace_index, constraints, ties, max_iter=5000)
+        _do_fit(function_str, data_ws, fit_options.workspace_index, constraints, ties, max_iter=5000,
+                rescale_output=fast_chisq)
 
         #### Run second time using standard CompositeFunction & no constraints matrix to
         #### calculate correct reduced chisq ####
         param_values = mtd["__fit_Parameters"]
 
-    function_str = fit_options.create_function_str(param_values)
-    max_iter = 0 if simulation else 1
-    reduced_chi_square = _do_fit(function_str, data_ws, fit_options.workspace_index, constraints, ties, max_iter=max_iter)
+    if not fast_chisq:
+        function_str = fit_options.create_function_str(param_values)
+        max_iter = 0 if simulation else 1
+        reduced_chi_square = _do_fit(function_str, data_ws, fit_options.workspace_index, constraints, ties, max_iter=max_iter)
+    else:
+        #### The calculated spectrum of the constrained fit is the composite evaluated at the
+        #### fitted parameters so compute the reduced chisq directly from it ####
+        reduced_chi_square = _reduced_chi_square(data_ws, fit_options.workspace_index,
+                                                 mtd["__fit_Workspace"], param_values, ties)
 
     ws_prefix = "__fit"
     fit_suffixes = ('_Parameters','_NormalisedCovarianceMatrix','_Workspace')
@@ -168,30 +183,117 @@ def _run_fit_impl(data_ws, fit_options, simulation=False):
 
 #----------------------------------------------------------------------------------------
 
-def _do_fit(function_str, data_ws, index, constraints, ties, max_iter):
+def _reduced_chi_square(data_ws, index, fit_ws, params_ws, ties):
+    """
+        Computes the reduced chi-squared of a fit in the same way as the Fit algorithm
+        with all parameters, other than those tied, free.
+        The cost function value in the parameter table is updated to match.
+        @param data_ws :: The workspace containing the data that was fitted
+        @param index :: The workspace index that was fitted
+        @param fit_ws :: The output workspace from Fit. Spectrum 1 holds the calculated values
+        @param params_ws :: The parameter table from Fit
+        @param ties :: The string of ties used for the fit
+        @returns The reduced chi-squared
+    """
+    observed = np.array(data_ws.readY(index))
+    errors = np.array(data_ws.readE(index))
+    calculated = np.array(fit_ws.readY(1))
+
+    # Fit uses a weight of 1 for points with no error and ignores masked bins
+    weights = np.ones(len(observed))
+    has_error = errors > 0.0
+    weights[has_error] = 1.0/errors[has_error]
+    if data_ws.hasMaskedBins(index):
+        weights[list(data_ws.maskedBinsIndices(index))] = 0.0
+
+    chi_square = np.sum(((observed - calculated)*weights)**2)
+
+    param_names = params_ws.column('Name')
+    cost_function_row = param_names.index("Cost function value")
+    nties = len([tie for tie in ties.split(",") if tie != ""]) if ties else 0
+    nparams = len(param_names) - 1 - nties
+    degrees_of_freedom = np.count_nonzero(weights) - nparams
+    if degrees_of_freedom <= 0:
+        raise RuntimeError("Not enough data points (%d) to compute chi-squared for %d free parameters"
+                           % (np.count_nonzero(weights), nparams))
+
+    reduced_chi_square = chi_square/degrees_of_freedom
+    params_ws.setCell('Value', cost_function_row, reduced_chi_square)
+    return reduced_chi_square
+
+#----------------------------------------------------------------------------------------
+
+def _do_fit(function_str, data_ws, index, constraints, ties, max_iter, rescale_output=True):
+    """
+        Run a single Fit against the given spectrum
+        @param rescale_output :: If true the fitted workspace is put back in microseconds.
+                                 Set to false when the output is about to be replaced
+    """
     from mantid.simpleapi import Fit, ScaleX
 
-    # From mantid 3 onwards the tof data is required to be in seconds for the fitting
-    # in order to re-use the standard Mantid Polynomial function. This polynomial simply
-    # accepts the data "as is" in the workspace so if it is in microseconds then the
-    # we would have to either implement a another wrapper to translate or write another
-    # Polynomial.
-    # The simplest option is to put the data in seconds here and then put it back afterward
-    if MTD_VER3:
-        ScaleX(InputWorkspace=data_ws,OutputWorkspace=data_ws,Operation='Multiply',Factor=1e-06)
+    fit_data = seconds_view(data_ws)
 
-    results = Fit(function_str,data_ws,WorkspaceIndex=index,Ties=ties,Constraints=constraints,Output="__fit",
+    results = Fit(function_str,fit_data,WorkspaceIndex=index,Ties=ties,Constraints=constraints,Output="__fit",
                   CreateOutput=True,OutputCompositeMembers=True,MaxIterations=max_iter,
                   Minimizer="Levenberg-Marquardt,AbsError=1e-08,RelError=1e-08")
 
-    if MTD_VER3:
+    if MTD_VER3 and rescale_output:
         ScaleX(InputWorkspace='__fit_Workspace',OutputWorkspace='__fit_Workspace',Operation='Multiply',Factor=1e06)
-        ScaleX(InputWorkspace=data_ws,OutputWorkspace=data_ws,Operation='Multiply',Factor=1e06)
 
     return results[1] # reduced chi-squared
 
 #----------------------------------------------------------------------------------------
 
+def seconds_view(data_ws):
+    """
+        Returns the data to pass to Fit. From mantid 3 onwards the tof data is required
+        to be in seconds for the fitting in order to re-use the standard Mantid Polynomial
+        function. This polynomial simply accepts the data "as is" in the workspace so if it
+        is in microseconds then we would have to either implement a another wrapper to
+        translate or write another Polynomial.
+        A copy in seconds is created the first time a workspace is seen and reused by every
+        subsequent fit against the same workspace object, including fits of other spectra in it.
+        A different workspace under the same name (e.g. another run loaded) gets a new copy.
+        Call clear_seconds_cache if the data in the workspace object is changed in place.
+        @param data_ws :: The workspace containing the data in microseconds
+        @returns The workspace to fit against
+    """
+    if not MTD_VER3:
+        return data_ws
+    from mantid.simpleapi import ScaleX, mtd
+
+    name = str(data_ws)
+    cached_ws, view_name = _seconds_views.get(name, (None, None))
+    # The copy is only valid for the workspace object it was made from, the name may
+    # have been reused for other data
+    if cached_ws is data_ws and mtd.doesExist(view_name):
+        return mtd[view_name]
+
+    view_name = "__" + name + "_seconds"
+    view_ws = ScaleX(InputWorkspace=data_ws,OutputWorkspace=view_name,Operation='Multiply',Factor=1e-06)
+    _seconds_views[name] = (data_ws, view_name)
+    return view_ws
+
+#----------------------------------------------------------------------------------------
+
+def clear_seconds_cache(data_ws=None):
+    """
+        Removes the cached copies of the data in seconds
+        @param data_ws :: Only remove the copy for this workspace. If None then all are removed
+    """
+    from mantid.simpleapi import DeleteWorkspace, mtd
+
+    if data_ws is None:
+        names = _seconds_views.keys()
+    else:
+        names = [str(data_ws)]
+    for name in names:
+        cached_ws, view_name = _seconds_views.pop(name, (None, None))
+        if view_name is not None and mtd.doesExist(view_name):
+            DeleteWorkspace(view_name)
+
+#----------------------------------------------------------------------------------------
+
 def _run_global_fit_impl(data_ws, fit_options, simulation=False):
     """
         Run the Fit algorithm with the given options on the input data
@@ -232,14 +334,7 @@ def _run_global_fit_impl(data_ws, fit_options, simulation=False):
 def _do_global_fit(function_str, data_ws, max_iter):
     from mantid.simpleapi import Fit, ScaleX
 
-    # From mantid 3 onwards the tof data is required to be in seconds for the fitting
-    # in order to re-use the standard Mantid Polynomial function. This polynomial simply
-    # accepts the data "as is" in the workspace so if it is in microseconds then the
-    # we would have to either implement a another wrapper to translate or write another
-    # Polynomial.
-    # The simplest option is to put the data in seconds here and then put it back afterward
-    if MTD_VER3:
-        ScaleX(InputWorkspace=data_ws,OutputWorkspace=data_ws,Operation='Multiply',Factor=1e-06)
+    fit_data = seconds_view(data_ws)
 
     nspec = data_ws.getNumberHistograms()
     # no need to output the calc workspaces after the constrained fit, only parameters
@@ -257,20 +352,34 @@ def _do_global_fit(function_str, data_ws, max_iter):
         kwargs['OutputParametersOnly'] = True
 
     for i in range(1,nspec):
-        kwargs['InputWorkspace_' + str(i)] = data_ws
+        kwargs['InputWorkspace_' + str(i)] = fit_data
         kwargs['WorkspaceIndex_' + str(i)] = i
 
-    results = Fit( function_str, data_ws, **kwargs )
+    results = Fit( function_str, fit_data, **kwargs )
 
-    if MTD_VER3:
-        ScaleX(InputWorkspace=data_ws,OutputWorkspace=data_ws,Operation='Multiply',Factor=1e06)
-        if not output_params_only:
-            for i in range(0,nspec):
-                ws_name = 'fit_Workspace_%s' % i
-                ScaleX(InputWorkspace=ws_name,OutputWorkspace=ws_name,Operation='Multiply',Factor=1e06)
+    # Only the calculated workspaces need to go back to microseconds
+    if MTD_VER3 and not output_params_only:
+        for i in range(0,nspec):
+            ws_name = 'fit_Workspace_%s' % i
+            ScaleX(InputWorkspace=ws_name,OutputWorkspace=ws_name,Operation='Multiply',Factor=1e06)
 
     return results[1] # reduced chi-squared
 
+#----------------------------------------------------------------------------------------
+
+def _freeze(value):
+    """Converts nested dictionaries and sequences to tuples so that they
+    can be used as a key in a dictionary
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(val)) for key, val in value.iteritems()))
+    elif isinstance(value, (list, tuple)):
+        return tuple(_freeze(val) for val in value)
+    elif isinstance(value, np.ndarray):
+        return _freeze(value.tolist())
+    else:
+        return value
+
 #----------------------------------------------------------------------------------------
 class FitOptions(object):
     """Holds all of the parameters for the reduction & fit"""
@@ -279,6 +388,13 @@ class FitOptions(object):
     _options = {}
     # Defaults
     _defaults = {}
+    # Strings already built for the current function definition
+    _cache = {}
+    # Options that define the fit function. Changing any of these invalidates the cache
+    _function_options = ("background_function", "background_order", "masses",
+                         "constraints", "global_fit")
+    # Maximum number of strings held before the cache is emptied
+    _max_cached = 512
 
     def __init__(self):
         options = {
@@ -291,12 +407,14 @@ class FitOptions(object):
           "workspace_index":None,
           "output_prefix":None,
           "global_fit": False,
+          "fast_chisq": False,
         }
         object.__setattr__(self, "_options", options)
         defaults = {
             "background_function":"Polynomial"
         }
         object.__setattr__(self, "_defaults", defaults)
+        object.__setattr__(self, "_cache", {})
 
     def has_been_set(self, name):
         """Returns true if the given option has been set by the user
@@ -342,8 +460,69 @@ class FitOptions(object):
         return param_values
 
 #-------------------------------------------------------------------------------------------------------------
+# The strings are rebuilt for every spectrum and iteration so they are cached on the
+# definition of the masses and the parameter values
+
+    def _cached(self, key, builder):
+        """Returns the string stored for key, calling builder() to create it if required.
+        The mass definitions are part of the key as they can be modified in place
+        """
+        key = (key, _freeze(self.masses), _freeze(self.constraints))
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        if len(self._cache) >= self._max_cached:
+            self._cache.clear()
+        value = builder()
+        self._cache[key] = value
+        return value
+
+    def _param_values_key(self, param_values):
+        """Returns a hashable key for a dict/tableworkspace of parameter values"""
+        if param_values is None:
+            return None
+        elif isinstance(param_values, mantid.api.ITableWorkspace):
+            return tuple((row['Name'], row['Value']) for row in param_values)
+        else:
+            return _freeze(param_values)
 
     def create_function_str(self, param_values=None):
+        """
+            Creates the function string to pass to fit. See _create_function_str
+        """
+        key = ("function", self._param_values_key(param_values))
+        return self._cached(key, lambda: self._create_function_str(param_values))
+
+    def create_gram_charlier_function(self, mass_info, all_free, param_values, par_value_prefix):
+        """
+            Returns the GramCharlierComptonProfile function string for a mass.
+            See _create_gram_charlier_function
+        """
+        key = ("gram_charlier", _freeze(mass_info), all_free,
+               self._param_values_key(param_values), par_value_prefix)
+        return self._cached(key, lambda: self._create_gram_charlier_function(mass_info, all_free,
+                                                                             param_values, par_value_prefix))
+
+    def create_constraints_str(self):
+        """Returns the string of constraints for this Fit
+        """
+        return self._cached(("constraints",), self._create_constraints_str)
+
+    def create_ties_str(self):
+        """Returns the string of ties for this Fit
+        """
+        return self._cached(("ties",), self._create_ties_str)
+
+    def create_global_function_str(self, n, param_values=None):
+        """
+            Creates the function string to pass to fit for a multi-dataset (global) fitting.
+            See _create_global_function_str
+        """
+        key = ("global_function", n, self._param_values_key(param_values))
+        return self._cached(key, lambda: self._create_global_function_str(n, param_values))
+
+    def _create_function_str(self, param_values=None):
         """
             Creates the function string to pass to fit
 
@@ -428,7 +607,7 @@ class FitOptions(object):
 
         return function_str.rstrip(";")
 
-    def create_gram_charlier_function(self, mass_info, all_free, param_values, par_value_prefix):
+    def _create_gram_charlier_function(self, mass_info, all_free, param_values, par_value_prefix):
         """
         Adds a GramCharlierComptonProfile to the function str and returns
         the updated version
@@ -494,7 +673,7 @@ class FitOptions(object):
         matrix_str = matrix_str % (nrows, ncols, values)
         return matrix_str
 
-    def create_constraints_str(self):
+    def _create_constraints_str(self):
         """Returns the string of constraints for this Fit
         """
         constraints = ""
@@ -508,7 +687,7 @@ class FitOptions(object):
 
         return constraints.rstrip(",")
 
-    def create_ties_str(self):
+    def _create_ties_str(self):
         """Returns the string of ties for this Fit
         """
 
@@ -544,7 +723,7 @@ class FitOptions(object):
 
         return ties.rstrip(",")
 
-    def create_global_function_str(self, n, param_values=None):
+    def _create_global_function_str(self, n, param_values=None):
         """
             Creates the function string to pass to fit for a multi-dataset (global) fitting
 
@@ -597,6 +776,8 @@ class FitOptions(object):
                     and (len(value) > 0 and not hasattr(value[0], "__len")):
                     value = (value,) # note trailing comma
             self._options[name] = value
+            if name in self._function_options:
+                self._cache.clear()
         else:
             raise AttributeError("Unknown attribute %s. "
                             "Allowed names (%s)" % (name, str(self._options.keys())))
@@ -225,6 +225,22 @@ Scatt. int. (area, normalised) = 0.030257 +/- 0.010815
         ]
         self._check_params(params_ws,expected)
 
+#=============================================================================================================
+
+    def test_fast_chisq_matches_chisq_from_second_fit(self):
+        fit_options = self._setup_fit_options()
+        raw_ws = mtd['raw_ws']
+        raw_ws = ncs.preprocess(raw_ws, fit_options)
+        reduced_chi_square, params_ws = ncs.run_fit(raw_ws, fit_options)
+
+        fit_options.fast_chisq = True
+        fast_chi_square, fast_params_ws = ncs.run_fit(raw_ws, fit_options)
+
+        self.assertAlmostEqual(reduced_chi_square, fast_chi_square, places=2)
+        cost_function_row = fast_params_ws.column('Name').index("Cost function value")
+        self.assertAlmostEqual(fast_chi_square, fast_params_ws.row(cost_function_row)['Value'], places=8)
+        self.assertAlmostEqual(3.9527823429702624, fast_params_ws.row(0)["Value"], places=2)
+
     def _setup_fit_options(self):
         fit_options = ncs.FitOptions()
         fit_options.workspace_index = 0
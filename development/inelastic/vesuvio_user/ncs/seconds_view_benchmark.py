@@ -0,0 +1,47 @@
+"""
+Measures the per-spectrum overhead of putting the TOF data into seconds for fitting.
+
+Before: every fit called ScaleX on the whole input workspace to put it into seconds
+and again afterwards to put it back, so each spectrum paid for two copies of all of
+the data for each of the two fits.
+After: ncs.seconds_view creates one copy in seconds for the workspace and reuses it.
+"""
+from mantid.simpleapi import *
+import ncs
+
+import time
+
+runs = "15039-15045"
+spectra = "3-198"
+diff_type="SingleDifference" # Allowed values=Single,Double,Thick
+ip_file = "IP0004_10.par"
+# Number of fits per spectrum in ncs.run_fit (constrained fit + chi-squared refit)
+fits_per_spectrum = 2
+
+tof_data = LoadVesuvio(Filename=runs, SpectrumList=spectra,
+                       Mode=diff_type,InstrumentParFile=ip_file)
+tof_data = CropWorkspace(tof_data,XMin=50.0,XMax=562.0)
+nspec = tof_data.getNumberHistograms()
+
+## Before: ScaleX round trip on the whole workspace for every fit ##
+start = time.time()
+for idx in range(nspec):
+    for _ in range(fits_per_spectrum):
+        ScaleX(InputWorkspace=tof_data,OutputWorkspace=tof_data,Operation='Multiply',Factor=1e-06)
+        ScaleX(InputWorkspace=tof_data,OutputWorkspace=tof_data,Operation='Multiply',Factor=1e06)
+before = (time.time() - start)/nspec
+
+## After: cached copy in seconds ##
+ncs.clear_seconds_cache()
+start = time.time()
+for idx in range(nspec):
+    for _ in range(fits_per_spectrum):
+        ncs.seconds_view(tof_data)
+after = (time.time() - start)/nspec
+ncs.clear_seconds_cache()
+
+print "Spectra: %d, bins per spectrum: %d" % (nspec, tof_data.blocksize())
+print "Unit conversion overhead per spectrum before: %f ms" % (1000.*before)
+print "Unit conversion overhead per spectrum after:  %f ms" % (1000.*after)
+if after > 0.0:
+    print "Speed up: %.1fx" % (before/after)
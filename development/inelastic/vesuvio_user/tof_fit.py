@@ -132,6 +132,11 @@ flags['max_fit_iterations'] = 5000
 # Configuration of the minimizer to use in fitting
 flags['fit_minimizer'] = 'Levenberg-Marquardt,AbsError=1e-08,RelError=1e-08'
 
+# Number of worker processes used to fit the spectra. Each spectrum is fitted
+# independently so they can be spread across the available cores.
+# Set to 1 to fit in this process or None to use every available core
+flags['num_workers'] = 1
+
 # Number of iterations to perform of the corrections and fitting workflow
 # Each new iteration used the previous fitted parameters as the starting parameters
 flags['iterations'] = 1
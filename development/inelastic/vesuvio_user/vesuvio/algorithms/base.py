@@ -47,4 +47,7 @@ class TableWorkspaceDictionaryFacade(object):
 
         return False
 
+    def items(self):
+        return [(row['Name'], row['Value']) for row in self._table_ws]
+
 # -----------------------------------------------------------------------------------------
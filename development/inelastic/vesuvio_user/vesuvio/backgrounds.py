@@ -2,6 +2,8 @@
 """
 import ast
 
+from caching import cached, freeze
+
 # --------------------------------------------------------------------------------
 # Background
 # --------------------------------------------------------------------------------
@@ -42,12 +44,21 @@ class PolynomialBackground(object):
         return PolynomialBackground(order=poly_order)
 
     def create_fit_function_str(self, param_vals=None, param_prefix=""):
-        """Creates a string used by the Fit algorithm for this function
+        """Creates a string used by the Fit algorithm for this function. The string
+        is cached on the order and the values of the parameters
 
         :param param_vals: A table of values for the parameters that override those set
         on the object already. Default=None
         :param param_prefix: A string prefix for the parameter name in the params_vals list
         """
+        if param_vals is None:
+            vals_key = None
+        else:
+            vals_key = tuple(item for item in freeze(param_vals) if item[0].startswith(param_prefix))
+        key = ("background", freeze(self), vals_key, param_prefix)
+        return cached(key, lambda: self._create_fit_function_str(param_vals, param_prefix))
+
+    def _create_fit_function_str(self, param_vals=None, param_prefix=""):
         vals_provided = (param_vals is not None)
         func_str = "name={0},n={1}".format(self.cfunction, str(self.order))
 
@@ -0,0 +1,56 @@
+"""Caches the strings built for the fitting algorithms.
+
+The fitting options and profiles are recreated from the algorithm properties for
+every spectrum so the strings are cached on the content of the definitions and
+parameter values rather than on the objects themselves.
+"""
+
+# Maximum number of entries held before the cache is emptied
+MAX_ENTRIES = 512
+
+_CACHE = {}
+
+# --------------------------------------------------------------------------------
+# Functions
+# --------------------------------------------------------------------------------
+
+def cached(key, builder):
+    """Returns the value stored for the key, calling builder() to create it
+    if it is not yet stored
+
+    :param key: A hashable key, see freeze()
+    :param builder: A callable taking no arguments that creates the value
+    """
+    try:
+        return _CACHE[key]
+    except KeyError:
+        pass
+
+    if len(_CACHE) >= MAX_ENTRIES:
+        _CACHE.clear()
+    value = builder()
+    _CACHE[key] = value
+    return value
+
+def clear():
+    """Removes everything from the cache"""
+    _CACHE.clear()
+
+def freeze(value):
+    """Converts a value to a hashable form so it can be used in a cache key.
+    Dictionaries (or anything with items()), sequences and the attributes
+    of objects are converted recursively
+
+    :param value: The value to convert
+    """
+    if hasattr(value, "items"):
+        return tuple(sorted((key, freeze(val)) for key, val in value.items()))
+    elif isinstance(value, (list, tuple)):
+        return tuple(freeze(val) for val in value)
+    elif hasattr(value, "tolist"):
+        # numpy arrays and scalars
+        return freeze(value.tolist())
+    elif hasattr(value, "__dict__"):
+        return (type(value).__name__, freeze(vars(value)))
+    else:
+        return value
@@ -7,6 +7,7 @@ import ast
 
 import backgrounds
 import profiles
+from caching import cached, freeze
 
 # --------------------------------------------------------------------------------
 # Functions
@@ -71,8 +72,35 @@ class FittingOptions(object):
         return getattr(self, name) is not None
 
     # -------------------------------------------------------------------------------------------------------------
+    # The strings are rebuilt for every spectrum and iteration so they are cached on the
+    # content of the options and the parameter values
 
     def create_function_str(self, default_vals=None):
+        """
+            Creates the function string to pass to fit. See _create_function_str
+        """
+        key = ("function", freeze(self), freeze(default_vals))
+        return cached(key, lambda: self._create_function_str(default_vals))
+
+    def create_constraints_str(self):
+        """Returns the string of constraints for this Fit
+        """
+        return cached(("constraints", freeze(self)), self._create_constraints_str)
+
+    def create_ties_str(self):
+        """Returns the string of ties for this Fit
+        """
+        return cached(("ties", freeze(self)), self._create_ties_str)
+
+    def create_global_function_str(self, n, param_values=None):
+        """
+            Creates the function string to pass to fit for a multi-dataset (global) fitting.
+            See _create_global_function_str
+        """
+        key = ("global_function", freeze(self), n, freeze(param_values))
+        return cached(key, lambda: self._create_global_function_str(n, param_values))
+
+    def _create_function_str(self, default_vals=None):
         """
             Creates the function string to pass to fit
 
@@ -125,7 +153,7 @@ class FittingOptions(object):
         matrix_str = matrix_str % (nrows, ncols, values)
         return matrix_str
 
-    def create_constraints_str(self):
+    def _create_constraints_str(self):
         """Returns the string of constraints for this Fit
         """
         constraints = []
@@ -138,7 +166,7 @@ class FittingOptions(object):
 
         return ",".join(constraints).rstrip(",")
 
-    def create_ties_str(self):
+    def _create_ties_str(self):
         """Returns the string of ties for this Fit
         """
         ties = []
@@ -152,7 +180,7 @@ class FittingOptions(object):
 
         return ",".join(ties).rstrip(",")
 
-    def create_global_function_str(self, n, param_values=None):
+    def _create_global_function_str(self, n, param_values=None):
         """
             Creates the function string to pass to fit for a multi-dataset (global) fitting
 
@@ -10,6 +10,8 @@ import re
 
 from mantid import logger
 
+from caching import cached, freeze
+
 # --------------------------------------------------------------------------------
 # Mass profile base class
 # --------------------------------------------------------------------------------
@@ -24,7 +26,22 @@ class MassProfile(object):
         self.intensity = intensity
 
     def create_fit_function_str(self, param_vals=None, param_prefix=""):
-        raise NotImplementedError("MassProfile: Subclasses should overrode create_fitting_str")
+        """Creates a string used by the Fit algorithm for this profile. The string
+        is cached on the profile definition and the values of its parameters
+
+        :param param_vals: A table of values for the parameters that override those set
+        on the object already. Default=None
+        :param param_prefix: A string prefix for the parameter as seen by the Mantid Fit algorithm
+        """
+        if param_vals is None:
+            vals_key = None
+        else:
+            vals_key = tuple(item for item in freeze(param_vals) if item[0].startswith(param_prefix))
+        key = ("profile", freeze(self), vals_key, param_prefix)
+        return cached(key, lambda: self._create_fit_function_str(param_vals, param_prefix))
+
+    def _create_fit_function_str(self, param_vals=None, param_prefix=""):
+        raise NotImplementedError("MassProfile: Subclasses should override _create_fit_function_str")
 
     def create_constraint_str(self, param_prefix=""):
         """Returns a constraints string for the Fit algorithm
@@ -128,9 +145,14 @@ class GaussianMassProfile(MassProfile):
             'mass': mass
         }
 
+        # An intensity is given when starting from the results of a previous fit
+        intensity_match = re.search(r"intensity=([-+]?[0-9.]+(?:[eE][-+]?[0-9]+)?)", func_str)
+        if intensity_match:
+            params['intensity'] = float(intensity_match.group(1))
+
         return GaussianMassProfile(**params)
 
-    def create_fit_function_str(self, param_vals=None, param_prefix=""):
+    def _create_fit_function_str(self, param_vals=None, param_prefix=""):
         """Creates a string used by the Fit algorithm for this profile
 
         :param param_vals: A table of values for the parameters that override those set
@@ -222,14 +244,14 @@ class GramCharlierMassProfile(MassProfile):
         if len(hermite_vals) > 0:
             params['hermite_coeff_vals'] = hermite_vals
 
-        fsecoeff_regex = re.compile("fsecoeff=([0-9.]+)")
-        fsecoeff_match = fsecoeff_regex.match(func_str)
+        fsecoeff_regex = re.compile("fsecoeff=([-+]?[0-9.]+(?:[eE][-+]?[0-9]+)?)")
+        fsecoeff_match = fsecoeff_regex.search(func_str)
         if fsecoeff_match:
-            params['fsecoeff'] = ast.literal_eval(fsecoeff_match.group(1))
+            params['fsecoeff'] = float(fsecoeff_match.group(1))
 
         return GramCharlierMassProfile(**params)
 
-    def create_fit_function_str(self, param_vals=None, param_prefix=""):
+    def _create_fit_function_str(self, param_vals=None, param_prefix=""):
         """Creates a string used by the Fit algorithm for this profile
 
         :param param_vals: A table of values for the parameters that override those set
@@ -264,7 +286,7 @@ class GramCharlierMassProfile(MassProfile):
                 fitting_str += ",{0}={1:f}".format(par_name, param_vals[param_prefix + par_name])
         else:
             if self.fsecoeff is not None:
-                fitting_str += "FSECoeff={0}".format(self.fsecoeff)
+                fitting_str += ",FSECoeff={0:f}".format(self.fsecoeff)
             if self.hermite_coeff_vals is not None:
                 for i, coeff in self.hermite_coeff_vals.items():
                     if coeff > 0:
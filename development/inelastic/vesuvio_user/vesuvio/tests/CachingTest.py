@@ -0,0 +1,53 @@
+import unittest
+
+from vesuvio import caching
+from vesuvio.fitting import FittingOptions
+from vesuvio.profiles import GaussianMassProfile
+
+class CachingTest(unittest.TestCase):
+
+    def setUp(self):
+        caching.clear()
+
+    def test_value_is_only_built_once_for_the_same_key(self):
+        calls = []
+        def builder():
+            calls.append(1)
+            return "built"
+
+        self.assertEqual("built", caching.cached(("key", 1), builder))
+        self.assertEqual("built", caching.cached(("key", 1), builder))
+        self.assertEqual(1, len(calls))
+
+    def test_freeze_gives_equal_keys_for_equal_content(self):
+        first = {"f0.Width": 5.0, "f0.Intensity": [1, 2]}
+        second = {"f0.Intensity": [1, 2], "f0.Width": 5.0}
+
+        self.assertEqual(caching.freeze(first), caching.freeze(second))
+        self.assertEqual(caching.freeze(GaussianMassProfile(10, 16)),
+                         caching.freeze(GaussianMassProfile(10, 16)))
+        self.assertNotEqual(caching.freeze(GaussianMassProfile(10, 16)),
+                            caching.freeze(GaussianMassProfile(11, 16)))
+
+    def test_function_str_changes_when_profile_is_modified(self):
+        gauss = GaussianMassProfile(10, 16)
+        fit_opts = FittingOptions([gauss])
+
+        expected = "composite=ComptonScatteringCountRate,NumDeriv=1;"\
+                   "name=GaussianComptonProfile,Mass=16.000000,Width=10.000000"
+        self.assertEqual(expected, fit_opts.create_function_str())
+
+        gauss.width = 12
+        expected = expected.replace("Width=10.000000", "Width=12.000000")
+        self.assertEqual(expected, fit_opts.create_function_str())
+
+    def test_function_str_changes_with_parameter_values(self):
+        fit_opts = FittingOptions([GaussianMassProfile(10, 16)])
+
+        first = fit_opts.create_function_str({"f0.Width": 11.0, "f0.Intensity": 4.5})
+        second = fit_opts.create_function_str({"f0.Width": 11.0, "f0.Intensity": 5.5})
+        self.assertTrue("Intensity=4.500000" in first)
+        self.assertTrue("Intensity=5.500000" in second)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -29,6 +29,14 @@ class GaussianMassProfileTest(unittest.TestCase):
         self.assertAlmostEqual(mass, profile.mass)
         self.assertEqual([2, 5, 7], profile.width)
 
+    def test_string_with_intensity_produces_object_with_intensity(self):
+        function_str = "function=Gaussian,width=[2, 5, 7],intensity=4.5"
+        mass = 16.0
+
+        profile = create_from_str(function_str, mass)
+        self.assertTrue(isinstance(profile, GaussianMassProfile))
+        self.assertAlmostEqual(4.5, profile.intensity)
+
     def test_function_string_has_expected_form_with_no_defaults(self):
         test_profiles = GaussianMassProfile(10, 16)
 
@@ -109,6 +117,20 @@ class GramCharlierMassProfileTest(unittest.TestCase):
         self.assertEqual(0, profile.sears_flag)
         self.assertEqual(1, profile.k_free)
 
+    def test_string_with_starting_values_produces_object_with_values(self):
+        function_str = "function=GramCharlier,width=[2, 5,7],k_free=1,hermite_coeffs=[1,0,1],sears_flag=0,"\
+                       "fsecoeff=0.25,c_0=21.5"
+        mass = 16.0
+
+        profile = create_from_str(function_str, mass)
+        self.assertTrue(isinstance(profile, GramCharlierMassProfile))
+        self.assertAlmostEqual(0.25, profile.fsecoeff)
+        self.assertEqual({"0": 21.5}, profile.hermite_coeff_vals)
+
+        expected = "name=GramCharlierComptonProfile,Mass=16.000000,HermiteCoeffs=1 0 1,Width=5.000000,"\
+                   "FSECoeff=0.250000,C_0=21.500000;"
+        self.assertEqual(expected, profile.create_fit_function_str())
+
     def test_function_string_has_expected_form_with_no_defaults(self):
         test_profile = GramCharlierMassProfile(10, 16,[1,0,1],1,1)
 
@@ -171,6 +171,34 @@ class FitTofTest(unittest.TestCase):
         self.assertTrue(isinstance(exit_iteration, int))
 
 
+    def test_fit_spectra_in_parallel_gives_results_in_spectrum_order(self):
+        flags = self._create_test_flags(background=False)
+        flags['fit_mode'] = 'spectra'
+        flags['spectra'] = '143-145'
+        flags['num_workers'] = 2
+        runs = "15039-15045"
+
+        fit_results = fit_tof(runs, flags)
+        self.assertTrue(isinstance(fit_results, tuple))
+        self.assertEquals(4, len(fit_results))
+
+        fitted_spec = fit_results[0]
+        self.assertTrue(isinstance(fitted_spec, list))
+        self.assertEqual(3, len(fitted_spec))
+        for spec_no, spec_group in zip(range(143, 146), fitted_spec):
+            self.assertTrue(isinstance(spec_group, WorkspaceGroup))
+            self.assertTrue(spec_group.getName().endswith("_spectrum_" + str(spec_no)))
+            self.assertTrue(isinstance(spec_group[0], MatrixWorkspace))
+
+        fitted_params = fit_results[1]
+        self.assertTrue(isinstance(fitted_params, MatrixWorkspace))
+        self.assertEqual(3, fitted_params.blocksize())
+
+        chisq_values = fit_results[2]
+        self.assertTrue(isinstance(chisq_values, list))
+        self.assertEqual(3, len(chisq_values))
+
+
     def _create_test_flags(self, background):
         runs = "15039-15045"
         flags = dict()
@@ -9,10 +9,15 @@ from mantid import mtd
 from mantid.api import (AnalysisDataService, WorkspaceFactory, TextAxis)
 from mantid.simpleapi import (_create_algorithm_function, AlgorithmManager,
                               CropWorkspace, GroupWorkspaces, UnGroupWorkspace,
-                              LoadVesuvio, DeleteWorkspace, Rebin)
+                              LoadVesuvio, DeleteWorkspace, Rebin,
+                              SaveNexusProcessed, LoadNexusProcessed)
 
 import copy
+import multiprocessing
+import os
 import re
+import shutil
+import tempfile
 import numpy as np
 
 
@@ -28,8 +33,10 @@ def fit_tof(runs, flags, iterations=1, convergence_threshold=None):
     :param flags: A dictionary of flags to control the processing
     :param iterations: Maximum number of iterations to perform
     :param convergence_threshold: Maximum difference in the cost
-                                  function at which the parameters are accepted
-                                  to have converged
+                                  function at which the parameters of a spectrum
+                                  are accepted to have converged. Converged spectra
+                                  are not refitted and iterations stop once every
+                                  spectrum has converged
     :return: Tuple of (fitted workspace, fitted params, number of iterations
              performed)
     """
@@ -52,6 +59,8 @@ def fit_tof(runs, flags, iterations=1, convergence_threshold=None):
                                             flags.get('bin_parameters', None))
 
     last_results = None
+    # Spectra whose cost function has converged are not refitted
+    converged = np.zeros(sample_data.getNumberHistograms(), dtype=bool)
 
     exit_iteration = 0
 
@@ -60,20 +69,24 @@ def fit_tof(runs, flags, iterations=1, convergence_threshold=None):
         iteration_flags['iteration'] = iteration
 
         if last_results is not None:
+            # Start each refit from the previous iteration's parameters
             iteration_flags['masses'] = _update_masses_from_params(copy.deepcopy(flags['masses']), last_results[2])
 
         print "=== Iteration {0} out of a possible {1}".format(iteration, iterations)
-        results = fit_tof_iteration(sample_data, container_data, runs, iteration_flags)
+        results = fit_tof_iteration(sample_data, container_data, runs, iteration_flags,
+                                    previous_results=last_results, converged=converged)
         exit_iteration += 1
 
         if last_results is not None and convergence_threshold is not None:
             last_chi2 = np.array(last_results[3])
             chi2 = np.array(results[3])
-            chi2_delta = last_chi2 - chi2
-            max_chi2_delta = np.abs(np.max(chi2_delta))
-            print "Cost function change: {0}".format(max_chi2_delta)
+            chi2_delta = np.abs(last_chi2 - chi2)
+            print "Cost function change: {0}".format(np.max(chi2_delta))
 
-            if max_chi2_delta <= convergence_threshold:
+            converged |= (chi2_delta <= convergence_threshold)
+            print "{0} of {1} spectra have converged".format(np.count_nonzero(converged), len(converged))
+
+            if np.all(converged):
                 print "Stopped at iteration {0} due to minimal change in cost function".format(exit_iteration)
                 last_results = results
                 break
@@ -83,7 +96,8 @@ def fit_tof(runs, flags, iterations=1, convergence_threshold=None):
     return (last_results[0], last_results[2], last_results[3], exit_iteration)
 
 
-def fit_tof_iteration(sample_data, container_data, runs, flags):
+def fit_tof_iteration(sample_data, container_data, runs, flags,
+                      previous_results=None, converged=None):
     """
     Performs a single iterations of the time of flight corrections and fitting
     workflow.
@@ -92,6 +106,10 @@ def fit_tof_iteration(sample_data, container_data, runs, flags):
     :param container_data: Loaded container data workspaces
     :param runs: A string specifying the runs to process
     :param flags: A dictionary of flags to control the processing
+    :param previous_results: The results of the previous iteration (can be None)
+    :param converged: A sequence of flags, one per workspace index, marking the
+                      spectra that have converged. These are not refitted and
+                      their results are taken from previous_results
     :return: Tuple of (workspace group name, pre correction fit parameters,
              final fit parameters, chi^2 values)
     """
@@ -106,99 +124,56 @@ def fit_tof_iteration(sample_data, container_data, runs, flags):
     background_str = _create_background_str(flags.get('background', None))
     intensity_constraints = _create_intensity_constraint_str(flags['intensity_constraints'])
 
-    # The simpleapi function won't have been created so do it by hand
-    VesuvioTOFFit = _create_algorithm_function("VesuvioTOFFit", 1,
-                                               AlgorithmManager.createUnmanaged("VesuvioTOFFit"))
-    VesuvioCorrections = _create_algorithm_function("VesuvioCorrections", 1,
-                                                    AlgorithmManager.createUnmanaged("VesuvioCorrections"))
-
     num_spec = sample_data.getNumberHistograms()
-    pre_correct_pars_workspace = None
-    pars_workspace = None
-    max_fit_iterations = flags.get('max_fit_iterations', 5000)
-
+    if previous_results is None or converged is None:
+        fit_indices = range(num_spec)
+    else:
+        fit_indices = [index for index in range(num_spec) if not converged[index]]
+        print "Refitting {0} of {1} spectra".format(len(fit_indices), num_spec)
+    if len(fit_indices) == 0:
+        raise ValueError("No unconverged spectra left to fit")
+
+    num_workers = _get_num_workers(flags.get('num_workers', 1), len(fit_indices))
+    fit_args = {'mass_values': mass_values,
+                'profiles_strs': profiles_strs,
+                'background_str': background_str,
+                'intensity_constraints': intensity_constraints}
+
+    if num_workers > 1:
+        spectrum_results = _fit_tof_spectra_parallel(sample_data, container_data, runs,
+                                                     flags, fit_args, num_workers, fit_indices)
+    else:
+        spectrum_results = [_fit_tof_spectrum(index, sample_data, container_data, runs, flags, **fit_args)
+                            for index in fit_indices]
+    spectrum_results = dict(zip(fit_indices, spectrum_results))
+
+    # All spectra share the same parameters so any of the new tables will do
+    first_result = spectrum_results[fit_indices[0]]
+    pre_correct_pars_workspace = _create_param_workspace(num_spec, mtd[first_result[2]])
+    pars_workspace = _create_param_workspace(num_spec, mtd[first_result[3]])
+
+    if previous_results is not None:
+        previous_groups = previous_results[0]
+        if not isinstance(previous_groups, list):
+            previous_groups = [previous_groups]
+
+    # Merge the per-spectrum results in workspace index order regardless of the
+    # order in which the fits completed
     output_groups = []
     chi2_values = []
     for index in range(num_spec):
-        if isinstance(profiles_strs, list):
-            profiles = profiles_strs[index]
-        else:
-            profiles = profiles_strs
-
-        suffix = _create_fit_workspace_suffix(index,
-                                              sample_data,
-                                              flags['fit_mode'],
-                                              flags['spectra'],
-                                              flags.get('iteration', None))
-
-        # Corrections
-        corrections_args = dict()
-
-        # Need to do a fit first to obtain the parameter table
-        pre_correction_pars_name = runs + "_params_pre_correction" + suffix
-        corrections_fit_name = "__vesuvio_corrections_fit"
-        VesuvioTOFFit(InputWorkspace=sample_data,
-                      WorkspaceIndex=index,
-                      Masses=mass_values,
-                      MassProfiles=profiles,
-                      Background=background_str,
-                      IntensityConstraints=intensity_constraints,
-                      OutputWorkspace=corrections_fit_name,
-                      FitParameters=pre_correction_pars_name,
-                      MaxIterations=max_fit_iterations,
-                      Minimizer=flags['fit_minimizer'])
-        DeleteWorkspace(corrections_fit_name)
-        corrections_args['FitParameters'] = pre_correction_pars_name
-
-        # Add the mutiple scattering arguments
-        corrections_args.update(flags['ms_flags'])
-
-        corrected_data_name = runs + "_tof_corrected" + suffix
-        linear_correction_fit_params_name = runs + "_correction_fit_scale" + suffix
-
-        if flags.get('output_verbose_corrections', False):
-            corrections_args["CorrectionWorkspaces"] = runs + "_correction" + suffix
-            corrections_args["CorrectedWorkspaces"] = runs + "_corrected" + suffix
+        if index not in spectrum_results:
+            # Converged in an earlier iteration, keep those results
+            _copy_fit_params(pre_correct_pars_workspace, index, previous_results[1])
+            _copy_fit_params(pars_workspace, index, previous_results[2])
+            chi2_values.append(previous_results[3][index])
+            output_groups.append(previous_groups[index])
+            continue
 
-        if container_data is not None:
-            corrections_args["ContainerWorkspace"] = container_data
-
-        VesuvioCorrections(InputWorkspace=sample_data,
-                           OutputWorkspace=corrected_data_name,
-                           LinearFitResult=linear_correction_fit_params_name,
-                           WorkspaceIndex=index,
-                           GammaBackground=flags.get('gamma_correct', False),
-                           Masses=mass_values,
-                           MassProfiles=profiles,
-                           IntensityConstraints=intensity_constraints,
-                           MultipleScattering=True,
-                           GammaBackgroundScale=flags.get('fixed_gamma_scaling', 0.0),
-                           ContainerScale=flags.get('fixed_container_scaling', 0.0),
-                           **corrections_args)
-
-        # Final fit
-        fit_ws_name = runs + "_data" + suffix
-        pars_name = runs + "_params" + suffix
-        fit_result = VesuvioTOFFit(InputWorkspace=corrected_data_name,
-                                   WorkspaceIndex=0, # Corrected data always has a single histogram
-                                   Masses=mass_values,
-                                   MassProfiles=profiles,
-                                   Background=background_str,
-                                   IntensityConstraints=intensity_constraints,
-                                   OutputWorkspace=fit_ws_name,
-                                   FitParameters=pars_name,
-                                   MaxIterations=max_fit_iterations,
-                                   Minimizer=flags['fit_minimizer'])
-        chi2_values.append(fit_result[-1])
-        DeleteWorkspace(corrected_data_name)
+        suffix, chi2, pre_correction_pars_name, pars_name, output_workspaces = spectrum_results[index]
+        chi2_values.append(chi2)
 
         # Process parameter tables
-        if pre_correct_pars_workspace is None:
-            pre_correct_pars_workspace = _create_param_workspace(num_spec, mtd[pre_correction_pars_name])
-
-        if pars_workspace is None:
-            pars_workspace = _create_param_workspace(num_spec, mtd[pars_name])
-
         _update_fit_params(pre_correct_pars_workspace, index, mtd[pre_correction_pars_name], suffix[1:])
         _update_fit_params(pars_workspace, index, mtd[pars_name], suffix[1:])
 
@@ -208,13 +183,6 @@ def fit_tof_iteration(sample_data, container_data, runs, flags):
         # Process spectrum group
         # Note the ordering of operations here gives the order in the WorkspaceGroup
         group_name = runs + suffix
-        output_workspaces = [fit_ws_name, linear_correction_fit_params_name]
-        if flags.get('output_verbose_corrections', False):
-            output_workspaces += mtd[corrections_args["CorrectionWorkspaces"]].getNames()
-            output_workspaces += mtd[corrections_args["CorrectedWorkspaces"]].getNames()
-            UnGroupWorkspace(corrections_args["CorrectionWorkspaces"])
-            UnGroupWorkspace(corrections_args["CorrectedWorkspaces"])
-
         output_groups.append(GroupWorkspaces(InputWorkspaces=output_workspaces, OutputWorkspace=group_name))
 
         # Output the parameter workspaces
@@ -287,6 +255,213 @@ def load_and_crop_data(runs, spectra, ip_file, diff_mode='single',
 # Private Functions
 # --------------------------------------------------------------------------------
 
+def _get_num_workers(num_workers, num_spec):
+    """
+    Work out how many worker processes to use for fitting.
+
+    @param num_workers The requested number of workers. None means use all available cores
+    @param num_spec The number of spectra to be fitted
+    @return The number of workers, never more than the number of spectra
+    """
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    if num_workers < 1:
+        raise ValueError("Number of workers must be at least 1, found {0}".format(num_workers))
+
+    return min(num_workers, num_spec)
+
+def _fit_tof_spectrum(index, sample_data, container_data, runs, flags,
+                      mass_values, profiles_strs, background_str, intensity_constraints):
+    """
+    Runs the corrections and final fit for a single spectrum.
+
+    @param index The workspace index of the spectrum to fit
+    @param sample_data Loaded sample data workspace
+    @param container_data Loaded container data workspace (can be None)
+    @param runs A string specifying the runs to process
+    @param flags A dictionary of flags to control the processing
+    @return Tuple of (workspace suffix, chi^2 value, pre correction parameter table name,
+            final parameter table name, list of output workspace names for the spectrum group)
+    """
+    # The simpleapi function won't have been created so do it by hand
+    VesuvioTOFFit = _create_algorithm_function("VesuvioTOFFit", 1,
+                                               AlgorithmManager.createUnmanaged("VesuvioTOFFit"))
+    VesuvioCorrections = _create_algorithm_function("VesuvioCorrections", 1,
+                                                    AlgorithmManager.createUnmanaged("VesuvioCorrections"))
+
+    max_fit_iterations = flags.get('max_fit_iterations', 5000)
+
+    if isinstance(profiles_strs, list):
+        profiles = profiles_strs[index]
+    else:
+        profiles = profiles_strs
+
+    suffix = _create_fit_workspace_suffix(index,
+                                          sample_data,
+                                          flags['fit_mode'],
+                                          flags['spectra'],
+                                          flags.get('iteration', None))
+
+    # Corrections
+    corrections_args = dict()
+
+    # Need to do a fit first to obtain the parameter table
+    pre_correction_pars_name = runs + "_params_pre_correction" + suffix
+    corrections_fit_name = "__vesuvio_corrections_fit"
+    VesuvioTOFFit(InputWorkspace=sample_data,
+                  WorkspaceIndex=index,
+                  Masses=mass_values,
+                  MassProfiles=profiles,
+                  Background=background_str,
+                  IntensityConstraints=intensity_constraints,
+                  OutputWorkspace=corrections_fit_name,
+                  FitParameters=pre_correction_pars_name,
+                  MaxIterations=max_fit_iterations,
+                  Minimizer=flags['fit_minimizer'])
+    DeleteWorkspace(corrections_fit_name)
+    corrections_args['FitParameters'] = pre_correction_pars_name
+
+    # Add the mutiple scattering arguments
+    corrections_args.update(flags['ms_flags'])
+
+    corrected_data_name = runs + "_tof_corrected" + suffix
+    linear_correction_fit_params_name = runs + "_correction_fit_scale" + suffix
+
+    if flags.get('output_verbose_corrections', False):
+        corrections_args["CorrectionWorkspaces"] = runs + "_correction" + suffix
+        corrections_args["CorrectedWorkspaces"] = runs + "_corrected" + suffix
+
+    if container_data is not None:
+        corrections_args["ContainerWorkspace"] = container_data
+
+    VesuvioCorrections(InputWorkspace=sample_data,
+                       OutputWorkspace=corrected_data_name,
+                       LinearFitResult=linear_correction_fit_params_name,
+                       WorkspaceIndex=index,
+                       GammaBackground=flags.get('gamma_correct', False),
+                       Masses=mass_values,
+                       MassProfiles=profiles,
+                       IntensityConstraints=intensity_constraints,
+                       MultipleScattering=True,
+                       GammaBackgroundScale=flags.get('fixed_gamma_scaling', 0.0),
+                       ContainerScale=flags.get('fixed_container_scaling', 0.0),
+                       **corrections_args)
+
+    # Final fit
+    fit_ws_name = runs + "_data" + suffix
+    pars_name = runs + "_params" + suffix
+    fit_result = VesuvioTOFFit(InputWorkspace=corrected_data_name,
+                               WorkspaceIndex=0, # Corrected data always has a single histogram
+                               Masses=mass_values,
+                               MassProfiles=profiles,
+                               Background=background_str,
+                               IntensityConstraints=intensity_constraints,
+                               OutputWorkspace=fit_ws_name,
+                               FitParameters=pars_name,
+                               MaxIterations=max_fit_iterations,
+                               Minimizer=flags['fit_minimizer'])
+    chi2 = fit_result[-1]
+    DeleteWorkspace(corrected_data_name)
+
+    output_workspaces = [fit_ws_name, linear_correction_fit_params_name]
+    if flags.get('output_verbose_corrections', False):
+        output_workspaces += mtd[corrections_args["CorrectionWorkspaces"]].getNames()
+        output_workspaces += mtd[corrections_args["CorrectedWorkspaces"]].getNames()
+        UnGroupWorkspace(corrections_args["CorrectionWorkspaces"])
+        UnGroupWorkspace(corrections_args["CorrectedWorkspaces"])
+
+    return (suffix, chi2, pre_correction_pars_name, pars_name, output_workspaces)
+
+def _fit_tof_spectra_parallel(sample_data, container_data, runs, flags, fit_args, num_workers,
+                              fit_indices):
+    """
+    Fits each spectrum in a separate process using a pool of workers.
+
+    Workspaces cannot be passed between processes so the input data is saved
+    once to a scratch directory, each worker loads it once when it starts
+    (_init_fit_worker) and saves its outputs back there, and the results are
+    loaded into this process afterwards.
+
+    @param sample_data Loaded sample data workspace
+    @param container_data Loaded container data workspace (can be None)
+    @param runs A string specifying the runs to process
+    @param flags A dictionary of flags to control the processing
+    @param fit_args A dictionary of the fit function arguments for _fit_tof_spectrum
+    @param num_workers The number of worker processes to use
+    @param fit_indices The workspace indices of the spectra to fit
+    @return A list of the _fit_tof_spectrum results in the order of fit_indices
+    """
+    scratch_dir = tempfile.mkdtemp(prefix="vesuvio_fit_")
+    try:
+        sample_file = os.path.join(scratch_dir, "sample.nxs")
+        SaveNexusProcessed(InputWorkspace=sample_data, Filename=sample_file)
+        container_file = None
+        if container_data is not None:
+            container_file = os.path.join(scratch_dir, "container.nxs")
+            SaveNexusProcessed(InputWorkspace=container_data, Filename=container_file)
+
+        tasks = [(index, runs, flags, fit_args, scratch_dir) for index in fit_indices]
+
+        print "Fitting {0} spectra using {1} worker processes".format(len(tasks), num_workers)
+        pool = multiprocessing.Pool(processes=num_workers, initializer=_init_fit_worker,
+                                    initargs=(sample_file, container_file))
+        try:
+            # map preserves the task order so the results are deterministic
+            spectrum_results = pool.map(_fit_tof_spectrum_worker, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+        for spectrum_result in spectrum_results:
+            _, _, pre_correction_pars_name, pars_name, output_workspaces = spectrum_result
+            for name in [pre_correction_pars_name, pars_name] + output_workspaces:
+                LoadNexusProcessed(Filename=os.path.join(scratch_dir, name + ".nxs"),
+                                   OutputWorkspace=name)
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    return spectrum_results
+
+# Input data of a worker process, loaded once by _init_fit_worker and used by
+# every spectrum the worker fits
+_worker_data = {}
+
+def _init_fit_worker(sample_file, container_file):
+    """
+    Initializer of the worker processes. Loads the input data that every
+    spectrum fitted by the worker is taken from.
+
+    @param sample_file File of the sample data saved by _fit_tof_spectra_parallel
+    @param container_file File of the container data (can be None)
+    """
+    _worker_data['sample'] = LoadNexusProcessed(Filename=sample_file,
+                                                OutputWorkspace="__vesuvio_worker_sample")
+    _worker_data['container'] = None
+    if container_file is not None:
+        _worker_data['container'] = LoadNexusProcessed(Filename=container_file,
+                                                       OutputWorkspace="__vesuvio_worker_container")
+
+def _fit_tof_spectrum_worker(task):
+    """
+    Entry point for a worker process. Fits a single spectrum of the data
+    loaded by _init_fit_worker and saves all of the outputs to the scratch
+    directory.
+
+    @param task Tuple of (index, runs, flags, fit arguments, scratch directory)
+    @return The result of _fit_tof_spectrum
+    """
+    index, runs, flags, fit_args, scratch_dir = task
+
+    spectrum_result = _fit_tof_spectrum(index, _worker_data['sample'], _worker_data['container'],
+                                        runs, flags, **fit_args)
+
+    _, _, pre_correction_pars_name, pars_name, output_workspaces = spectrum_result
+    for name in [pre_correction_pars_name, pars_name] + output_workspaces:
+        SaveNexusProcessed(InputWorkspace=name, Filename=os.path.join(scratch_dir, name + ".nxs"))
+        DeleteWorkspace(name)
+
+    return spectrum_result
+
 def _update_masses_from_params(old_masses, param_ws):
     """
     Update the massses flag based on the results of a fit.
@@ -349,6 +524,13 @@ def _update_fit_params(params_ws, spec_idx, params_table, name):
         params_ws.dataY(idx)[spec_idx] = params_table.column('Value')[idx]
         params_ws.dataE(idx)[spec_idx] = params_table.column('Error')[idx]
 
+def _copy_fit_params(params_ws, spec_idx, previous_params_ws):
+    params_ws.getAxis(0).setLabel(spec_idx, previous_params_ws.getAxis(0).label(spec_idx))
+    for idx in range(params_ws.getNumberHistograms()):
+        params_ws.dataX(idx)[spec_idx] = spec_idx
+        params_ws.dataY(idx)[spec_idx] = previous_params_ws.readY(idx)[spec_idx]
+        params_ws.dataE(idx)[spec_idx] = previous_params_ws.readE(idx)[spec_idx]
+
 def _create_tof_workspace_suffix(runs, spectra):
     return runs + "_" + spectra + "_tof"
 
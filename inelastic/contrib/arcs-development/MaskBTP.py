@@ -1,7 +1,14 @@
-from numpy import arange
+import os
+from numpy import arange, array, zeros, ix_, load, save
 from mantid import *
 from mantid.simpleapi import *
 
+#first and last bank numbers of each instrument
+BANKRANGES={"ARCS":(1,115),"CNCS":(1,50),"HYSPEC":(1,20),"SEQUOIA":(38,150)}
+#directory where the (bank,tube,pixel) to detector ID tables are saved between sessions
+TABLEDIR=os.path.join(os.path.expanduser('~'),'.maskbtp')
+_idtables={}
+
 
 def getEightPackHandle(inst,banknum):
 	name=inst.getName()
@@ -35,7 +42,41 @@ def getEightPackHandle(inst,banknum):
 		else: 
 			raise ValueError("Out of range index for SEQUOIA instrument bank numbers")
 
-		
+
+def getDetectorIDTable(inst,idf):
+    """
+    Returns the numpy array of detector IDs of the instrument, indexed by [bank-first bank,tube-1,pixel-1].
+    The table is built once from the eight packs of the instrument, then kept in memory and
+    saved in TABLEDIR, keyed by the instrument definition file idf and its modification time.
+    """
+    name=inst.getName()
+    key=name+'_'+os.path.splitext(os.path.basename(idf))[0]
+    if os.path.isfile(idf):
+        key+='_'+str(int(os.path.getmtime(idf)))
+    if _idtables.has_key(key):
+        return _idtables[key]
+    tablefile=os.path.join(TABLEDIR,key+'.npy')
+    try:
+        table=load(tablefile)
+    except (IOError,ValueError):
+        firstbank,lastbank=BANKRANGES[name]
+        table=zeros((lastbank-firstbank+1,8,128),dtype=int)
+        for b in range(firstbank,lastbank+1):
+            ep=getEightPackHandle(inst,b)
+            for t in range(8):
+                tube=ep[t]
+                for p in range(128):
+                    table[b-firstbank,t,p]=tube[p].getID()
+        try:
+            if not os.path.isdir(TABLEDIR):
+                os.makedirs(TABLEDIR)
+            save(tablefile,table)
+        except (IOError,OSError):
+            print "Could not save the detector ID table to "+tablefile
+    _idtables[key]=table
+    return table
+
+
 def MaskBTP(**kwargs):
 
     instrument=kwargs.get('Instrument',None)
@@ -57,12 +98,21 @@ def MaskBTP(**kwargs):
     except:
         print "Instrument not found"
         return detlist
+    idf=config["instrumentDefinition.directory"]+instrument+"_Definition.xml"
     if (workspace==None):
-        path=config["instrumentDefinition.directory"]
-        LoadEmptyInstrument(Filename=path+instrument+"_Definition.xml",OutputWorkspace="temporaryWorkspaceForMasking")
+        #the empty instrument is loaded once per session and copied for each call
+        emptyworkspace="__MaskBTP_"+instrument
+        if not mtd.doesExist(emptyworkspace):
+            LoadEmptyInstrument(Filename=idf,OutputWorkspace=emptyworkspace)
         workspace="temporaryWorkspaceForMasking"
+        CloneWorkspace(InputWorkspace=emptyworkspace,OutputWorkspace=workspace)
         w=mtd[workspace]
         inst=w.getInstrument()
+    else:
+        try:
+            idf=inst.getFilename()
+        except:
+            pass
     if (banks==None):
         if (instrument=="ARCS"):
             banks=arange(115)+1
@@ -95,19 +145,18 @@ def MaskBTP(**kwargs):
             len(pixels)
         except:
             pixels=[pixels]	
-    for b in banks:
-        ep=getEightPackHandle(inst,b)
-        for t in tubes:
-            if ((t<1) or (t>8)):
-                raise ValueError("Out of range index for tube number")
-            else:
-                for p in pixels:
-#                    print p
-                    if ((p<1) or (p>128)):
-                        raise ValueError("Out of range index for pixel number")
-                    else:
-                        pid=ep[int(t-1)][int(p-1)].getID()
-                        detlist.append(pid)
+    banks=array(banks,dtype=int).ravel()
+    tubes=array(tubes,dtype=int).ravel()
+    pixels=array(pixels,dtype=int).ravel()
+    firstbank,lastbank=BANKRANGES[instrument]
+    if ((banks<firstbank) | (banks>lastbank)).any():
+        raise ValueError("Out of range index for "+instrument+" instrument bank numbers")
+    if ((tubes<1) | (tubes>8)).any():
+        raise ValueError("Out of range index for tube number")
+    if ((pixels<1) | (pixels>128)).any():
+        raise ValueError("Out of range index for pixel number")
+    table=getDetectorIDTable(inst,idf)
+    detlist=table[ix_(banks-firstbank,tubes-1,pixels-1)].ravel().tolist()
     MaskDetectors(Workspace=workspace,DetectorList=detlist)
     return detlist
 
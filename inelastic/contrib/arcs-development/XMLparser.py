@@ -86,6 +86,9 @@ class XMLparser(object):
                    'logvaluemin','logvaluemax','logvaluestep','powderanglestep']:
             return float(value)
 
+        if tag == 'sliceworkers':
+            return int(value)
+
         if tag in ['runs','vanruns','pixel','tube','bank']:
             #create empty list to put the runs in
             runs = []
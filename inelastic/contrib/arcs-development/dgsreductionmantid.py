@@ -5,6 +5,11 @@ import os
 import imp
 import stat
 import shutil as shutil
+import tempfile
+import threading
+import copy
+import hashlib
+from multiprocessing.pool import ThreadPool
 
 from XMLparser import XMLparser
 from mantid import *
@@ -13,6 +18,8 @@ from MaskBTP import *
 from MaskAngle import *
 from numpy import *
 
+#createanglelist writes the powder grouping files to the current directory
+_powdergrouplock = threading.Lock()
 
 
 def GetPathFromRunNumber(instrument,run):
@@ -41,6 +48,39 @@ def GetPathFromRunNumber(instrument,run):
 
 
 
+class RunLoaderThread(threading.Thread):
+    """Loads a run (and its monitors) and filters its bad pulses in the background.
+    Call result() to wait for it, which returns the path of the file."""
+    def __init__(self,instrument,run,wsname,monwsname,loadmon,filterbadpulses):
+        threading.Thread.__init__(self)
+        self.instrument=instrument
+        self.runnumber=run
+        self.wsname=wsname
+        self.monwsname=monwsname
+        self.loadmon=loadmon
+        self.filterbadpulses=filterbadpulses
+        self.path=None
+        self.error=None
+
+    def run(self):
+        try:
+            self.path = GetPathFromRunNumber(self.instrument,self.runnumber)
+            Load(Filename=self.path,OutputWorkspace = self.wsname)
+            if self.loadmon:
+                LoadNexusMonitors(Filename=self.path,OutputWorkspace = self.monwsname)
+            if self.filterbadpulses:
+                FilterBadPulses(InputWorkspace = self.wsname, OutputWorkspace = self.wsname)
+        except Exception, e:
+            self.error=e
+
+    def result(self):
+        self.join()
+        if self.error!=None:
+            raise self.error
+        return self.path
+
+
+
 class dgsreduction(object):
     def __init__(self, XMLfile=None):
         self.instrument=None
@@ -88,6 +128,7 @@ class dgsreduction(object):
         self.friendlynamelogs = None
         self.vanpath = ''
         self.datapath = ''
+        self.sliceworkers = 1
 
 
         if XMLfile!=None:
@@ -137,35 +178,7 @@ class dgsreduction(object):
         if self.scantype == 'single':
             #load and filter bad pulses
             #load and add the runs together.
-            #get the path for the first file
-            path = GetPathFromRunNumber(self.instrument,self.runs[0])
-            #load the file.
-            Load(Filename=path,OutputWorkspace = 'data')
-            print "Datafile "+path+" loaded."
-            if self.loadmon:            
-                LoadNexusMonitors(Filename=path,OutputWorkspace = 'monitorws')
-
-            if self.filterbadpulses:
-                FilterBadPulses(InputWorkspace = 'data', OutputWorkspace = 'data')
-
-            self.datatext += "Loaded data run from "+path +"\n"
-
-            if len(self.runs) > 1:
-                for i in range(1,len(self.runs)):
-                    path = GetPathFromRunNumber(self.instrument,self.runs[i])
-                    Load(Filename=path,OutputWorkspace = 'datatemp')
-                    print "Datafile "+path+" loaded."
-                    if self.loadmon:                    
-                        LoadNexusMonitors(Filename=path,OutputWorkspace = 'monitortemp')
-                    if self.filterbadpulses:
-                        FilterBadPulses(InputWorkspace = 'datatemp', OutputWorkspace = 'datatemp')
-                    Plus(LHSWorkspace='data', RHSWorkspace = 'datatemp', OutputWorkspace='data')
-                    if self.loadmon:                    
-                        Plus(LHSWorkspace='monitorws', RHSWorkspace = 'monitortemp', OutputWorkspace='monitorws')
-                    self.datatext += "Added data run from "+path +"\n"
-
-            if self.filterbadpulses:
-                self.datatext += "Bad pulses have been filterd from the data file(s).\n"
+            self.LoadAndSumRuns('data','monitorws')
 
             #This is where the reduction is done.
             self.ProcessWorkspace('data')
@@ -195,34 +208,7 @@ class dgsreduction(object):
         if self.scantype == 'sweep':
             #load and filter bad pulses
             #load and add the runs together.
-            #get the path for the first file
-            path = GetPathFromRunNumber(self.instrument,self.runs[0])
-            #load the file.
-            Load(Filename=path,OutputWorkspace = 'data')
-            print "Datafile "+path+" loaded."
-            if self.loadmon:
-                LoadNexusMonitors(Filename=path,OutputWorkspace = 'monitorws')
-            if self.filterbadpulses:
-                FilterBadPulses(InputWorkspace = 'data', OutputWorkspace = 'data')
-
-            self.datatext += "Loaded data run from "+path +"\n"
-
-            if len(self.runs) > 1:
-                for i in range(1,len(self.runs)):
-                    path = GetPathFromRunNumber(self.instrument,self.runs[i])
-                    Load(Filename=path,OutputWorkspace = 'datatemp')
-                    print "Datafile "+path+" loaded."
-                    if self.loadmon:                    
-                        LoadNexusMonitors(Filename=path,OutputWorkspace = 'monitortemp')
-                    if self.filterbadpulses:
-                        FilterBadPulses(InputWorkspace = 'datatemp', OutputWorkspace = 'datatemp')
-                    Plus(LHSWorkspace='data', RHSWorkspace = 'datatemp', OutputWorkspace='data')
-                    if self.loadmon:                    
-                        Plus(LHSWorkspace='monitorws', RHSWorkspace = 'monitortemp', OutputWorkspace='monitorws')
-                    self.datatext += "Added data run from "+path +"\n"
-
-            if self.filterbadpulses:
-                self.datatext += "Bad pulses have been filterd from the data file(s).\n"
+            self.LoadAndSumRuns('data','monitorws')
             
 
             wsrun = mtd['data'].run()
@@ -245,15 +231,127 @@ class dgsreduction(object):
             #Get the time correlation correct if you set the time correlation keyword.
             #To first approximation, set the time to zero for the first.
 
-            for i in range(len(bounds)-1):
-                FilterByLogValue(InputWorkspace="data",OutputWorkspace = 'dataslice', LogName= self.logvalue,MinimumValue=float(bounds[i]) ,MaximumValue = float(bounds[i+1]))
-                dataslice=mtd['dataslice']
-                if dataslice.getNumberEvents()>0:
-                    values=array(dataslice.run().getProperty(self.logvalue).value)
-                    self.datatext+= "Processing data for "+self.logvalue+" between "+str(bounds[i])+" and "+str(bounds[i+1])+", mean="+str(values.mean())+" std="+str(values.std())+"\n"
-                    self.ProcessWorkspace('dataslice')                
-                    if self.resetEnergyToNone:
-                        self.efixed=None
+            #split the events into all the slices in one pass
+            slices = self.SplitByLogValue('data',bounds)
+            self.ProcessSlices(slices)
+
+
+    def SplitByLogValue(self,wsname,bounds):
+        """Split the events of wsname by the log value self.logvalue into the intervals
+        [bounds[i],bounds[i+1]), the same slices as FilterByLogValue, in 'dataslice_'+str(i).
+        Evenly spaced bounds are split in a single pass over the events, uneven bounds need
+        one FilterByLogValue per interval.
+        Returns a list of (workspace name, lower bound, upper bound, log values) of the non empty slices."""
+        bounds = array(bounds,dtype=float)
+        if len(bounds)<2:
+            return []
+        nslices = len(bounds)-1
+        steps = diff(bounds)
+        if allclose(steps,steps[0]):
+            #zero tolerance: the intervals start at the bounds (the default centres them on the bounds)
+            GenerateEventsFilter(InputWorkspace=wsname,OutputWorkspace='slicesplitter',InformationWorkspace='sliceinfo',
+                                 LogName=self.logvalue,MinimumLogValue=float(bounds[0]),MaximumLogValue=float(bounds[-1]),
+                                 LogValueInterval=float(steps[0]),LogValueTolerance=0.,LogBoundary='Centre',
+                                 FilterLogValueByChangingDirection='Both')
+            FilterEvents(InputWorkspace=wsname,SplitterWorkspace='slicesplitter',InformationWorkspace='sliceinfo',
+                         OutputWorkspaceBaseName='dataslice')
+            DeleteWorkspace('slicesplitter')
+            DeleteWorkspace('sliceinfo')
+            if mtd.doesExist('dataslice_unfiltered'):
+                DeleteWorkspace('dataslice_unfiltered')
+            #rounding of (max-min)/interval can give one more (tiny) interval at the top, it belongs to the last slice
+            extraname = 'dataslice_'+str(nslices)
+            if mtd.doesExist(extraname):
+                lastname = 'dataslice_'+str(nslices-1)
+                if mtd[extraname].getNumberEvents()>0 and mtd.doesExist(lastname):
+                    Plus(LHSWorkspace=lastname,RHSWorkspace=extraname,OutputWorkspace=lastname)
+                DeleteWorkspace(extraname)
+        else:
+            for i in range(nslices):
+                FilterByLogValue(InputWorkspace=wsname,OutputWorkspace='dataslice_'+str(i),LogName=self.logvalue,
+                                 MinimumValue=float(bounds[i]),MaximumValue=float(bounds[i+1]))
+
+        #log values of each slice
+        values = array(mtd[wsname].run().getProperty(self.logvalue).value)
+        sliceindex = digitize(values,bounds)-1
+
+        slices = []
+        for i in range(nslices):
+            slicename = 'dataslice_'+str(i)
+            if not mtd.doesExist(slicename):
+                continue
+            if mtd[slicename].getNumberEvents()>0:
+                slicevalues = values[sliceindex==i]
+                if len(slicevalues)==0:
+                    slicevalues = array(mtd[slicename].run().getProperty(self.logvalue).value)
+                slices.append((slicename,bounds[i],bounds[i+1],slicevalues))
+            else:
+                DeleteWorkspace(slicename)
+        return slices
+
+
+    def ProcessSlices(self,slices):
+        """Reduce the slices from SplitByLogValue with ProcessWorkspace.
+        If self.sliceworkers > 1 the slices are reduced by a pool of threads, each working on
+        a (deep) copy of this object, and the text of each slice is added to datatext in order.
+        The last slice is kept as 'dataslice', the others are deleted once reduced."""
+        def processslice(reduction,sliceinfo):
+            slicename,lower,upper,values=sliceinfo
+            reduction.datatext+= "Processing data for "+reduction.logvalue+" between "+str(lower)+" and "+str(upper)+", mean="+str(values.mean())+" std="+str(values.std())+"\n"
+            reduction.ProcessWorkspace(slicename)
+            if reduction.resetEnergyToNone:
+                reduction.efixed=None
+            return reduction
+
+        if self.sliceworkers <= 1 or len(slices) <= 1:
+            for sliceinfo in slices:
+                processslice(self,sliceinfo)
+        else:
+            starttext = self.datatext
+            pool = ThreadPool(min(self.sliceworkers,len(slices)))
+            try:
+                reductions = pool.map(lambda sliceinfo: processslice(copy.deepcopy(self),sliceinfo),slices,chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+            for reduction in reductions:
+                self.datatext += reduction.datatext[len(starttext):]
+
+        for i in range(len(slices)):
+            if i < len(slices)-1:
+                DeleteWorkspace(slices[i][0])
+            else:
+                RenameWorkspace(InputWorkspace=slices[i][0],OutputWorkspace='dataslice')
+
+
+    def LoadAndSumRuns(self,wsname,monwsname):
+        """Load the runs, filter their bad pulses and add them together into wsname
+        (and the monitors into monwsname). The next run is loaded in a background thread
+        while the current one is added to the sum in place, so no more than two runs
+        are held in memory besides the sum."""
+        loader=RunLoaderThread(self.instrument,self.runs[0],wsname,monwsname,self.loadmon,self.filterbadpulses)
+        loader.start()
+        for i in range(len(self.runs)):
+            path=loader.result()
+            runwsname,runmonwsname=loader.wsname,loader.monwsname
+            if i+1 < len(self.runs):
+                loader=RunLoaderThread(self.instrument,self.runs[i+1],'__datarun'+str(i+1),'__monitorrun'+str(i+1),self.loadmon,self.filterbadpulses)
+                loader.start()
+            print "Datafile "+path+" loaded."
+            if i==0:
+                self.datatext += "Loaded data run from "+path +"\n"
+                continue
+
+            #Plus with the output equal to the LHS adds the events in place
+            Plus(LHSWorkspace=wsname, RHSWorkspace = runwsname, OutputWorkspace=wsname)
+            DeleteWorkspace(runwsname)
+            if self.loadmon:
+                Plus(LHSWorkspace=monwsname, RHSWorkspace = runmonwsname, OutputWorkspace=monwsname)
+                DeleteWorkspace(runmonwsname)
+            self.datatext += "Added data run from "+path +"\n"
+
+        if self.filterbadpulses:
+            self.datatext += "Bad pulses have been filterd from the data file(s).\n"
 
 
     def ProcessWorkspace(self,datawsname):
@@ -328,7 +426,7 @@ class dgsreduction(object):
             tibstep=tibmax-tibmin
             tibpar=str(tibmin)+","+str(tibstep)+","+str(tibmax)
 
-            Rebin(InputWorkspace=datawsname,OutputWorkspace="background_origin_ws",Params=tibpar,PreserveEvents=False)
+            Rebin(InputWorkspace=datawsname,OutputWorkspace=datawsname+"_background_origin",Params=tibpar,PreserveEvents=False)
             ConvertUnits(InputWorkspace=datawsname,OutputWorkspace=datawsname,Target="DeltaE",EMode="Direct",Efixed=efixed)
 
 	        #Do the Binning into energy bins
@@ -336,9 +434,9 @@ class dgsreduction(object):
             ConvertUnits(InputWorkspace=datawsname,OutputWorkspace=datawsname,Target="TOF",EMode="Direct",Efixed=efixed)
 
             ConvertToDistribution(Workspace=datawsname)
-            FlatBackground(InputWorkspace="background_origin_ws",OutputWorkspace="background_ws",StartX=tibmin,EndX=tibmax,Mode="Mean",OutputMode="Return Background")
-            ConvertToDistribution(Workspace="background_ws")
-            Minus(LHSWorkspace=datawsname,RHSWorkspace="background_ws",OutputWorkspace=datawsname)
+            FlatBackground(InputWorkspace=datawsname+"_background_origin",OutputWorkspace=datawsname+"_background",StartX=tibmin,EndX=tibmax,Mode="Mean",OutputMode="Return Background")
+            ConvertToDistribution(Workspace=datawsname+"_background")
+            Minus(LHSWorkspace=datawsname,RHSWorkspace=datawsname+"_background",OutputWorkspace=datawsname)
             ConvertFromDistribution(Workspace=datawsname)
             self.datatext  += "Time-independent background between "+str(tibmin)+" and "+str(tibmax)+" microseconds was subtracted.\n"
         else:
@@ -389,14 +487,20 @@ class dgsreduction(object):
         #in general grouping files will be stored in Mantid/instrument/Grouping
         #check if the requested grouping file is present
         #Two types of grouping, powder and pixel
+        powderparfile = None
         if ((self.grouping == 'powder') and (self.powderanglestep != None)):
             #do the powder work
             outputdir = os.path.abspath(os.curdir)
-            mapping=createanglelist(datawsname,self.powderanglestep)
-            GroupDetectors(InputWorkspace=datawsname,OutputWorkspace=datawsname,MapFile=outputdir+"/powdergroup.map",Behaviour="Sum")
-            SolidAngle(InputWorkspace=datawsname,OutputWorkspace="sa")
-            Divide(LHSWorkspace=datawsname,RHSWorkspace="sa",OutputWorkspace=datawsname)
-            DeleteWorkspace(Workspace = "sa")
+            #the other slices may rewrite powdergroup.map/.par, keep a copy of the par file of this one for the saving
+            with _powdergrouplock:
+                mapping=createanglelist(datawsname,self.powderanglestep)
+                GroupDetectors(InputWorkspace=datawsname,OutputWorkspace=datawsname,MapFile=outputdir+"/powdergroup.map",Behaviour="Sum")
+                handle,powderparfile = tempfile.mkstemp(prefix='powdergroup_',suffix='.par')
+                os.close(handle)
+                shutil.copy(outputdir+"/powdergroup.par",powderparfile)
+            SolidAngle(InputWorkspace=datawsname,OutputWorkspace=datawsname+"_sa")
+            Divide(LHSWorkspace=datawsname,RHSWorkspace=datawsname+"_sa",OutputWorkspace=datawsname)
+            DeleteWorkspace(Workspace = datawsname+"_sa")
             self.datatext += "Detectors grouped by angle with a step of "+str(self.powderanglestep)+ ".\n"
 
         #case of powder grouping and NO valid angle step
@@ -439,7 +543,7 @@ class dgsreduction(object):
             if 'nxspe' in self.save:
                 #if there is a powder maping file in the current directory, then use it with the .nxspe file
                 if self.grouping == 'powder':
-                    SaveNXSPE(Filename=friendlynamebase+".nxspe", InputWorkspace=datawsname, Efixed=str(efixed),Psi=str(psiangle), KiOverKfScaling=self.kiokf, ParFile=os.path.abspath(os.curdir) +"/powdergroup.par")
+                    SaveNXSPE(Filename=friendlynamebase+".nxspe", InputWorkspace=datawsname, Efixed=str(efixed),Psi=str(psiangle), KiOverKfScaling=self.kiokf, ParFile=powderparfile)
                 else:
                     SaveNXSPE(Filename=friendlynamebase+".nxspe", InputWorkspace=datawsname, Efixed=str(efixed),Psi=str(psiangle), KiOverKfScaling=self.kiokf)
                 self.datatext += "Data have been saved as a .nxspe file, FILENAME="+friendlynamebase+".nxspe.\n"
@@ -471,10 +575,10 @@ class dgsreduction(object):
                 emaxloc = ws.readX(0)[-1]
                 efullbin = (emaxloc - eminloc)*1.50
                 ebinparams = str(eminloc)+","+str(efullbin)+","+str(emaxloc)
-                SofQW(InputWorkspace=datawsname,OutputWorkspace='SofQWdata',QAxisBinning=qbinparams,Emode="Direct",Efixed=efixed)
-                Transpose(InputWorkspace='SofQWdata',OutputWorkspace='SofQWdata')
-                wsofq = Rebin2D(InputWorkspace='SofQWdata',Axis1Binning=qbinparams,Axis2Binning=ebinparams)
-                SaveAscii(Filename=friendlynamebase+"_iofq.dat",InputWorkspace='wsofq')
+                SofQW(InputWorkspace=datawsname,OutputWorkspace=datawsname+'_SofQW',QAxisBinning=qbinparams,Emode="Direct",Efixed=efixed)
+                Transpose(InputWorkspace=datawsname+'_SofQW',OutputWorkspace=datawsname+'_SofQW')
+                Rebin2D(InputWorkspace=datawsname+'_SofQW',OutputWorkspace=datawsname+'_iofq',Axis1Binning=qbinparams,Axis2Binning=ebinparams)
+                SaveAscii(Filename=friendlynamebase+"_iofq.dat",InputWorkspace=datawsname+'_iofq')
                 self.datatext += "Data have been saved as a iofq.dat file, FILENAME="+friendlynamebase+"_iofq.dat.\n" 
                 #change permissions of the directory and file
                 changepermissions(friendlynamebase+"_iofq.dat")
@@ -482,7 +586,7 @@ class dgsreduction(object):
 
             if 'par' in self.save:
                 if self.grouping == 'powder':
-                    shutil.copy(os.path.abspath(os.curdir) +"/powdergroup.par",friendlynamebase+".par")
+                    shutil.copy(powderparfile,friendlynamebase+".par")
                 else:
                     SavePAR(Filename=friendlynamebase+".par", InputWorkspace=datawsname)
                 self.datatext += "PAR file has been saved as FILENAME="+friendlynamebase+".par.\n"
@@ -503,10 +607,10 @@ class dgsreduction(object):
                 [qmin, qmax] = calqrangefromworkspace(datawsname)
                 qfullbin = (qmax - qmin)*1.50
                 qbinparams = str(qmin)+","+str(qfullbin)+","+str(qmax)
-                SofQW(InputWorkspace=datawsname,OutputWorkspace='SofQWdata',QAxisBinning=qbinparams,Emode="Direct",Efixed=efixed)
-                Transpose(InputWorkspace='SofQWdata',OutputWorkspace='SofQWdata')
-                wsofe = Rebin2D(InputWorkspace='SofQWdata',Axis1Binning=qbinparams,Axis2Binning=Erange)
-                SaveAscii(Filename=friendlynamebase+"_iofe.dat",InputWorkspace='wsofe')
+                SofQW(InputWorkspace=datawsname,OutputWorkspace=datawsname+'_SofQW',QAxisBinning=qbinparams,Emode="Direct",Efixed=efixed)
+                Transpose(InputWorkspace=datawsname+'_SofQW',OutputWorkspace=datawsname+'_SofQW')
+                Rebin2D(InputWorkspace=datawsname+'_SofQW',OutputWorkspace=datawsname+'_iofe',Axis1Binning=qbinparams,Axis2Binning=Erange)
+                SaveAscii(Filename=friendlynamebase+"_iofe.dat",InputWorkspace=datawsname+'_iofe')
                 self.datatext += "Data have been saved as a iofe.dat file, FILENAME="+friendlynamebase+"_iofe.dat.\n" 
                 #change permissions of the directory and file
                 changepermissions(friendlynamebase+"_iofe.dat")
@@ -529,6 +633,9 @@ class dgsreduction(object):
                 sumfile.close()
                 changepermissions(summaryfilename)
 
+        if powderparfile != None:
+            os.remove(powderparfile)
+
 
     def SetInstrument(self,instrument):
         if instrument not in ['ARCS','CNCS','HYSPEC','SEQUOIA']:
@@ -666,6 +773,8 @@ class dgsreduction(object):
             self.vanpath= params['vanpath']
         if params.has_key('datapath'):
             self.datapath = params['datapath']
+        if params.has_key('sliceworkers'):
+            self.sliceworkers = params['sliceworkers']
 
 
     def PerformCalibration(self):
@@ -974,6 +1083,116 @@ def definegoniometer(names, offsets, directions, axes, workspace):
             raise ValueError("Number of angle names, offsets, directions and axes do not match.")
 
 
+#directory where the detector geometry is cached between sessions
+GEOMETRYCACHEDIR = os.path.join(os.path.expanduser('~'),'.dgsreduction')
+_geometrycache = {}
+
+def geometrycachekey(ws):
+    """
+    Key of the detector geometry of the workspace ws: the instrument name, the
+    instrument definition file and the positions (L2, two theta, azimuth, from
+    PreprocessDetectorsToMD) of all the detectors, so that any calibration of the
+    detector positions gives a different key.
+    Returns [key, persistent]. If the positions cannot be read in one pass only a
+    sample of detectors is in the key and persistent is False: the key is then only
+    good enough for the current session.
+    """
+    w=mtd[str(ws)]
+    inst=w.getInstrument()
+    key=inst.getName()
+    try:
+        idf=inst.getFilename()
+        key+=idf
+        if os.path.isfile(idf):
+            key+=str(os.path.getmtime(idf))
+    except:
+        pass
+    key+=str(inst.getSample().getPos())
+    #one pass over all the spectra in C++, named after ws for the slice threads
+    tablename='__geometrykey_'+str(ws)
+    try:
+        table=PreprocessDetectorsToMD(InputWorkspace=w,OutputWorkspace=tablename)
+        digest=hashlib.md5(key)
+        for column in ['DetectorID','L2','TwoTheta','Azimuthal']:
+            digest.update(array(table.column(column)).tostring())
+        DeleteWorkspace(tablename)
+        return [inst.getName()+'_'+digest.hexdigest(),True]
+    except:
+        if mtd.doesExist(tablename):
+            DeleteWorkspace(tablename)
+    nhist=w.getNumberHistograms()
+    for i in unique(linspace(0,nhist-1,16).astype(int)):
+        try:
+            det=w.getDetector(int(i))
+            key+=str(det.getID())+str(det.getPos())
+        except:
+            pass
+    return [inst.getName()+'_sampled_'+hashlib.md5(key).hexdigest(),False]
+
+
+def getdetectorgeometry(ws):
+    """
+    Returns the detector geometry of workspace ws (string or workspace) as a dictionary of numpy arrays
+    with one element per detector, in the order of the spectra: 'ids' (detector IDs), 'twotheta' and
+    'phi' (radians) and 'l2', plus 'masked' with the masking of the detectors in ws.
+    The geometry is calculated once per instrument and calibration (see geometrycachekey),
+    kept in memory and, if the key covers all the detectors, saved in GEOMETRYCACHEDIR for later sessions.
+    """
+    w=mtd[str(ws)]
+    key,persistent=geometrycachekey(ws)
+    if not _geometrycache.has_key(key):
+        cachefile=os.path.join(GEOMETRYCACHEDIR,key+'.npz')
+        geometry=None
+        if persistent and os.path.isfile(cachefile):
+            try:
+                f=load(cachefile)
+                geometry=dict([(name,f[name]) for name in ['ids','twotheta','phi','l2']])
+                f.close()
+            except:
+                geometry=None
+        if geometry==None:
+            geometry=calculatedetectorgeometry(w)
+            if persistent:
+                try:
+                    if not os.path.isdir(GEOMETRYCACHEDIR):
+                        os.makedirs(GEOMETRYCACHEDIR)
+                    savez(cachefile,**geometry)
+                except (IOError,OSError):
+                    logger.warning("Could not save the detector geometry to "+cachefile)
+        _geometrycache[key]=geometry
+
+    geometry=dict(_geometrycache[key])
+    #the masking changes from workspace to workspace. The mask workspace is named after ws,
+    #the slices can be reduced by several threads at once (sliceworkers)
+    maskname='__geometrymask_'+str(ws)
+    maskws=ExtractMask(InputWorkspace=w,OutputWorkspace=maskname)
+    maskeddetectors=array(maskws[1],dtype=int)
+    DeleteWorkspace(maskname)
+    geometry['masked']=in1d(geometry['ids'],maskeddetectors)
+    return geometry
+
+
+def calculatedetectorgeometry(w):
+    """
+    Calculates the detector IDs, two theta, phi and L2 of all detectors of the spectra of workspace w,
+    see getdetectorgeometry.
+    """
+    inst=w.getInstrument()
+    samplepos=inst.getSample().getPos()
+    ids=[]
+    positions=[]
+    for i in range(w.getNumberHistograms()):
+        for j in w.getSpectrum(i).getDetectorIDs():
+            pos=inst.getDetector(j).getPos()-samplepos
+            ids.append(j)
+            positions.append([pos.X(),pos.Y(),pos.Z()])
+    positions=array(positions,dtype=float).reshape(-1,3)
+    l2=sqrt((positions**2).sum(axis=1))
+    twotheta=arccos(clip(positions[:,2]/where(l2>0,l2,1.0),-1.0,1.0))
+    phi=arctan2(positions[:,1],positions[:,0])
+    return {'ids':array(ids,dtype=int),'twotheta':twotheta,'phi':phi,'l2':l2}
+
+
 def createanglelist(ws,astep):
     """
     Function to create a map of detectors corresponding to angles in a certain range.
@@ -984,21 +1203,18 @@ def createanglelist(ws,astep):
     amin = 0.0
     amax = 180.0
     bin_angles=arange(amin+astep*0.5,amax+astep*0.5,astep)
-    a=[[] for i in range(len(bin_angles))] #list of list with detector IDs
-    w=mtd[ws]
-    origin = w.getInstrument().getSample().getPos()
-    for i in range(w.getNumberHistograms()):
-        ang=w.getDetector(i).getTwoTheta(origin,V3D(0,0,1))*180/pi
-        index=int((ang-amin)/astep)
-        if (index>=0) and (index<len(a)) and ((w.getDetector(i).getID())>0):
-            a[index].append(w.getDetector(i).getID())
+    geometry=getdetectorgeometry(ws)
+    ids=geometry['ids']
+    index=((degrees(geometry['twotheta'])-amin)/astep).astype(int)
+    good=(index>=0)&(index<len(bin_angles))&(ids>0)
+    #sort the detectors by bin, keeping the order of the spectra within each bin
+    order=argsort(index[good],kind='mergesort')
+    binindex=index[good][order]
+    binids=ids[good][order]
     #create lists with angles and detector ID only for bins where there are detectors 
-    ang_list=[]
-    detIDlist=[]
-    for elem,ang in zip(a,bin_angles):
-        if len(elem)>0:
-            detIDlist.append(elem)
-            ang_list.append(ang)
+    usedbins,starts=unique(binindex,return_index=True)
+    ang_list=bin_angles[usedbins].tolist()
+    detIDlist=[elem.tolist() for elem in split(binids,starts[1:])]
 	# file with grouping information, saved to current directory
     outputdir = os.path.abspath(os.curdir)
     f=open(outputdir+"/powdergroup.map",'w')
@@ -1039,18 +1255,12 @@ def calqrangefromworkspace(workspace):
     angle1 = 180.0
     angle2 = 0.0
 
-    #loop over all the detectors and find the
-    for i in range(ws.getNumberHistograms()):
-        #get the detectorIDs
-        ids = ws.getSpectrum(i).getDetectorIDs()
-        for j in ids:
-            det = ws.getInstrument().getDetector(j)
-            if not det.isMasked():
-                angle =  degrees(det.getTwotheta(V3D(0,0,0),V3D(0,0,1)))
-                if angle < angle1:
-                    angle1 = angle
-                if angle > angle2:
-                    angle2 = angle
+    #the min and max angles of the detectors that are not masked
+    geometry = getdetectorgeometry(ws)
+    angles = degrees(geometry['twotheta'][logical_not(geometry['masked'])])
+    if len(angles) > 0:
+        angle1 = min(angle1,angles.min())
+        angle2 = max(angle2,angles.max())
  
     #need the minimum energy transfer the data have been binned to.
     hwmin = ws.readX(0)[0]
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+Benchmark of the event slicing of the 'sweep' scan type of dgsreduction.
+
+Before: FilterByLogValue once per slice, i.e. one pass over all events per slice.
+After: dgsreduction.SplitByLogValue, one pass over the events for all slices
+(GenerateEventsFilter and FilterEvents).
+
+Set the instrument, run and log below to a large (multi-GB) event file with a swept log.
+"""
+import time
+from mantid.simpleapi import *
+from numpy import *
+from dgsreductionmantid import dgsreduction, GetPathFromRunNumber
+
+instrument = 'ARCS'
+run = 12345
+logvalue = 'SampleTemp'
+nslices = 50
+
+path = GetPathFromRunNumber(instrument,run)
+Load(Filename=path,OutputWorkspace='data')
+values = array(mtd['data'].run().getProperty(logvalue).value)
+bounds = linspace(values.min(),values.max(),nslices+1)
+print "Events: %d, slices of %s: %d" % (mtd['data'].getNumberEvents(),logvalue,nslices)
+
+## Before: one FilterByLogValue pass per slice ##
+start = time.time()
+nevents_before = []
+for i in range(nslices):
+    FilterByLogValue(InputWorkspace='data',OutputWorkspace='dataslice',LogName=logvalue,
+                     MinimumValue=float(bounds[i]),MaximumValue=float(bounds[i+1]))
+    nevents_before.append(mtd['dataslice'].getNumberEvents())
+before = time.time() - start
+DeleteWorkspace('dataslice')
+
+## After: one pass for all slices ##
+reduction = dgsreduction()
+reduction.logvalue = logvalue
+start = time.time()
+slices = reduction.SplitByLogValue('data',bounds)
+after = time.time() - start
+#events of each slice, the empty slices are not returned
+nevents_after = [0]*nslices
+for s in slices:
+    nevents_after[int(s[0].split('_')[-1])] = mtd[s[0]].getNumberEvents()
+    DeleteWorkspace(s[0])
+
+print "Events in slices before: %d, after: %d" % (sum(nevents_before),sum(nevents_after))
+for i in range(nslices):
+    if nevents_before[i] != nevents_after[i]:
+        print "Slice %d [%g,%g): %d events before, %d after" % (i,bounds[i],bounds[i+1],nevents_before[i],nevents_after[i])
+if nevents_before != nevents_after:
+    raise RuntimeError("The slices of SplitByLogValue differ from FilterByLogValue")
+print "Slicing before: %f s" % before
+print "Slicing after:  %f s" % after
+if after > 0.0:
+    print "Speed up: %.1fx" % (before/after)
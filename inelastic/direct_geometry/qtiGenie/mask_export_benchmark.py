@@ -0,0 +1,86 @@
+"""
+Round trip benchmark of the qtiGenie mask export on a MERLIN sized (~70k spectra) workspace.
+
+Before: export_masks called getSpectrum(i) and getDetector(i) for every histogram
+and writeISISmasks built the ranges character by character.
+After: the masked flags and spectra numbers are extracted in bulk, compressed into
+ranges with numpy.diff and the .msk file is written in one go. readISISmasks reads
+the file back into a mask array. Spectra without detectors count as masked.
+"""
+from mantid.simpleapi import *
+import numpy
+import os
+import time
+import qtiGenie
+
+instrument = 'MERLIN'
+msk_file = os.path.join(qtiGenie.save_dir,'mask_benchmark.msk')
+
+def export_masks_loop(pws):
+    """ the mask extraction loop of export_masks before vectorisation """
+    masks = []
+    for i in range(pws.getNumberHistograms()):
+        ms = i+1
+        try:
+            ms = pws.getSpectrum(i).getSpectrumNo();
+        except Exception:
+            masks.append(ms)
+            continue
+        try:
+            det = pws.getDetector(i)
+        except Exception:
+            masks.append(ms)
+            continue
+        if det.isMasked():
+            masks.append(ms)
+    return masks
+
+ws = CreateSimulationWorkspace(Instrument=instrument,BinParams='0,1,10')
+nspec = ws.getNumberHistograms()
+
+# mask ~10% of the spectra: whole tubes and single pixels
+numpy.random.seed(0)
+tubes = numpy.random.randint(0,nspec/256,size=nspec/2560)
+indices = numpy.concatenate([numpy.arange(t*256,t*256+256) for t in tubes] +
+                            [numpy.random.randint(0,nspec,size=nspec/20)])
+indices = numpy.unique(indices[indices < nspec])
+MaskDetectors(Workspace=ws,WorkspaceIndexList=indices.tolist())
+
+# spectra without detectors are exported as masked
+no_detectors = numpy.unique(numpy.random.randint(0,nspec,size=20))
+for i in no_detectors:
+    ws.getSpectrum(int(i)).clearDetectorIDs()
+
+## Before ##
+start = time.time()
+masks_before = export_masks_loop(ws)
+extract_before = time.time() - start
+
+## After ##
+start = time.time()
+masks = qtiGenie.export_masks(ws,returnMasks=True)
+extract_after = time.time() - start
+
+start = time.time()
+qtiGenie.writeISISmasks(msk_file,masks)
+write_after = time.time() - start
+
+start = time.time()
+flags = qtiGenie.readISISmasks(msk_file,ws.getAxis(1).extractValues())
+read_after = time.time() - start
+
+spec_nums = numpy.asarray(ws.getAxis(1).extractValues(),dtype=int)
+if not numpy.all(numpy.in1d(spec_nums[no_detectors],masks)):
+    raise RuntimeError("Spectra without detectors are not in the exported masks")
+if not numpy.array_equal(masks,numpy.array(masks_before)):
+    raise RuntimeError("Vectorised mask extraction differs from the loop")
+if not numpy.array_equal(masks,spec_nums[flags]):
+    raise RuntimeError("Masks read back from %s differ from the masks written" % msk_file)
+os.remove(msk_file)
+
+print "Spectra: %d, masked: %d" % (nspec,len(masks))
+print "Extract masks before: %f s" % extract_before
+print "Extract masks after:  %f s" % extract_after
+print "Write .msk: %f s, read .msk: %f s" % (write_after,read_after)
+if extract_after > 0.0:
+    print "Speed up of the extraction: %.1fx" % (extract_before/extract_after)
@@ -619,6 +619,129 @@ def normalise(*args):
     return mtd[wksp_out]	
 
 
+def prefetch_runs(runs,loader,nthreads=4):
+    """
+    generator returning loader(run) for each run in runs, in order. 
+    The next nthreads runs are loaded by a pool of background threads while 
+    the current one is processed, so no more than nthreads+1 runs are in memory.
+    The loader should return numpy arrays rather than workspaces (see load_run_arrays)
+    eg:
+    for data in prefetch_runs(range(1000,1200),loader):
+    """
+    from multiprocessing.pool import ThreadPool
+
+    runs=list(runs)
+    nthreads=max(1,min(nthreads,len(runs)))
+    pool=ThreadPool(nthreads)
+    try:
+        pending=[pool.apply_async(loader,(run,)) for run in runs[:nthreads]]
+        inext=len(pending)
+        while len(pending)>0:
+            data=pending.pop(0).get()
+            if inext<len(runs):
+                pending.append(pool.apply_async(loader,(runs[inext],)))
+                inext=inext+1
+            yield data
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def load_run_arrays(filename,spectra=None,monitors=False):
+    """
+    loads a run and returns its data as numpy arrays in a dictionary 
+    with keys x,y,e (counts, one row per spectrum), spec (spectrum numbers) and uamps.
+    No workspace is kept.
+    spectra=[specmin,specmax] or list of spectrum numbers: load these spectra only
+    monitors=True: return the separately loaded monitors instead of the data
+    """
+    wksp='__qtg_'+os.path.basename(str(filename))
+    kwargs={}
+    if monitors:
+        kwargs['LoadMonitors']='Separate'
+    elif spectra is not None:
+        if len(spectra)==2 and spectra[0]<=spectra[1]:
+            kwargs['SpectrumMin']=spectra[0]
+            kwargs['SpectrumMax']=spectra[1]
+        else:
+            kwargs['SpectrumList']=list(spectra)
+    Load(Filename=filename,OutputWorkspace=wksp,Cache="Never",**kwargs)
+    try:
+        uamps=mtd[wksp].getRun().getProtonCharge()
+        if monitors:
+            DeleteWorkspace(wksp)
+            wksp=wksp+'_Monitors'
+        ws=mtd[wksp]
+        data=dict(x=ws.extractX(),y=ws.extractY(),e=ws.extractE(),uamps=uamps)
+        data['spec']=numpy.array([ws.getSpectrum(i).getSpectrumNo() for i in range(ws.getNumberHistograms())])
+    finally:
+        DeleteWorkspace(wksp)
+    return data
+
+def integrate_arrays(x,y,e,tmin,tmax):
+    """
+    integrates each spectrum between tmin and tmax including partial bins,
+    as the Integration algorithm with IncludePartialBins does for counts.
+    x are the bin boundaries, y and e have one row per spectrum.
+    returns (integrals,errors) arrays of one value per spectrum
+    """
+    x=numpy.asarray(x,dtype=float)
+    lo=numpy.clip(x[...,:-1],tmin,tmax)
+    hi=numpy.clip(x[...,1:],tmin,tmax)
+    width=x[...,1:]-x[...,:-1]
+    frac=numpy.where(width>0,(hi-lo)/numpy.where(width>0,width,1.0),0.0)
+    integral=(y*frac).sum(axis=-1)
+    error=numpy.sqrt(((e*frac)**2).sum(axis=-1))
+    return integral,error
+
+def integrate_runs(runs,tmin,tmax,specmin,specmax,normalise='uamp',mon_range=[1000,2000],nthreads=4):
+    """
+    batch engine for integrate_over_runs.
+    loads spectra specmin to specmax of each run (and monitor 1 if normalise='mon') 
+    in background threads and calculates the sum over the spectra of the 
+    normalised integral between tmin and tmax.
+    returns numpy arrays (integrals,errors), one value per run, NaN for runs with zero beam current
+    eg:
+    y,e=integrate_runs(range(1000,1200),1000,2000,1,100)
+    y,e=integrate_runs(range(1000,1200),1000,2000,1,100,normalise='mon',mon_range=[1000,2000])
+    """
+    runs=list(runs)
+    instname=qtg_par["instname"]
+    mon_spec=None
+    spectra=[specmin,specmax]
+    if normalise=='mon':
+        mon_spec=int(qtg_par["mon1_spec"])
+        spectra=range(specmin,specmax+1)
+        if mon_spec<specmin or mon_spec>specmax:
+            spectra=[mon_spec]+spectra
+    def loader(run):
+        return load_run_arrays(instname+getnumor(run),spectra)
+
+    integrals=numpy.zeros(len(runs))
+    errors=numpy.zeros(len(runs))
+    for irun,data in enumerate(prefetch_runs(runs,loader,nthreads)):
+        if data['uamps']==0:
+            print 'Integral from run ', runs[irun], 'is NaN because zero beam current'
+            integrals[irun]=numpy.nan
+            errors[irun]=numpy.nan
+            continue
+        rows=(data['spec']>=specmin)&(data['spec']<=specmax)
+        x=data['x'][rows]
+        y,e=integrate_arrays(x,data['y'][rows],data['e'][rows],tmin,tmax)
+        if mon_spec is None:
+            y=y/data['uamps']
+            e=e/data['uamps']
+        else:
+            imon=numpy.nonzero(data['spec']==mon_spec)[0][0]
+            mon,mon_err=integrate_arrays(data['x'][imon],data['y'][imon],data['e'][imon],mon_range[0],mon_range[1])
+            # errors of the monitor are propagated to each spectrum as by Divide
+            e=numpy.sqrt((e/mon)**2+(y*mon_err/mon**2)**2)
+            y=y/mon
+        integrals[irun]=y.sum()
+        errors[irun]=numpy.sqrt((e**2).sum())
+        print 'Integral from run ', runs[irun], '=' ,integrals[irun],'+/-',errors[irun]
+    return integrals,errors
+
 def integrate_over_runs(runstart,runstop,tmin,tmax,specmin,specmax,*args,**kwargs):
     """
     reads in multiple runs and calculates integral of a region of interest
@@ -630,61 +753,42 @@ def integrate_over_runs(runstart,runstop,tmin,tmax,specmin,specmax,*args,**kwarg
     integrate_over_runs(runstart,runstop,tmin,tmax,specmin,specmax,xaxis_start_pos,xstep,normalise=mon)
     integrate_over_runs(runstart,runstop,tmin,tmax,specmin,specmax,xaxis_start_pos,xstep,normalise=mon,mon_range=[1000,2000])
     integrate_over_runs(runstart,runstop,tmin,tmax,specmin,specmax,xaxis_start_pos,xstep,normalise=uamp)
+    integrate_over_runs(runstart,runstop,tmin,tmax,specmin,specmax,nthreads=8) <-- number of runs loaded ahead
+    see integrate_runs to get the integrals as arrays without a table
     """
     if kwargs.has_key('normalise'):
         norm_method = kwargs.get('normalise')
         if norm_method=='uamp':
             print 'Normalise to uamps'
-            norm=2
         elif norm_method=='mon':
             print 'Normalise to monitor 1'
-            norm=1
     
     else:
         print 'default uamphr normalisation use keyword normalise to change'
-        norm =2
+        norm_method='uamp'
 
-    if kwargs.has_key('normalise') and kwargs.get('normalise')=='mon' and kwargs.has_key('mon_range'):
-        mon_int_range=kwargs.get('mon_range')
+    mon_int_range=kwargs.get('mon_range',[1000,2000])
+    nthreads=kwargs.get('nthreads',4)
+
+    integrals,errors=integrate_runs(range(runstart,runstop+1),tmin,tmax,specmin,specmax,norm_method,mon_int_range,nthreads)
 
-    jj=1
     outdat=createqtiTable('integral',runstop+1-runstart)
-    
-    for i in range(runstart,runstop+1):	
-        #Extra line added by RAE - check if we are using uamps norm and run has zero uamphr count time
-        runnumber=getnumor(i)
-        base_name = qtg_par["instname"]
-        runinfo=RawFileInfo(base_name+str(runnumber),GetRunParameters=True)
-        temp = mtd.getTableWorkspace('Raw_RPB')
-        uamps=temp.getDouble('r_gd_prtn_chrg', 0)
-        if uamps==0:
-            print 'Integral from run ', i, 'is NaN because zero beam current'
+    for jj in range(1,runstop+2-runstart):
+        if numpy.isnan(integrals[jj-1]):
             outdat.setCell(1,jj,jj)
             outdat.setCell(2,jj,0)
             outdat.setCell(3,jj,0)
-        else:	
-            #tmp=load(i)
-            #RAE added:
-            tmp=load_spectra(i,specmin,specmax)
-            if kwargs.has_key('normalise') and kwargs.get('normalise')=='mon' and kwargs.has_key('mon_range'):		
-                out=normalise(tmp,norm,mon_int_range[0],mon_int_range[1])
-            else:
-                out=normalise(tmp,norm)
-            #tmp=integrate(out,tmin,tmax,specmin,specmax)
-            tmp=integrate(out,tmin,tmax,1,specmax-specmin+1)
-            tmp=sumspec(tmp)
-            if len(args)==2:
-                outdat.setCell(1,jj,args[0]+args[1]*(jj-1))
-            else:
-                outdat.setCell(1,jj,jj)
-            outdat.setCell(2,jj,tmp.readY(0)[0])
-            outdat.setCell(3,jj,tmp.readE(0)[0])
-            print 'Integral from run ', i, '=' ,tmp.readY(0)[0],'+/-',tmp.readE(0)[0]
-        jj=jj+1
+            continue
+        if len(args)==2:
+            outdat.setCell(1,jj,args[0]+args[1]*(jj-1))
+        else:
+            outdat.setCell(1,jj,jj)
+        outdat.setCell(2,jj,integrals[jj-1])
+        outdat.setCell(3,jj,errors[jj-1])
     mantidplot.plot(outdat,(1,2,3),2)
     return outdat
 
-def integrate_maps_monitors_over_runs(runstart,runstop,tmin,tmax,mypath):
+def integrate_maps_monitors_over_runs(runstart,runstop,tmin,tmax,mypath,nthreads=4):
     """
     reads in multiple runs and calculates integral of a region of interest
     as there is no simple method to create a mantid workspace the output is 
@@ -696,82 +800,46 @@ def integrate_maps_monitors_over_runs(runstart,runstop,tmin,tmax,mypath):
     integrate_over_runs(runstart,runstop,tmin,tmax,specmin,specmax,xaxis_start_pos,xstep,normalise=mon,mon_range=[1000,2000])
     integrate_over_runs(runstart,runstop,tmin,tmax,specmin,specmax,xaxis_start_pos,xstep,normalise=uamp)
     """
+    base_name = qtg_par["instname"]
+    def loader(run):
+        runnumber=getnumor(run)
+        sz=0
+        for name in ['map','MAP']:
+            for ext in ['.raw','.RAW']:
+                if os.path.isfile(mypath+name+runnumber+ext):
+                    sz=os.path.getsize(mypath+name+runnumber+ext)
+        #Three possibilities, either we are using one to one, or mid-tubes mapping, or a problem. If
+        #the file size is not too big, load the whole thing, as it is much easier to get the monitors then
+        try:
+            if sz<50000000:
+                return load_run_arrays(base_name+runnumber,monitors=True)
+            try:
+                return load_run_arrays(base_name+runnumber,[41473,41473])
+            except:
+                return load_run_arrays(base_name+runnumber,[577,577])
+        except:
+            print('Unexpected item in the bagging area')
+            return None
 
-    norm =2
-    jj=1
+    runs=range(runstart,runstop+1)
     outdat=createqtiTable('integral',runstop+1-runstart)
-    
-    
-    for i in range(runstart,runstop+1):	
-        #Extra line added by RAE - check if we are using uamps norm and run has zero uamphr count time
-        runnumber=getnumor(i)
-        base_name = qtg_par["instname"]
-        runinfo=RawFileInfo(base_name+str(runnumber),GetRunParameters=True)
-        temp = mtd.getTableWorkspace('Raw_RPB')
-        uamps=temp.getDouble('r_gd_prtn_chrg', 0)
-        if uamps==0:
+    jj=1
+    for data in prefetch_runs(runs,loader,nthreads):
+        i=runs[jj-1]
+        outdat.setCell(1,jj,jj)
+        if data is None:
+            print 'Integral from run ', i, 'is NaN because problem getting mon spectra'
+            outdat.setCell(2,jj,0)
+            outdat.setCell(3,jj,0)
+        elif data['uamps']==0:
             print 'Integral from run ', i, 'is NaN because zero beam current'
-            outdat.setCell(1,jj,jj)
             outdat.setCell(2,jj,0)
             outdat.setCell(3,jj,0)
-        else:	
-            t1=os.path.isfile(mypath+'map'+runnumber+'.raw')
-            t2=os.path.isfile(mypath+'map'+runnumber+'.RAW')
-            t3=os.path.isfile(mypath+'MAP'+runnumber+'.raw')
-            t4=os.path.isfile(mypath+'MAP'+runnumber+'.RAW')
-            #check file size
-            if t1:
-                sz=os.path.getsize(mypath+'map'+runnumber+'.raw')
-            elif t2:
-                sz=os.path.getsize(mypath+'map'+runnumber+'.RAW')
-            elif t3:
-                sz=os.path.getsize(mypath+'MAP'+runnumber+'.raw')
-            elif t4:
-                sz=os.path.getsize(mypath+'MAP'+runnumber+'.RAW')
-            
-            #Three possibilities, either we are using one to one, or mid-tubes mapping, or a problem. If
-            #the file size is not too big, load the whole thing, as it is much easier to get the monitors then
-            if sz<50000000:
-                tmp=load_monitors(i)
-                mflag=True
-                badflag=False
-            else:
-                mflag=False
-                try:
-                    tmp=load_spectra(i,41473,41473)
-                    specmin=41473
-                    specmax=41473
-                    igood=i
-                    badflag=False
-                except:
-                    try:
-                        tmp=load_spectra(i,577,577)
-                        specmin=573
-                        specmax=573
-                        badflag=False
-                    except:
-                        print('Unexpected item in the bagging area')
-                        badflag=True
-            if badflag:
-                print 'Integral from run ', i, 'is NaN because problem getting mon spectra'
-                outdat.setCell(1,jj,jj)
-                outdat.setCell(2,jj,0)
-                outdat.setCell(3,jj,0)
-            else:	
-                if mflag:
-                    CloneWorkspace('tmp_Monitors',OutputWorkspace='tmp')			
-                    #out=normalise(tmp,norm)
-                    out=tmp/uamps
-                    tmp=integrate(out,tmin,tmax,1,1)
-                else:
-                    out=normalise(tmp,norm)
-                    tmp=integrate(out,tmin,tmax,1,specmax-specmin+1)
-                tmp=sumspec(tmp)
-            
-                outdat.setCell(1,jj,jj)
-                outdat.setCell(2,jj,tmp.readY(0)[0])
-                outdat.setCell(3,jj,tmp.readE(0)[0])
-                print 'Integral from run ', i, '=' ,tmp.readY(0)[0],'+/-',tmp.readE(0)[0]
+        else:
+            y,e=integrate_arrays(data['x'][0],data['y'][0],data['e'][0],tmin,tmax)
+            outdat.setCell(2,jj,y/data['uamps'])
+            outdat.setCell(3,jj,e/data['uamps'])
+            print 'Integral from run ', i, '=' ,y/data['uamps'],'+/-',e/data['uamps']
         jj=jj+1
     mantidplot.plot(outdat,(1,2,3),2)
     return outdat
@@ -1212,30 +1280,7 @@ def export_masks(ws,fileName='',returnMasks=False):
  
  
     ws_name=pws.getName()       
-    nhist = pws.getNumberHistograms()
- 
-    masks = []
-    for i in range(nhist):
-        # set provisional spectra ID
-        ms = i+1
-        try: 
-            sp = pws.getSpectrum(i)
-            # got real spectra ID, which would correspond real spectra num to spectra ID map
-            ms = sp.getSpectrumNo();
-        except Exception: 
-            print " Can not get spectra No: ",i
-            masks.append(ms) 
-            continue        
-        
-        try:
-            det = pws.getDetector(i)
-        except Exception:
-            masks.append(ms)        
-            continue
-        if det.isMasked():
-            masks.append(ms)
- 
-      
+    masks = get_masked_spectra(pws)
 
     nMasks = len(masks);
     if nMasks == 0:
@@ -1254,17 +1299,45 @@ def export_masks(ws,fileName='',returnMasks=False):
     else:
         writeISISmasks(filename,masks,8)
         
-        
-def flushOutString(f,OutString,BlockSize,BlockLimit):
+
+def get_masked_spectra(ws):
+    """Returns numpy array of the numbers of the masked spectra of the workspace
+       Spectra without detectors are considered masked.
+
+       The masked flags are extracted for all spectra at once by ExtractMask 
+       and the spectra numbers are taken from the spectra axis. ExtractMask
+       reports the spectra without detectors as unmasked, they are added here.
+    """
+    mask_ws = '__'+ws.getName()+'_masks'
+    ExtractMask(InputWorkspace=ws,OutputWorkspace=mask_ws)
+    try:
+        masked = mtd[mask_ws].extractY()[:,0] > 0
+    finally:
+        DeleteWorkspace(mask_ws)
+    no_detectors = numpy.array([len(ws.getSpectrum(i).getDetectorIDs()) == 0 for i in range(ws.getNumberHistograms())],dtype=bool)
+    masked = masked | no_detectors
+
+    spectra_axis = ws.getAxis(1)
+    if spectra_axis.isSpectra():
+        spec_nums = numpy.asarray(spectra_axis.extractValues(),dtype=int)
+    else:
+        # provisional spectra ID
+        spec_nums = numpy.arange(1,ws.getNumberHistograms()+1)
+    return spec_nums[masked]
+
+
+def mask_ranges(masks):
     """Internal function for writeISISmasks procedure   
+       Compresses array of spectra numbers into the (first,last) arrays of the
+       runs of consecutive numbers, e.g. 1,2,3,4,20,30,31,32 -> (1,20,30),(4,20,32)
     """
-    BlockSize+=1;
-    if BlockSize >= BlockLimit: 
-       if len(OutString)>0:
-           f.write(OutString+'\n');
-       OutString = ''
-       BlockSize = 0
-    return (f,BlockSize,OutString)
+    masks = numpy.asarray(masks,dtype=int)
+    if len(masks) == 0:
+        return (masks,masks)
+    breaks = numpy.nonzero(numpy.diff(masks) != 1)[0]
+    first = masks[numpy.concatenate(([0],breaks+1))]
+    last  = masks[numpy.concatenate((breaks,[len(masks)-1]))]
+    return (first,last)
 
     
 def  writeISISmasks(filename,masks,nSpectraInRow=8):
@@ -1275,9 +1348,9 @@ def  writeISISmasks(filename,masks,nSpectraInRow=8):
         file will have the following ascii stgings:
         1-4 20 30-32
         
-        nSpectaInRow indicates the number of the separate spectra ID (numbers) which the program 
-        needs to fit into one row. For the example above the number has to be 5 or more 
-        to fit all spectra into a single row. Setting it to one will produce 8 rows with single number in each.
+        nSpectaInRow indicates the number of the separate spectra ID (numbers) or ranges which the program 
+        needs to fit into one row. For the example above the number has to be 3 or more 
+        to fit all spectra into a single row. Setting it to one will produce 3 rows with single number or range in each.
     
     Usage: 
     >>writeISISmasks(fileName,masks)
@@ -1289,50 +1362,52 @@ def  writeISISmasks(filename,masks,nSpectraInRow=8):
     if len(ext) == 0 :
         filename=filename+'.msk'
 
-    f = open(filename,'w')   
-    
-    # prepare and write mask data in conventional msk format
+    # prepare mask data in conventional msk format
     # where adjusted spectra are separated by - sign
-    OutString   = ''
-    LastSpectraN= ''
-    BlockSize = 0;
-    iDash = 0;
-    im1=masks[0]
-    for i in masks:       
-        if len(OutString)== 0:
-            OutString = str(i)        
-            (f,BlockSize,OutString) = flushOutString(f,OutString,BlockSize,nSpectraInRow)
-            im1 = i  
-            continue
-        # if the current spectra is different from the previous one by 1 only, we may want to skip it
-        if im1+1 == i :
-            LastSpectraN = str(i)
-            iDash += 1;
-        else :  # it is different and should be dealt separately
-            if iDash > 0 :
-                OutString = OutString+'-'+LastSpectraN
-                iDash = 0
-                LastSpectraN=''
-                # write the string if it is finished
-                (f,BlockSize,OutString) = flushOutString(f,OutString,BlockSize,nSpectraInRow)
-
-      
-            if len(OutString) == 0:
-                OutString = str(i)
-            else:
-                OutString = OutString + ' ' + str(i)
-            # write the string if it is finished
-            (f,BlockSize,OutString) = flushOutString(f,OutString,BlockSize,nSpectraInRow)             
-        #endif
-      
-        # current spectra is the previous now
-        im1 = i  
-    # end masks loop
-    if iDash > 0 :
-        OutString = OutString+'-'+LastSpectraN   
-    (f,OutString,BlockSize)=flushOutString(f,OutString,BlockSize,0)                   
+    (first,last) = mask_ranges(masks)
+    blocks = [str(i1) if i1 == i2 else str(i1)+'-'+str(i2) for (i1,i2) in zip(first.tolist(),last.tolist())]
+    nSpectraInRow = max(1,nSpectraInRow)
+    rows = [' '.join(blocks[i:i+nSpectraInRow]) for i in range(0,len(blocks),nSpectraInRow)]
+
+    f = open(filename,'w')   
+    if len(rows) > 0:
+        f.write('\n'.join(rows)+'\n')
     f.close();
 
+
+def readISISmasks(filename,spectra=None):
+    """Function reads ISIS mask file written by writeISISmasks (inverse of writeISISmasks)
+    
+    Usage: 
+    >>masks=readISISmasks(fileName) 
+      returns numpy array of the masked spectra numbers
+    >>flags=readISISmasks(fileName,spectra) 
+      returns numpy boolean array, True for the spectra numbers in array spectra 
+      which are masked, e.g. spectra=ws.getAxis(1).extractValues()
+    """
+    f = open(filename,'r')
+    tokens = f.read().split()
+    f.close()
+
+    first = []
+    last  = []
+    for token in tokens:
+        limits = token.split('-')
+        first.append(int(limits[0]))
+        last.append(int(limits[-1]))
+    first = numpy.array(first,dtype=int)
+    last  = numpy.array(last,dtype=int)
+
+    # expand the ranges: the offset from the start of each range
+    nInRange = last-first+1
+    starts = numpy.repeat(first,nInRange)
+    offsets = numpy.arange(nInRange.sum()) - numpy.repeat(numpy.cumsum(nInRange)-nInRange,nInRange)
+    masks = starts+offsets
+
+    if spectra is None:
+        return masks
+    return numpy.in1d(numpy.asarray(spectra,dtype=int),masks)
+
 def convertDetDataToNexus(detDotDatFileName):
     """ Function converts ascii det.Dat file,which describes detector positions and delay times
         into nexus file format. Both formats are recognizable by Mantid, LoadDetectorInfo algorithm but 
@@ -1512,6 +1587,7 @@ def help(*args):
         print '\t''normalise(*args) '
         print '\t''rebin(wksp_in,params) '
         print '\t''integrate_over_runs(runstart,runstop,tmin,tmax,specmin,specmax) '	
+        print '\t''integrate_runs(runs,tmin,tmax,specmin,specmax) '
         print '\t''Log(wksp_in) '	
         print '\t''Ln(wksp_in) '
         print '\t''etrans(*args) '
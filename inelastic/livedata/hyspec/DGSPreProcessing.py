@@ -1,4 +1,44 @@
-# The incident energy needs to be given to DgsReduction because the 'EnergyRequest' log will not contain a value for every chunk after the first one
-ei = mtd['__dgs-interim'].getRun().getLogData('Ei').value if mtd.workspaceExists('__dgs-interim') else GetEi(InputWorkspace=input,FixEi='1').getPropertyValue('IncidentEnergy')
+from math import sqrt, cos, radians, floor, ceil, fabs
+import sys
+sys.path.append('/SNS/HYSA/shared/adara')
+from LiveContext import getContext
 
-DgsReduction(SampleInputWorkspace=input,OutputWorkspace=output,IncidentEnergyGuess=ei,UseIncidentEnergyGuess=1,HardMaskFile=r'/SNS/HYSA/shared/adara/MonsterMask.xml',SofPhiEIsDistribution=0,RejectZeroBackground=0)
+# Each chunk is reduced to S(Q,E) here and added to the accumulation workspace, so an update costs the same
+# whatever the number of counts already accumulated. The post-processing only transposes the accumulated S(Q,E).
+
+# The incident energy needs to be given to DgsReduction because the 'EnergyRequest' log will not contain a value for every chunk after the first one.
+# It is kept, with the grouping workspace, in the context of the view between chunks
+context = getContext('Live:DGSReduction', input)
+
+DgsReduction(SampleInputWorkspace=input,OutputWorkspace=input,IncidentEnergyGuess=context.ei,UseIncidentEnergyGuess=1,HardMaskFile=r'/SNS/HYSA/shared/adara/MonsterMask.xml',SofPhiEIsDistribution=0,RejectZeroBackground=0)
+GroupDetectors(InputWorkspace=input,OutputWorkspace=input,CopyGroupingFromWorkspace=context.grouping(r'/SNS/HYSA/shared/adara/HYS_Grouping_2x.xml'),Behaviour='Average')
+
+if mtd.workspaceExists('__dgs-interim'):
+	# Every chunk must be binned like the accumulated S(Q,E) to be added to it
+	qvals = mtd['__dgs-interim'].getAxis(1).extractValues()
+	Qbinning = qvals[0], qvals[1]-qvals[0], qvals[qvals.size-1]
+else:
+	# All this is to work out the Q range to pass to SofQW
+	Ei = input.getRun().getProperty('Ei').value
+	S2 = fabs(input.getRun().getProperty('s2').value[0])
+
+	xvals = input.readX(0)
+	dE = [ xvals[0], 0.0, xvals[xvals.size-1] ]
+
+	factor = 2.072194
+
+	Qlo = []
+	Qhi = []
+	for E in dE:
+		kf2 = (Ei-E)/factor
+		ki2 = Ei/factor
+		Qhi.append( sqrt(ki2+kf2-(2*sqrt(ki2)*sqrt(kf2)*cos(radians(S2+30)))) )
+		Qlo.append( sqrt(ki2+kf2-(2*sqrt(ki2)*sqrt(kf2)*cos(radians(S2-30)))) )
+
+	Qbin = 0.05
+	Qmin = floor(min(Qlo))+Qbin  # Bringing in the limit from an exact integer means less whitespace around the plot
+	Qmax = ceil(max(Qhi))-Qbin
+	Qbinning = Qmin, Qbin, Qmax
+	# Done working out Q binning
+
+SofQW3(InputWorkspace=input,OutputWorkspace=output,QAxisBinning=Qbinning,EMode='Direct')
@@ -3,11 +3,15 @@
 ######################################################################
 
 wsName="Live:DGSReduction"
+import sys
+sys.path.append('/SNS/HYSA/shared/adara')
+from LiveContext import resetContext
+resetContext(wsName)
 
 prescript = open('/SNS/HYSA/shared/adara/DGSPreProcessing.py').read()
 postscript = open('/SNS/HYSA/shared/adara/DGSPostProcessing.py').read()
 
-StartLiveData(UpdateEvery='10',Instrument='HYSPECA',ProcessingScript=prescript,PreserveEvents='1',PostProcessingScript=postscript,EndRunBehavior='Stop',AccumulationWorkspace='__dgs-interim',OutputWorkspace=wsName)
+StartLiveData(UpdateEvery='10',Instrument='HYSPECA',ProcessingScript=prescript,PreserveEvents='0',AccumulationMethod='Add',PostProcessingScript=postscript,EndRunBehavior='Stop',AccumulationWorkspace='__dgs-interim',OutputWorkspace=wsName)
 
 sqw_mat = importMatrixWorkspace(wsName)
 sqw_g = sqw_mat.plotGraph2D()
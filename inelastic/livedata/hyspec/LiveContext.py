@@ -0,0 +1,82 @@
+"""
+State of the HYSPEC live data views kept between the processing of two chunks.
+
+The processing scripts are run again for every chunk but this module is only imported once, so the
+source distance, the incident energy, the TOF binning and the grouping workspaces are worked out on the
+first chunk. They stay fixed until resetContext, as every chunk must be binned like the accumulated
+workspace it is added to. Each view has its own context:
+
+import sys
+sys.path.append('/SNS/HYSA/shared/adara')
+from LiveContext import getContext
+context = getContext('Live:TubeTOF', input)
+Rebin(InputWorkspace=input,OutputWorkspace=input,Params=context.tofbinning)
+
+The view scripts call resetContext() when the live data is (re)started, e.g. after changing the incident energy.
+"""
+from math import fabs, sqrt
+from mantid.simpleapi import *
+
+l2 = 4.54 # Rough average
+
+_contexts = {}
+
+class LiveContext(object):
+	def __init__(self, name):
+		self.name = name
+		self.l1 = None
+		self.ei = None
+		self.tofbinning = None
+		self.groupings = {}
+
+	def update(self, input):
+		"""Work out the incident energy and the TOF binning from the first chunk, they are kept until resetContext"""
+		if self.l1 is None:
+			self.l1 = fabs(input.getInstrument().getSource().getPos().getZ())
+		if self.ei is not None:
+			return
+		ei = requestedEnergy(input)
+		if ei is None:
+			ei = float(GetEi(InputWorkspace=input,FixEi='1').getPropertyValue('IncidentEnergy'))
+		self.ei = ei
+		# Work out (roughly) the tof range based on the incident energy
+		tof = (self.l1 + l2) * sqrt(1.675e-27/2/1.602e-22/ei) * 1e6
+		tofmin = tof-10000 if tof > 10000 else 0
+		self.tofbinning = tofmin, 100, tof+10000
+
+	def grouping(self, mapfile):
+		"""Name of a grouping workspace made from the map file, which is only read the first time"""
+		if not self.groupings.has_key(mapfile) or not mtd.workspaceExists(self.groupings[mapfile]):
+			wsname = '__%s-grouping%d' % (self.name, len(self.groupings))
+			LoadDetectorsGroupingFile(InputFile=mapfile,OutputWorkspace=wsname)
+			self.groupings[mapfile] = wsname
+		return self.groupings[mapfile]
+
+def requestedEnergy(input):
+	"""The last value of the 'EnergyRequest' log of the chunk, None if the chunk does not have one"""
+	run = input.getRun()
+	if not run.hasProperty('EnergyRequest'):
+		return None
+	values = run.getProperty('EnergyRequest').value
+	try:
+		if len(values) == 0:
+			return None
+		return float(values[len(values)-1])
+	except TypeError:
+		return float(values)
+
+def getContext(name, input):
+	"""The context of the view, brought up to date with the chunk"""
+	if not _contexts.has_key(name):
+		_contexts[name] = LiveContext(name)
+	context = _contexts[name]
+	context.update(input)
+	return context
+
+def resetContext(name):
+	"""Forget the context of the view, e.g. when its live data is started again"""
+	if _contexts.has_key(name):
+		context = _contexts.pop(name)
+		for wsname in context.groupings.values():
+			if mtd.workspaceExists(wsname):
+				mtd.remove(wsname)
@@ -1,5 +1,9 @@
 wsName = 'Live:TotalCounts'
 mtd.remove(wsName)
+import sys
+sys.path.append('/SNS/HYSA/shared/adara')
+from LiveContext import resetContext
+resetContext(wsName)
 prescript = open('/SNS/HYSA/shared/adara/TotalCountsPreProcessing.py').read()
 
 StartLiveData(UpdateEvery='5',Instrument='HYSPECA',ProcessingScript=prescript,PreserveEvents='0',EndRunBehavior='Stop',OutputWorkspace=wsName)
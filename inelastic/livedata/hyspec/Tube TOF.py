@@ -1,5 +1,9 @@
 wsName = 'Live:TubeTOF'
 mtd.remove(wsName)
+import sys
+sys.path.append('/SNS/HYSA/shared/adara')
+from LiveContext import resetContext
+resetContext(wsName)
 prescript = open('/SNS/HYSA/shared/adara/TubeTOFPreProcessing.py').read()
 
 StartLiveData(UpdateEvery='5',Instrument='HYSPECA',ProcessingScript=prescript,EndRunBehavior='Stop',OutputWorkspace=wsName)
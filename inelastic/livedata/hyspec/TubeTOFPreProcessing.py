@@ -1,15 +1,8 @@
-from math import fabs, sqrt
-# Work out (roughly) the tof range based on the incident energy
-l1 = fabs(input.getInstrument().getSource().getPos().getZ())
-l2 = 4.54 # Rough average
-ltot = l1 + l2
-
-ei = mtd['Live:TubeTOF'].getRun().getLogData('Ei').value if mtd.workspaceExists('Live:TubeTOF') else GetEi(InputWorkspace=input,FixEi='1').getPropertyValue('IncidentEnergy')
-
-tof = ltot * sqrt(1.675e-27/2/1.602e-22/float(ei)) * 1e6
-
-tofmin = tof-10000 if tof > 10000 else 0
-binning = tofmin, 100, tof+10000
-
-Rebin(InputWorkspace=input,OutputWorkspace=input,Params=binning)
-GroupDetectors(InputWorkspace=input,OutputWorkspace=output,MapFile='/SNS/HYSA/shared/adara/128x1pixels.xml')
+import sys
+sys.path.append('/SNS/HYSA/shared/adara')
+from LiveContext import getContext
+# The TOF range and the grouping are worked out on the first chunk, until the live data is restarted
+context = getContext('Live:TubeTOF', input)
+
+Rebin(InputWorkspace=input,OutputWorkspace=input,Params=context.tofbinning)
+GroupDetectors(InputWorkspace=input,OutputWorkspace=output,CopyGroupingFromWorkspace=context.grouping('/SNS/HYSA/shared/adara/128x1pixels.xml'))
@@ -7,67 +7,147 @@ except ImportError:
   pass
 #import qti as qti
 import numpy as n
+import os
+import threading
+import hashlib
 
-def addRuns(runlist,wname):
-  #DeleteWorkspace(str(wname))
-  output=str(wname)
-  if runlist[0] != "0":
-    #nzeros=8-len(str(runlist[0]))
-    #fpad=""
-    #for i in range(nzeros):
-    #  fpad+="0"
-    #filename="offspec"+fpad+str(runlist[0])+".nxs"
-    #fname=str(FileFinder.findRuns(filename))
-    #fname=str.replace(fname,'\\','/')
-    #fname=str.replace(fname,'[','')
-    #fname=str.replace(fname,']','')
-    #fname=str.replace(fname,'\'','')
-    #fname=fname.lower()
-    ##fname=str.replace(fname,'.nxs','.raw')
-    #Load(fname,output)
-	Load(str(runlist[0]),OutputWorkspace=output)
-  else:
-    #dae="ndx"+mtd.settings['default.instrument'].lower()
-    dae="ndxoffspec"
-    LoadDAE(DAEname=dae,OutputWorkspace=output,SpectrumMin="1")
-    #LoadLiveData(Instrument="OFFSPEC",AccumulationMethod="Replace",OutputWorkspace="output")
-    if(mtd[output].isGroup()):
-    	for k in mtd[output].getNames():
-    		mtd[k].setYUnit('Counts')
-    else:
-    	mtd[output].setYUnit('Counts')
+#
+# Cache of the summed runs of addRuns, so that reductions using the same runs (e.g. direct beams reused
+# for several angles, or a reduction run again with other rebin parameters) do not load the raw files again.
+# The entries are keyed by the run list and the loader options. RUNCACHE_SIZE summed workspaces are kept
+# in memory (as hidden workspaces), the least recently used are dropped or, if RUNCACHE_DIR is set, saved
+# there as processed NeXus and loaded from there when needed again. Live data (run "0") is never cached.
+# The spilled files are named after a hash of the key, which is also written to a .key file next to them
+# and checked when they are loaded, so several sessions can share RUNCACHE_DIR.
+#
+RUNCACHE_SIZE=8
+RUNCACHE_DIR=None
+RUNCACHE_LOADTHREADS=4
+# [key, cache workspace name, processed NeXus file or None], least recently used first
+_runcache=[]
+_runcachecount=[0]
 
-  if len(runlist) > 1:
-    for i in range(1,len(runlist)):
-      if runlist[i] != "0":
-        #nzeros=8-len(str(runlist[i]))
-        #fpad=""
-        #for j in range(nzeros):
-        #  fpad+="0"
-        #filename="offspec"+fpad+str(runlist[i])+".nxs"
-        #fname=str(FileFinder.findRuns(filename))
-        #fname=str.replace(fname,'\\','/')
-        #fname=str.replace(fname,'[','')
-        #fname=str.replace(fname,']','')
-        #fname=str.replace(fname,'\'','')
-        #fname=fname.lower()
-        ##fname=str.replace(fname,'.nxs','.raw')
-        #Load(fname,"wtemp")
-		Load(str(runlist[i]),"wtemp")
-      else:
-		#dae="ndx"+mtd.settings['default.instrument'].lower()
-		dae="ndxoffspec"
-		LoadDAE(DAEname=dae,OutputWorkspace="wtemp",SpectrumMin="1")
-		#LoadLiveData(Instrument="OFFSPEC",AccumulationMethod="Replace",OutputWorkspace="output")
-		if(mtd['wtemp'].isGroup()):
-			for k in mtd['wtemp'].getNames():
-				mtd[k].setYUnit('Counts')
-		else:
-			mtd[output].setYUnit('Counts')
-      Plus(output,"wtemp",output)
-      DeleteWorkspace("wtemp")
+def setRunCache(size=8,spilldir=None,loadthreads=4):
+	global RUNCACHE_SIZE,RUNCACHE_DIR,RUNCACHE_LOADTHREADS
+	RUNCACHE_SIZE=int(size)
+	RUNCACHE_DIR=spilldir
+	RUNCACHE_LOADTHREADS=int(loadthreads)
+	_trimRunCache()
+
+def clearRunCache():
+	for entry in _runcache:
+		if mtd.workspaceExists(entry[1]):
+			DeleteWorkspace(entry[1])
+		if entry[2]:
+			for f in [entry[2],entry[2]+".key"]:
+				if os.path.exists(f):
+					os.remove(f)
+	del _runcache[:]
+
+def _runCacheFile(key):
+	return os.path.join(RUNCACHE_DIR,"runcache_"+hashlib.md5(repr(key)).hexdigest()+".nxs")
+
+def _spilledKey(filename):
+	# key written next to a spilled file, None if there is none
+	try:
+		f=open(filename+".key",'r')
+		key=f.read()
+		f.close()
+		return key
+	except IOError:
+		return None
+
+def _trimRunCache():
+	inmemory=[entry for entry in _runcache if mtd.workspaceExists(entry[1])]
+	for entry in inmemory[:max(len(inmemory)-RUNCACHE_SIZE,0)]:
+		if RUNCACHE_DIR:
+			if not os.path.isdir(RUNCACHE_DIR):
+				os.makedirs(RUNCACHE_DIR)
+			entry[2]=_runCacheFile(entry[0])
+			# written under a temporary name first, another session may be reading the file
+			tmpfile=entry[2]+".%d.tmp.nxs" % os.getpid()
+			SaveNexusProcessed(InputWorkspace=entry[1],Filename=tmpfile)
+			f=open(entry[2]+".key",'w')
+			f.write(repr(entry[0]))
+			f.close()
+			os.rename(tmpfile,entry[2])
+		DeleteWorkspace(entry[1])
+		if not entry[2]:
+			_runcache.remove(entry)
 
-  #mtd.sendLogMessage("addRuns Completed")
+def getCachedRuns(key,output):
+	# copy the cached sum of the runs to output, returns False if they are not cached
+	for entry in _runcache:
+		if entry[0] == key:
+			if not mtd.workspaceExists(entry[1]):
+				if not (entry[2] and os.path.exists(entry[2]) and _spilledKey(entry[2]) == repr(key)):
+					_runcache.remove(entry)
+					return False
+				LoadNexusProcessed(Filename=entry[2],OutputWorkspace=entry[1])
+			_runcache.remove(entry)
+			_runcache.append(entry)
+			CloneWorkspace(InputWorkspace=entry[1],OutputWorkspace=output)
+			_trimRunCache()
+			return True
+	return False
+
+def cacheRuns(key,output):
+	if RUNCACHE_SIZE <= 0:
+		return
+	_runcachecount[0]+=1
+	name="__runcache"+str(_runcachecount[0])
+	CloneWorkspace(InputWorkspace=output,OutputWorkspace=name)
+	_runcache.append([key,name,None])
+	_trimRunCache()
+
+def loadRuns(runs,names):
+	# Load the runs into the workspaces names, RUNCACHE_LOADTHREADS at a time
+	errors=[]
+	def load(k):
+		try:
+			Load(str(runs[k]),OutputWorkspace=names[k])
+		except Exception, e:
+			errors.append(e)
+	for start in range(0,len(runs),max(RUNCACHE_LOADTHREADS,1)):
+		threads=[threading.Thread(target=load,args=(k,)) for k in range(start,min(start+max(RUNCACHE_LOADTHREADS,1),len(runs)))]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+	if errors:
+		raise errors[0]
+
+def loadDAE(output):
+	#dae="ndx"+mtd.settings['default.instrument'].lower()
+	dae="ndxoffspec"
+	LoadDAE(DAEname=dae,OutputWorkspace=output,SpectrumMin="1")
+	#LoadLiveData(Instrument="OFFSPEC",AccumulationMethod="Replace",OutputWorkspace="output")
+	if(mtd[output].isGroup()):
+		for k in mtd[output].getNames():
+			mtd[k].setYUnit('Counts')
+	else:
+		mtd[output].setYUnit('Counts')
+
+def addRuns(runlist,wname):
+	# Sum the runs of runlist ("0" for the live data of the DAE) into the workspace wname
+	output=str(wname)
+	key=("Load",)+tuple([str(r) for r in runlist])
+	cache=not ("0" in key)
+	if cache and getCachedRuns(key,output):
+		return
+	# the first run goes directly into the output, the others into temporary workspaces
+	names=[output]+["__addruns"+str(k) for k in range(1,len(runlist))]
+	files=[k for k in range(len(runlist)) if runlist[k] != "0"]
+	loadRuns([runlist[k] for k in files],[names[k] for k in files])
+	for k in range(len(runlist)):
+		if runlist[k] == "0":
+			loadDAE(names[k])
+		if k > 0:
+			Plus(output,names[k],output)
+			DeleteWorkspace(names[k])
+	if cache:
+		cacheRuns(key,output)
+	#mtd.sendLogMessage("addRuns Completed")
 #
 #===================================================================================================================
 #
@@ -283,6 +363,88 @@ def removeoutlayer(wksp):
 				a1.dataY(i)[j]=0.0;
 				a1.dataE(i)[j]=0.0;
 
+def extractArrays(a1):
+	# X, Y and E of all the spectra of a workspace as 2D numpy arrays
+	try:
+		return a1.extractX(),a1.extractY(),a1.extractE()
+	except AttributeError:
+		nspec=a1.getNumberHistograms()
+		x=n.array([a1.readX(l) for l in range(nspec)])
+		y=n.array([a1.readY(l) for l in range(nspec)])
+		e=n.array([a1.readE(l) for l in range(nspec)])
+		return x,y,e
+
+def nrSESANSTransform(wksp,SEConst=None,lnPOverLam=True,lamScale=1.0):
+	# Converts, in place, the polarisation of all the spectra of wksp to ln(P)/lambda^2 (lambda in nm
+	# multiplied by lamScale, bins with P <= 0 set to 0) and, if SEConst is given, the wavelength bin
+	# boundaries to spin echo length 1e-2*SEConst*lambda^2.
+	# The arrays are read once and written back once per spectrum, the arithmetic is done with numpy.
+	a1=mantid.getMatrixWorkspace(wksp)
+	nspec=a1.getNumberHistograms()
+	x,y,e=extractArrays(a1)
+	if lnPOverLam:
+		lam2=(((x[:,:-1]+x[:,1:])/2.0)/10.0*lamScale)**2
+		good=y > 0.0
+		newy=n.zeros(y.shape)
+		newe=n.zeros(e.shape)
+		newy[good]=n.log(y[good])/lam2[good]
+		newe[good]=(e[good]/y[good])/lam2[good]
+		for l in range(nspec):
+			a1.dataY(l)[:]=newy[l]
+			a1.dataE(l)[:]=newe[l]
+	if SEConst is not None:
+		newx=1.0e-2*float(SEConst)*x*x
+		for l in range(nspec):
+			a1.dataX(l)[:]=newx[l]
+
+def nrPolarisation(upWksp,downWksp,outWksp,upMon,downMon,monIndex,startIndex=0,endIndex=None,sumSpectra=False):
+	# Polarisation (up-down)/(up+down) of the up and down period workspaces, each normalised by its
+	# monitor (spectrum monIndex of upMon/downMon), computed in one pass with numpy instead of the
+	# Divide, Minus, Plus, Divide and ReplaceSpecialValues chain and its temporary workspaces.
+	# The detector spectra startIndex to endIndex are summed if sumSpectra (1D), otherwise kept (2D).
+	# The errors are propagated for P=(a-b)/(a+b), a and b being the normalised up and down counts,
+	# and bins where P is not finite are set to 0 (value and error).
+	up=mantid.getMatrixWorkspace(upWksp)
+	if endIndex is None:
+		endIndex=up.getNumberHistograms()-1
+	x,yu,eu=extractArrays(up)
+	x,yd,ed=extractArrays(mantid.getMatrixWorkspace(downWksp))
+	yu=yu[startIndex:endIndex+1]
+	eu=eu[startIndex:endIndex+1]
+	yd=yd[startIndex:endIndex+1]
+	ed=ed[startIndex:endIndex+1]
+	if sumSpectra:
+		yu=yu.sum(axis=0)[n.newaxis,:]
+		eu=n.sqrt((eu*eu).sum(axis=0))[n.newaxis,:]
+		yd=yd.sum(axis=0)[n.newaxis,:]
+		ed=n.sqrt((ed*ed).sum(axis=0))[n.newaxis,:]
+	a1=mantid.getMatrixWorkspace(upMon)
+	mu=n.array(a1.readY(monIndex))
+	emu=n.array(a1.readE(monIndex))
+	a1=mantid.getMatrixWorkspace(downMon)
+	md=n.array(a1.readY(monIndex))
+	emd=n.array(a1.readE(monIndex))
+	err=n.seterr(divide='ignore',invalid='ignore')
+	a=yu/mu
+	ea=n.sqrt((eu/mu)**2+(yu*emu/(mu*mu))**2)
+	b=yd/md
+	eb=n.sqrt((ed/md)**2+(yd*emd/(md*md))**2)
+	s=a+b
+	pol=(a-b)/s
+	epol=2.0*n.sqrt((b*ea)**2+(a*eb)**2)/(s*s)
+	n.seterr(**err)
+	bad=~(n.isfinite(pol) & n.isfinite(epol))
+	pol[bad]=0.0
+	epol[bad]=0.0
+	if sumSpectra:
+		CropWorkspace(InputWorkspace=upWksp,OutputWorkspace=outWksp,StartWorkspaceIndex=startIndex,EndWorkspaceIndex=startIndex)
+	else:
+		CropWorkspace(InputWorkspace=upWksp,OutputWorkspace=outWksp,StartWorkspaceIndex=startIndex,EndWorkspaceIndex=endIndex)
+	a1=mantid.getMatrixWorkspace(outWksp)
+	for l in range(pol.shape[0]):
+		a1.dataY(l)[:]=pol[l]
+		a1.dataE(l)[:]=epol[l]
+
 def nrSESANSFn(runList,nameList,P0runList,P0nameList,minSpec,maxSpec,upPeriod,downPeriod,existingP0,SEConstants,gparams,convertToSEL,lnPOverLam,diagnostics="0",removeoutlayer="0",floodfile="none",):
 	nlist=parseNameList(nameList)
 	mtd.sendLogMessage("This is the sample nameslist:"+str(nlist))
@@ -316,40 +478,22 @@ def nrSESANSFn(runList,nameList,P0runList,P0nameList,minSpec,maxSpec,upPeriod,do
 		if (removeoutlayer != "0"):
 			removeoutlayer(i+"_1")
 			removeoutlayer(i+"_2")
-		CropWorkspace(InputWorkspace=i,OutputWorkspace=i+"mon",StartWorkspaceIndex=mon_spec,EndWorkspaceIndex=mon_spec)
 		if nspec == 245:
 			CropWorkspace(InputWorkspace=i,OutputWorkspace=i+"2ddet",StartWorkspaceIndex=4,EndWorkspaceIndex=243)
 			if (floodfile != "none"):
 				floodnorm(i+"2ddet",floodfile)
 		if nspec == 1030:
 			CropWorkspace(InputWorkspace=i,OutputWorkspace=i+"2ddet",StartWorkspaceIndex=3,EndWorkspaceIndex=124)
-		if int(maxSpec) > int(minSpec):
-			SumSpectra(InputWorkspace=i,OutputWorkspace=i+"det",StartWorkspaceIndex=minSp,EndWorkspaceIndex=maxSp)
-		else:
-			CropWorkspace(InputWorkspace=i,OutputWorkspace=i+"det",StartWorkspaceIndex=minSp,EndWorkspaceIndex=maxSp)
+		if (diagnostics != "0"):
+			if int(maxSpec) > int(minSpec):
+				SumSpectra(InputWorkspace=i,OutputWorkspace=i+"det",StartWorkspaceIndex=minSp,EndWorkspaceIndex=maxSp)
+			else:
+				CropWorkspace(InputWorkspace=i,OutputWorkspace=i+"det",StartWorkspaceIndex=minSp,EndWorkspaceIndex=maxSp)
 
-		Divide(LHSWorkspace=i+"det",RHSWorkspace=i+"mon",OutputWorkspace=i+"norm")
+		nrPolarisation(i+"_"+upPeriod,i+"_"+downPeriod,i+"pol",i+"_"+upPeriod,i+"_"+downPeriod,mon_spec,minSp,maxSp,True)
 		if nspec > 4 and minSp != 3:
-			Divide(LHSWorkspace=i+"2ddet",RHSWorkspace=i+"mon",OutputWorkspace=i+"2dnorm")
-		DeleteWorkspace(i+"mon")
-		if (diagnostics == "0"):
-			DeleteWorkspace(i+"det")
+			nrPolarisation(i+"2ddet_"+upPeriod,i+"2ddet_"+downPeriod,i+"2dpol",i+"_"+upPeriod,i+"_"+downPeriod,mon_spec)
 		DeleteWorkspace(i)
-		Minus(LHSWorkspace=i+"norm_"+upPeriod,RHSWorkspace=i+"norm_"+downPeriod,OutputWorkspace="num")
-		Plus(LHSWorkspace=i+"norm_2",RHSWorkspace=i+"norm_1",OutputWorkspace="den")
-		Divide(LHSWorkspace="num",RHSWorkspace="den",OutputWorkspace=i+"pol")
-		ReplaceSpecialValues(InputWorkspace=i+"pol",OutputWorkspace=i+"pol",NanValue=0.0,NaNError=0.0,InfinityValue=0.0,InfinityError=0.0)
-		if nspec >4 and minSp != 3:
-			#print i+"2dnorm_"+upPeriod
-			#print i+"2dnorm_"+downPeriod
-			Minus(LHSWorkspace=i+"2dnorm_"+upPeriod,RHSWorkspace=i+"2dnorm_"+downPeriod,OutputWorkspace="num")
-			Plus(LHSWorkspace=i+"2dnorm_2",RHSWorkspace=i+"2dnorm_1",OutputWorkspace="den")
-			Divide(LHSWorkspace="num",RHSWorkspace="den",OutputWorkspace=i+"2dpol")
-			ReplaceSpecialValues(InputWorkspace=i+"2dpol",OutputWorkspace=i+"2dpol",NanValue=0.0,NaNError=0.0,InfinityValue=0.0,InfinityError=0.0)
-		#DeleteWorkspace(i+"norm_2")
-		#DeleteWorkspace(i+"norm_1")
-		DeleteWorkspace("num")
-		DeleteWorkspace("den")
 		
 	if existingP0 != "2":
 		for i in P0nlist:
@@ -357,23 +501,8 @@ def nrSESANSFn(runList,nameList,P0runList,P0nameList,minSpec,maxSpec,upPeriod,do
 			Rebin(InputWorkspace=i,OutputWorkspace=i,Params=reb)
 			removeoutlayer(i+"_1")
 			removeoutlayer(i+"_2")
-			CropWorkspace(InputWorkspace=i,OutputWorkspace=i+"mon",StartWorkspaceIndex=mon_spec,EndWorkspaceIndex=mon_spec)
-			if int(maxSpec) > int(minSpec):
-				SumSpectra(InputWorkspace=i,OutputWorkspace=i+"det",StartWorkspaceIndex=minSp,EndWorkspaceIndex=maxSp)
-			else:
-				CropWorkspace(InputWorkspace=i,OutputWorkspace=i+"det",StartWorkspaceIndex=minSp,EndWorkspaceIndex=maxSp)
-			Divide(LHSWorkspace=i+"det",RHSWorkspace=i+"mon",OutputWorkspace=i+"norm")
-			DeleteWorkspace(i+"mon")
-			DeleteWorkspace(i+"det")
+			nrPolarisation(i+"_"+upPeriod,i+"_"+downPeriod,i+"pol",i+"_"+upPeriod,i+"_"+downPeriod,mon_spec,minSp,maxSp,True)
 			DeleteWorkspace(i)
-			Minus(LHSWorkspace=i+"norm_"+upPeriod,RHSWorkspace=i+"norm_"+downPeriod,OutputWorkspace="num")
-			Plus(LHSWorkspace=i+"norm_2",RHSWorkspace=i+"norm_1",OutputWorkspace="den")
-			Divide(LHSWorkspace="num",RHSWorkspace="den",OutputWorkspace=i+"pol")
-			ReplaceSpecialValues(InputWorkspace=i+"pol",OutputWorkspace=i+"pol",NanValue=0.0,NaNError=0.0,InfinityValue=0.0,InfinityError=0.0)
-			DeleteWorkspace(i+"norm_2")
-			DeleteWorkspace(i+"norm_1")
-			DeleteWorkspace("num")
-			DeleteWorkspace("den")
 		
 	for i in range(len(nlist)):
 		if existingP0 != "2":
@@ -391,24 +520,10 @@ def nrSESANSFn(runList,nameList,P0runList,P0nameList,minSpec,maxSpec,upPeriod,do
 	for i in nlist:
 		if lnPOverLam == "2":
 			CloneWorkspace(InputWorkspace=i+"SESANS",OutputWorkspace=i+"SESANS_P")
-		a1=mantid.getMatrixWorkspace(i+"SESANS")
-		x=a1.readX(0)
-		for j in range(len(x)-1):
-			lam=((a1.readX(0)[j]+a1.readX(0)[j+1])/2.0)/10.0
-			p=a1.readY(0)[j]
-			e=a1.readE(0)[j]
-			if lnPOverLam == "2":
-				if p > 0.0:
-					a1.dataY(0)[j]=log(p)/((lam)**2)
-					a1.dataE(0)[j]=(e/p)/((lam)**2)
-				else:
-					a1.dataY(0)[j]=0.0
-					a1.dataE(0)[j]=0.0
-		for j in range(len(x)):
-			if convertToSEL == "2":
-				lam=a1.readX(0)[j]
-				a1.dataX(0)[j]=1.0e-2*float(SEConstList[k])*lam*lam
-				#print str(lam)+" "+str(1.0e-2*float(SEConstList[k])*lam*lam)
+		if convertToSEL == "2":
+			nrSESANSTransform(i+"SESANS",SEConstList[k],lnPOverLam == "2")
+		else:
+			nrSESANSTransform(i+"SESANS",None,lnPOverLam == "2")
 		k=k+1
 
 	
@@ -417,26 +532,10 @@ def nrSESANSFn(runList,nameList,P0runList,P0nameList,minSpec,maxSpec,upPeriod,do
 		for i in nlist:
 			if lnPOverLam == "2":
 				CloneWorkspace(InputWorkspace=i+"2dSESANS",OutputWorkspace=i+"2dSESANS_P")
-			a1=mantid.getMatrixWorkspace(i+"2dSESANS")
-			nspec=a1.getNumberHistograms()
-			for l in range(nspec):
-				x=a1.readX(l)
-				for j in range(len(x)-1):
-					lam=((a1.readX(l)[j]+a1.readX(l)[j+1])/2.0)/10.0
-					p=a1.readY(l)[j]
-					e=a1.readE(l)[j]
-					if lnPOverLam == "2":
-						if p > 0.0:
-							a1.dataY(l)[j]=log(p)/((lam*1.0e-9)**2)
-							a1.dataE(l)[j]=(e/p)/((lam*1.0e-9)**2)
-						else:
-							a1.dataY(l)[j]=0.0
-							a1.dataE(l)[j]=0.0
-				for j in range(len(x)):
-					if convertToSEL == "2":
-						lam=a1.readX(l)[j]
-						a1.dataX(l)[j]=1.0e-2*float(SEConstList[k])*lam*lam
-						#print str(lam)+" "+str(1.0e-2*float(SEConstList[k])*lam*lam)
+			if convertToSEL == "2":
+				nrSESANSTransform(i+"2dSESANS",SEConstList[k],lnPOverLam == "2",1.0e-9)
+			else:
+				nrSESANSTransform(i+"2dSESANS",None,lnPOverLam == "2",1.0e-9)
 			k=k+1
 
 #
@@ -489,25 +588,16 @@ def nrSESANSP0Fn(P0runList,P0nameList,minSpec,maxSpec,upPeriod,downPeriod,gparam
 			GroupDetectors(InputWorkspace=i,OutputWorkspace=i,MapFile=mapfile)
 		ConvertUnits(InputWorkspace=i,OutputWorkspace=i,Target="Wavelength",AlignBins=1)
 		Rebin(InputWorkspace=i,OutputWorkspace=i,Params=reb)
-		CropWorkspace(InputWorkspace=i,OutputWorkspace=i+"mon",StartWorkspaceIndex=mon_spec,EndWorkspaceIndex=mon_spec)
-		if int(maxSpec) > int(minSpec):
-			SumSpectra(InputWorkspace=i,OutputWorkspace=i+"det",StartWorkspaceIndex=minSp,EndWorkspaceIndex=maxSp)
-		else:
-			CropWorkspace(InputWorkspace=i,OutputWorkspace=i+"det",StartWorkspaceIndex=minSp,EndWorkspaceIndex=maxSp)
-		Divide(LHSWorkspace=i+"det",RHSWorkspace=i+"mon",OutputWorkspace=i+"norm")
+		nrPolarisation(i+"_"+upPeriod,i+"_"+downPeriod,i+"pol",i+"_"+upPeriod,i+"_"+downPeriod,mon_spec,minSp,maxSp,True)
 		if (diagnostics=="0"):
-			DeleteWorkspace(i+"mon")
-			DeleteWorkspace(i+"det")
 			DeleteWorkspace(i)
-		Minus(LHSWorkspace=i+"norm_"+upPeriod,RHSWorkspace=i+"norm_"+downPeriod,OutputWorkspace="num")
-		Plus(LHSWorkspace=i+"norm_2",RHSWorkspace=i+"norm_1",OutputWorkspace="den")
-		Divide(LHSWorkspace="num",RHSWorkspace="den",OutputWorkspace=i+"pol")
-		ReplaceSpecialValues(InputWorkspace=i+"pol",OutputWorkspace=i+"pol",NanValue=0.0,NaNError=0.0,InfinityValue=0.0,InfinityError=0.0)
-		if (diagnostics=="0"):
-			DeleteWorkspace(i+"norm_2")
-			DeleteWorkspace(i+"norm_1")
-			DeleteWorkspace("num")
-			DeleteWorkspace("den")
+		else:
+			# keep the monitor and detector for inspection
+			CropWorkspace(InputWorkspace=i,OutputWorkspace=i+"mon",StartWorkspaceIndex=mon_spec,EndWorkspaceIndex=mon_spec)
+			if int(maxSpec) > int(minSpec):
+				SumSpectra(InputWorkspace=i,OutputWorkspace=i+"det",StartWorkspaceIndex=minSp,EndWorkspaceIndex=maxSp)
+			else:
+				CropWorkspace(InputWorkspace=i,OutputWorkspace=i+"det",StartWorkspaceIndex=minSp,EndWorkspaceIndex=maxSp)
 #
 #===========================================================
 #
@@ -617,16 +707,7 @@ def nrSERGISFn(runList,nameList,P0runList,P0nameList,incidentAngles,SEConstants,
 	SEConstList=parseNameList(SEConstants)
 	k=0
 	for i in nlist:
-		a1=mantid.getMatrixWorkspace(i+"SESANS")
-		x=a1.readX(0)
-		for j in range(len(x)-1):
-			lam=((a1.readX(0)[j]+a1.readX(0)[j+1])/2.0)/10.0
-			p=a1.readY(0)[j]
-			a1.dataY(0)[j]=log(p)/((lam*1.0e-8)**2)
-		for j in range(len(x)):
-			lam=a1.readX(0)[j]
-			a1.dataX(0)[j]=1.0e-2*float(SEConstList[k])*lam*lam
-			#print str(lam)+" "+str(1.0e-2*float(SEConstList[k])*lam*lam)
+		nrSESANSTransform(i+"SESANS",SEConstList[k],True,1.0e-8)
 		k=k+1
 #
 #===========================================================
@@ -981,170 +1062,52 @@ def NRCombineDatafn(RunsNameList,CombNameList,applySFs,SFList,SFError,scaleOptio
 #===========================================================
 #
 def nrWriteXYE(wksp,fname):
-	a1=mantid.getMatrixWorkspace(wksp)
-	x1=a1.readX(0)
-	X1=n.zeros((len(x1)-1))
-	for i in range(0,len(x1)-1):
-		X1[i]=(x1[i]+x1[i+1])/2.0
-	y1=a1.readY(0)
-	e1=a1.readE(0)
-	f=open(fname,'w')
-	for i in range(len(X1)):
-		s=""
-		s+="%f," % X1[i]
-		s+="%f," % y1[i]
-		s+="%f\n" % e1[i]  
-		f.write(s)
-	f.close()
+	X1,y1,e1=xye(wksp)
+	n.savetxt(fname,n.column_stack((X1,y1,e1)),fmt="%f",delimiter=",")
 #
 #===========================================================
 #
-def nrPNRCorrection(UpWksp,DownWksp,calibration=0):
 #	crho=[0.941893,0.0234006,-0.00210536,0.0]
 #	calpha=[0.945088,0.0242861,-0.00213624,0.0]
 #	cAp=[1.00079,-0.0186778,0.00131546,0.0]
 #	cPp=[1.01649,-0.0228172,0.00214626,0.0]
+# Polarisation efficiency calibrations: polynomial coefficients (in wavelength) of rho, alpha, Ap and Pp
+PolCalibrations={
 	# Constants Based on Runs 18350+18355 and 18351+18356 analyser theta at -0.1deg 
 	# 2 RF Flippers as the polarising system
-	if (calibration == 0):
-		crho=[1.006831,-0.011467,0.002244,-0.000095]
-		calpha=[1.017526,-0.017183,0.003136,-0.000140]
-		cAp=[0.917940,0.038265,-0.006645,0.000282]
-		cPp=[0.972762,0.001828,-0.000261,0.0]
-	elif (calibration == 1):
+	0:([1.006831,-0.011467,0.002244,-0.000095],
+	   [1.017526,-0.017183,0.003136,-0.000140],
+	   [0.917940,0.038265,-0.006645,0.000282],
+	   [0.972762,0.001828,-0.000261,0.0]),
 	# Constants Based on Runs 19438-19458 and 19439+19459 
 	# Drabkin on incident side RF Flipper on analyser side, Dec 2012
-		crho=[0.970257,0.016127,-0.002318,0.000090]
-		calpha=[0.975722,0.012464,-0.002408,0.000105]
-		cAp=[1.030894,-0.040847,0.006069,-0.000247]
-		cPp=[0.961900,-0.003722,0.001094,-0.000057]
-	elif (calibration == 2):
+	1:([0.970257,0.016127,-0.002318,0.000090],
+	   [0.975722,0.012464,-0.002408,0.000105],
+	   [1.030894,-0.040847,0.006069,-0.000247],
+	   [0.961900,-0.003722,0.001094,-0.000057]),
 	# Constants Based on Runs 19628-19656 and 19660-19670 analyser -0.2deg
 	# RF Flippers on polariser and analyser side Feb 2013
-		crho=[0.945927,0.025421,-0.003647,0.000156]
-		calpha=[0.940769,0.027250,-0.003848,0.000164]
-		cAp=[0.974374,-0.005334,0.001313,-0.000115]
-		cPp=[1.023141,-0.024548,0.003398,-0.000134]
-	elif (calibration == 3):
+	2:([0.945927,0.025421,-0.003647,0.000156],
+	   [0.940769,0.027250,-0.003848,0.000164],
+	   [0.974374,-0.005334,0.001313,-0.000115],
+	   [1.023141,-0.024548,0.003398,-0.000134]),
 	# Constants Based on Runs 19628-19656 and 19660-19670 analyser -0.1deg
 	# RF Flippers on polariser and analyser side Feb 2013
-		crho=[0.955384,0.021501,-0.002962,0.000112]
-		calpha=[0.957789,0.019995,-0.002697,0.000099]
-		cAp=[0.986906,-0.013945,0.002480,-0.000161]
-		cPp=[0.999517,-0.013878,0.001680,-0.000043]
+	3:([0.955384,0.021501,-0.002962,0.000112],
+	   [0.957789,0.019995,-0.002697,0.000099],
+	   [0.986906,-0.013945,0.002480,-0.000161],
+	   [0.999517,-0.013878,0.001680,-0.000043]),
+}
+# correction matrices already worked out, keyed by (PNR or PA, calibration, wavelength bin boundaries)
+_polcorrcache={}
 
-	Ip = mtd[UpWksp]
-	Ia = mtd[DownWksp]
-	CloneWorkspace(Ip,"PCalpha")
-	CropWorkspace(InputWorkspace="PCalpha",OutputWorkspace="PCalpha",StartWorkspaceIndex="0",EndWorkspaceIndex="0")
-	PCalpha=(mtd['PCalpha']*0.0)+1.0
-	alpha=mtd['PCalpha']
-	# a1=alpha.readY(0)
-	# for i in range(0,len(a1)):
-		# alpha.dataY(0)[i]=0.0
-		# alpha.dataE(0)[i]=0.0
-	CloneWorkspace("PCalpha","PCrho")
-	CloneWorkspace("PCalpha","PCAp")
-	CloneWorkspace("PCalpha","PCPp")
-	rho=mtd['PCrho']
-	Ap=mtd['PCAp']
-	Pp=mtd['PCPp']
-	# for i in range(0,len(a1)):
-		# x=(alpha.dataX(0)[i]+alpha.dataX(0)[i])/2.0
-		# for j in range(0,4):
-			# alpha.dataY(0)[i]=alpha.dataY(0)[i]+calpha[j]*x**j
-			# rho.dataY(0)[i]=rho.dataY(0)[i]+crho[j]*x**j
-			# Ap.dataY(0)[i]=Ap.dataY(0)[i]+cAp[j]*x**j
-			# Pp.dataY(0)[i]=Pp.dataY(0)[i]+cPp[j]*x**j
-	PolynomialCorrection(InputWorkspace="PCalpha",OutputWorkspace="PCalpha",Coefficients=calpha,Operation="Multiply")
-	PolynomialCorrection(InputWorkspace="PCrho",OutputWorkspace="PCrho",Coefficients=crho,Operation="Multiply")
-	PolynomialCorrection(InputWorkspace="PCAp",OutputWorkspace="PCAp",Coefficients=cAp,Operation="Multiply")
-	PolynomialCorrection(InputWorkspace="PCPp",OutputWorkspace="PCPp",Coefficients=cPp,Operation="Multiply")
+def PNRCorrected(Ip,Ia,rho,alpha,Ap,Pp):
 	D=Pp*(1.0+rho)
 	nIp=(Ip*(rho*Pp+1.0)+Ia*(Pp-1.0))/D
 	nIa=(Ip*(rho*Pp-1.0)+Ia*(Pp+1.0))/D
-	RenameWorkspace(nIp,str(Ip)+"corr")
-	RenameWorkspace(nIa,str(Ia)+"corr")
-	iwksp=mantid.getWorkspaceNames()
-	list=[str(Ip),str(Ia),"PCalpha","PCrho","PCAp","PCPp","1_p"]
-	for i in range(len(iwksp)):
-		for j in list:
-			lname=len(j)
-			if iwksp[i] [0:lname+1] == j+"_":
-				mantid.deleteWorkspace(iwksp[i])
-	mantid.deleteWorkspace("PCalpha")
-	mantid.deleteWorkspace("PCrho")
-	mantid.deleteWorkspace("PCAp")
-	mantid.deleteWorkspace("PCPp")
-	mantid.deleteWorkspace("D")
-#
-#===========================================================
-#
-def nrPACorrection(UpUpWksp,UpDownWksp,DownUpWksp,DownDownWksp,calibration=0):
-#	crho=[0.941893,0.0234006,-0.00210536,0.0]
-#	calpha=[0.945088,0.0242861,-0.00213624,0.0]
-#	cAp=[1.00079,-0.0186778,0.00131546,0.0]
-#	cPp=[1.01649,-0.0228172,0.00214626,0.0]
-	# Constants Based on Runs 18350+18355 and 18351+18356 analyser theta at -0.1deg 
-	# 2 RF Flippers as the polarising system
-	if (calibration == 0):
-		crho=[1.006831,-0.011467,0.002244,-0.000095]
-		calpha=[1.017526,-0.017183,0.003136,-0.000140]
-		cAp=[0.917940,0.038265,-0.006645,0.000282]
-		cPp=[0.972762,0.001828,-0.000261,0.0]
-	elif (calibration == 1):
-	# Constants Based on Runs 19438-19458 and 19439+19459 
-	# Drabkin on incident side RF Flipper on analyser side Dec 2012
-		crho=[0.970257,0.016127,-0.002318,0.000090]
-		calpha=[0.975722,0.012464,-0.002408,0.000105]
-		cAp=[1.030894,-0.040847,0.006069,-0.000247]
-		cPp=[0.961900,-0.003722,0.001094,-0.000057]
-	elif (calibration == 2):
-	# Constants Based on Runs 19628-19656 and 19660-19670 analyser -0.2deg
-	# RF Flippers on polariser and analyser side Feb 2013
-		crho=[0.945927,0.025421,-0.003647,0.000156]
-		calpha=[0.940769,0.027250,-0.003848,0.000164]
-		cAp=[0.974374,-0.005334,0.001313,-0.000115]
-		cPp=[1.023141,-0.024548,0.003398,-0.000134]
-	elif (calibration == 3):
-	# Constants Based on Runs 19628-19656 and 19660-19670 analyser -0.1deg
-	# RF Flippers on polariser and analyser side Feb 2013
-		crho=[0.955384,0.021501,-0.002962,0.000112]
-		calpha=[0.957789,0.019995,-0.002697,0.000099]
-		cAp=[0.986906,-0.013945,0.002480,-0.000161]
-		cPp=[0.999517,-0.013878,0.001680,-0.000043]
-	
-	Ipp = mtd[UpUpWksp]
-	Ipa = mtd[UpDownWksp]
-	Iap = mtd[DownUpWksp]
-	Iaa = mtd[DownDownWksp]
-	CloneWorkspace(Ipp,"PCalpha")
-	CropWorkspace(InputWorkspace="PCalpha",OutputWorkspace="PCalpha",StartWorkspaceIndex="0",EndWorkspaceIndex="0")
-	PCalpha=(mtd['PCalpha']*0.0)+1.0
-	alpha=mtd['PCalpha']
-	# a1=alpha.readY(0)
-	# for i in range(0,len(a1)):
-		# alpha.dataY(0)[i]=0.0
-		# alpha.dataE(0)[i]=0.0
-	CloneWorkspace("PCalpha","PCrho")
-	CloneWorkspace("PCalpha","PCAp")
-	CloneWorkspace("PCalpha","PCPp")
-	rho=mtd['PCrho']
-	Ap=mtd['PCAp']
-	Pp=mtd['PCPp']
-	# for i in range(0,len(a1)):
-		# x=(alpha.dataX(0)[i]+alpha.dataX(0)[i])/2.0
-		# for j in range(0,4):
-			# alpha.dataY(0)[i]=alpha.dataY(0)[i]+calpha[j]*x**j
-			# rho.dataY(0)[i]=rho.dataY(0)[i]+crho[j]*x**j
-			# Ap.dataY(0)[i]=Ap.dataY(0)[i]+cAp[j]*x**j
-			# Pp.dataY(0)[i]=Pp.dataY(0)[i]+cPp[j]*x**j
-	# Use the polynomial corretion fn instead
-	PolynomialCorrection(InputWorkspace="PCalpha",OutputWorkspace="PCalpha",Coefficients=calpha,Operation="Multiply")
-	PolynomialCorrection(InputWorkspace="PCrho",OutputWorkspace="PCrho",Coefficients=crho,Operation="Multiply")
-	PolynomialCorrection(InputWorkspace="PCAp",OutputWorkspace="PCAp",Coefficients=cAp,Operation="Multiply")
-	PolynomialCorrection(InputWorkspace="PCPp",OutputWorkspace="PCPp",Coefficients=cPp,Operation="Multiply")
-	
+	return [nIp,nIa]
+
+def PACorrected(Ipp,Ipa,Iap,Iaa,rho,alpha,Ap,Pp):
 	A0 = (Iaa * Pp * Ap) + (Ap * Ipa * rho * Pp) + (Ap * Iap * Pp * alpha) + (Ipp * Ap * alpha * rho * Pp)
 	A1 = Pp * Iaa
 	A2 = Pp * Iap
@@ -1159,35 +1122,60 @@ def nrPACorrection(UpUpWksp,UpDownWksp,DownUpWksp,DownDownWksp,calibration=0):
 	nIaa = (A0 + A1 - A2 + A3 - A4 - A5 + A6 - A7 + A8 + Ipp + Iaa - Ipa - Iap) / D
 	nIpa = (A0 - A1 + A2 + A3 - A4 - A5 + A6 + A7 - A8 - Ipp - Iaa + Ipa + Iap) / D
 	nIap = (A0 + A1 - A2 - A3 + A4 + A5 - A6 - A7 + A8 - Ipp - Iaa + Ipa + Iap) / D
-	RenameWorkspace(nIpp,str(Ipp)+"corr")
-	RenameWorkspace(nIpa,str(Ipa)+"corr")
-	RenameWorkspace(nIap,str(Iap)+"corr")
-	RenameWorkspace(nIaa,str(Iaa)+"corr")
-	ReplaceSpecialValues(str(Ipp)+"corr",str(Ipp)+"corr",NaNValue="0.0",NaNError="0.0",InfinityValue="0.0",InfinityError="0.0")
-	ReplaceSpecialValues(str(Ipp)+"corr",str(Ipp)+"corr",NaNValue="0.0",NaNError="0.0",InfinityValue="0.0",InfinityError="0.0")
-	ReplaceSpecialValues(str(Ipp)+"corr",str(Ipp)+"corr",NaNValue="0.0",NaNError="0.0",InfinityValue="0.0",InfinityError="0.0")
-	ReplaceSpecialValues(str(Ipp)+"corr",str(Ipp)+"corr",NaNValue="0.0",NaNError="0.0",InfinityValue="0.0",InfinityError="0.0")
-	iwksp=mantid.getWorkspaceNames()
-	list=[str(Ipp),str(Ipa),str(Iap),str(Iaa),"PCalpha","PCrho","PCAp","PCPp","1_p"]
-	for i in range(len(iwksp)):
-		for j in list:
-			lname=len(j)
-			if iwksp[i] [0:lname+1] == j+"_":
-				mantid.deleteWorkspace(iwksp[i])
-	mantid.deleteWorkspace("PCalpha")
-	mantid.deleteWorkspace("PCrho")
-	mantid.deleteWorkspace("PCAp")
-	mantid.deleteWorkspace("PCPp")
-	mantid.deleteWorkspace('A0')
-	mantid.deleteWorkspace('A1')
-	mantid.deleteWorkspace('A2')
-	mantid.deleteWorkspace('A3')
-	mantid.deleteWorkspace('A4')
-	mantid.deleteWorkspace('A5')
-	mantid.deleteWorkspace('A6')
-	mantid.deleteWorkspace('A7')
-	mantid.deleteWorkspace('A8')
-	mantid.deleteWorkspace('D')
+	return [nIpp,nIpa,nIap,nIaa]
+
+def polCorrectionMatrix(corrected,nper,calibration,x):
+	# Matrix M[out,in,bin] of the (linear) correction: corrected intensity out = sum over in of M[out,in]*I[in].
+	# The calibration polynomials are evaluated at the bin centres of x like PolynomialCorrection, and
+	# the matrix is worked out once per correction, calibration and wavelength grid.
+	key=(nper,calibration,x.tostring())
+	if not _polcorrcache.has_key(key):
+		lam=(x[:-1]+x[1:])/2.0
+		curves=[n.polyval(c[::-1],lam) for c in PolCalibrations[calibration]]
+		M=n.zeros((nper,nper,len(lam)))
+		for k in range(nper):
+			unit=[n.zeros(len(lam)) for l in range(nper)]
+			unit[k]=n.ones(len(lam))
+			M[:,k,:]=n.array(corrected(*(unit+curves)))
+		_polcorrcache[key]=M
+	return _polcorrcache[key]
+
+def applyPolCorrection(wksps,corrected,calibration):
+	# Apply the correction to the Y and E of all the spectra of the workspaces at once, the results go to
+	# the workspaces with "corr" appended to the names. The calibration curves are taken without errors,
+	# so the errors are propagated as E_out^2 = sum of (M[out,in]*E_in)^2. Values that are not finite are set to 0.
+	nper=len(wksps)
+	x,y,e=extractArrays(mantid.getMatrixWorkspace(wksps[0]))
+	Y=[y]
+	E=[e]
+	for w in wksps[1:]:
+		x1,y,e=extractArrays(mantid.getMatrixWorkspace(w))
+		Y.append(y)
+		E.append(e)
+	M=polCorrectionMatrix(corrected,nper,calibration,x[0])
+	for o in range(nper):
+		ny=n.zeros(Y[0].shape)
+		ne=n.zeros(E[0].shape)
+		for k in range(nper):
+			ny+=M[o,k]*Y[k]
+			ne+=(M[o,k]*E[k])**2
+		ne=n.sqrt(ne)
+		bad=~(n.isfinite(ny) & n.isfinite(ne))
+		ny[bad]=0.0
+		ne[bad]=0.0
+		CloneWorkspace(InputWorkspace=wksps[o],OutputWorkspace=wksps[o]+"corr")
+		a1=mantid.getMatrixWorkspace(wksps[o]+"corr")
+		for l in range(ny.shape[0]):
+			a1.dataY(l)[:]=ny[l]
+			a1.dataE(l)[:]=ne[l]
+
+def nrPNRCorrection(UpWksp,DownWksp,calibration=0):
+	applyPolCorrection([str(UpWksp),str(DownWksp)],PNRCorrected,calibration)
+#
+#===========================================================
+#
+def nrPACorrection(UpUpWksp,UpDownWksp,DownUpWksp,DownDownWksp,calibration=0):
+	applyPolCorrection([str(UpUpWksp),str(UpDownWksp),str(DownUpWksp),str(DownDownWksp)],PACorrected,calibration)
 #
 #===========================================================
 #
@@ -1322,65 +1310,84 @@ def nrPNRFn(runList,nameList,incidentAngles,DBList,specChan,minSpec,maxSpec,gpar
 #===========================================================
 #
 def tl(wksp,th0,schan):
+	# off-specular map of the workspace: wavelength bin boundaries, theta (degrees) of the pixel
+	# boundaries, intensities and errors, as (nspec+1,ntc+1), (nspec+1,ntc+1), (nspec,ntc), (nspec,ntc) arrays
 	pixel=1.2
 	dist=3630
 	ThetaInc=th0*pi/180.0
 	a1=mantid.getMatrixWorkspace(wksp)
-	y=a1.readY(0)
-	ntc=len(y)
-	nspec=a1.getNumberHistograms()
+	x,y1,e1=extractArrays(a1)
+	nspec,ntc=y1.shape
 	x1=n.zeros((nspec+1,ntc+1))
-	theta=n.zeros((nspec+1,ntc+1))
-	y1=n.zeros((nspec,ntc))
-	e1=n.zeros((nspec,ntc))
-	for i in range(0,nspec):
-		x=a1.readX(i)
-		y=a1.readY(i)
-		e=a1.readE(i)
-		x1[i,0:ntc+1]=x[0:ntc+1]
-		theta[i,:]=atan2( (i - schan-0.5) * pixel + dist * tan(ThetaInc) , dist)*180/pi
-		y1[i,0:ntc]=y[0:ntc]
-		e1[i,0:ntc]=e[0:ntc]
+	x1[0:nspec,:]=x[:,0:ntc+1]
 	x1[nspec,:]=x1[nspec-1,:]
-	theta[nspec,:]=atan2( (nspec - schan-0.5) * pixel + dist * tan(ThetaInc) , dist)*180/pi
-	d1=[x1,theta,y1,e1]
+	# one angle per pixel boundary, the same for all the bins of a row
+	th=n.arctan2((n.arange(nspec+1) - schan-0.5) * pixel + dist * tan(ThetaInc) , dist)*180/pi
+	theta=n.repeat(th[:,n.newaxis],ntc+1,axis=1)
+	d1=[x1,theta,n.array(y1),n.array(e1)]
 	return d1
 #
 #===========================================================
 #
 def writemap_tab(dat,th0,spchan,fname):
 	a1=tl(dat,th0,spchan)
-	f=open(fname,'w')
 	x=a1[0]
 	y=a1[1]
 	z=a1[2]
 	e=a1[3]
-	s="\t"
-	for i in range(0,n.shape(z)[1]-1):
-		s+="%g\t" % ((x[0][i]+x[0][i+1])/2.0)
-		s+="%g\t" % ((x[0][i]+x[0][i+1])/2.0)
-	s+="\n"
-	f.write(s)
-	for i in range(0,n.shape(y)[0]-1):
-		s=""
-		s+="%g\t" % ((y[i][0]+y[i+1][0])/2.0)
-		for j in range(0,n.shape(z)[1]-1):
-			s+="%g\t" % z[i][j]
-			s+="%g\t" % e[i][j]
-		s+="\n"
-		f.write(s)
+	nbin=n.shape(z)[1]-1
+	# first line: the wavelength bin centres, twice each (intensity and error columns)
+	xc=(x[0][0:nbin]+x[0][1:nbin+1])/2.0
+	# then one line per pixel: the theta centre and the intensity and error of each bin
+	table=n.zeros((n.shape(y)[0]-1,1+2*nbin))
+	table[:,0]=(y[0:-1,0]+y[1:,0])/2.0
+	table[:,1::2]=z[:,0:nbin]
+	table[:,2::2]=e[:,0:nbin]
+	f=open(fname,'w')
+	f.write("\t"+"".join(["%g\t%g\t" % (c,c) for c in xc])+"\n")
+	n.savetxt(f,table,fmt="%g",delimiter="\t",newline="\t\n")
 	f.close()
 #
 #===========================================================
 #
+def writemap_bin(dat,th0,spchan,fname):
+	# Off-specular map (see tl) in a compressed binary file for fitting programs: numpy .npz, or
+	# HDF5 (.h5, .hdf5; needs h5py). Arrays: lambda and theta (bin boundaries), I and E, plus th0 and spchan.
+	a1=tl(dat,th0,spchan)
+	arrays={'lambda':a1[0][0],'theta':a1[1][:,0],'I':a1[2],'E':a1[3],'th0':n.array(th0),'spchan':n.array(spchan)}
+	if fname.lower().endswith('.h5') or fname.lower().endswith('.hdf5'):
+		try:
+			import h5py
+		except ImportError:
+			raise RuntimeError("writemap_bin: h5py is needed to write HDF5 maps, use a .npz file name instead")
+		f=h5py.File(fname,'w')
+		for key in arrays.keys():
+			f.create_dataset(key,data=arrays[key],compression="gzip")
+		f.close()
+	else:
+		n.savez_compressed(fname,**arrays)
+
+def readmap_bin(fname):
+	# Map written by writemap_bin, as a dictionary of arrays
+	if fname.lower().endswith('.h5') or fname.lower().endswith('.hdf5'):
+		import h5py
+		f=h5py.File(fname,'r')
+		arrays=dict([(key,f[key][...]) for key in f.keys()])
+		f.close()
+		return arrays
+	f=n.load(fname)
+	arrays=dict([(key,f[key]) for key in f.files])
+	f.close()
+	return arrays
+#
+#===========================================================
+#
 def xye(wksp):
 	a1=mantid.getMatrixWorkspace(wksp)
-	x1=a1.readX(0)
-	X1=n.zeros((len(x1)-1))
-	for i in range(0,len(x1)-1):
-		X1[i]=(x1[i]+x1[i+1])/2.0
-	y1=a1.readY(0)
-	e1=a1.readE(0)
+	x1=n.array(a1.readX(0))
+	X1=(x1[0:-1]+x1[1:])/2.0
+	y1=n.array(a1.readY(0))
+	e1=n.array(a1.readE(0))
 	d1=[X1,y1,e1]
 	return d1
 #
@@ -1389,18 +1396,8 @@ def xye(wksp):
 def writeXYE_tab(dat,fname):
 	a1=xye(dat)
 	f=open(fname,'w')
-	x=a1[0]
-	y=a1[1]
-	e=a1[2]		
-	s=""
-	s+="x\ty\te\n"
-	f.write(s)
-	for i in range(len(x)):
-		s=""
-		s+="%f\t" % x[i]
-		s+="%f\t" % y[i]
-		s+="%f\n" % e[i]  
-		f.write(s)
+	f.write("x\ty\te\n")
+	n.savetxt(f,n.column_stack(a1),fmt="%f",delimiter="\t")
 	f.close()
 
 
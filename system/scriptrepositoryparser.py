@@ -28,6 +28,12 @@ The :func:`parse_repository` function is responsible for iterating over all the
 files inside the repository. Than, it ask the make_entry to form the 
 entry for the python structure.
 
+The authors of all the files are taken from a single git log pass
+(:func:`get_authors`). The descriptions are cached in the .repository_cache.json
+file of the out_directory, with the modification time and git blob hash of the
+file, so that only the files changed since the last run are parsed again (in
+parallel, see :func:`parse_repository`).
+
 In order to get the description of the entries, :func:`make_entry` depends on the
 :func:`get_description` function. 
 
@@ -41,11 +47,12 @@ Created on Wed Mar  6 09:05:08 2013
 @author: gesner
 """
 
+import ast
 import json
+import multiprocessing
 import os
 from os.path import join
 import time
-import compiler
 import sys
 import commands
 import re
@@ -53,6 +60,8 @@ import re
 re_default_author = re.compile('Author: (?P<author>.+) <(?P<email>.+)>')
 re_signed_author = re.compile('signed by: (?P<author>.+) <(?P<email>.+)>')
 
+CACHE_FILE = '.repository_cache.json'
+
 def extract_readme_doc(path):
     """
     Extract the description of README file.    
@@ -91,14 +100,14 @@ def extract_python_doc(path):
     
     .. note:
         It does not check for exception related to opening and reading files, nor 
-        with exception related to malformed python scripts (returned by compiler module)
+        with exception related to malformed python scripts (returned by ast module)
     
     """
     
-    ## first of all, try to get the docstring from the compiler 
-    ## parserFile function, if the doc is not an empty string,
+    ## first of all, try to get the docstring of the module
+    ## parsed by ast, if the doc is not an empty string,
     ## return this documentation
-    doc = compiler.parseFile(path).doc
+    doc = ast.get_docstring(ast.parse(open(path,'r').read(), path), clean=False)
     if doc : return doc
 
     ## extracting the comments at the header of the file
@@ -202,9 +211,95 @@ def get_author(path):
         print 'FAILED'
 
 
+def get_authors():
+    """
+    Get the author of every file of the repository (current directory) from a
+    single git log pass, instead of one :func:`get_author` call per file.
+    
+    The author of a file is the author of the last commit that changed it, or the 
+    name given as 'signed by:' in the message of that commit. 
+    
+    :rtype : dictionary
+    :return : path relative to the repository -> author
+    """
+    authors = dict()
+    # records separated by \x1e: author \x1f message \x1f names of the changed files
+    status, output = commands.getstatusoutput("git -c core.quotepath=off log --name-only --format=format:%x1e%an%x1f%B%x1f")
+    if status:
+        print 'FAILED to get the authors from git log'
+        return authors
+    for record in output.split('\x1e'):
+        try:
+            author, message, names = record.split('\x1f',2)
+        except ValueError:
+            continue
+        spec_m = re.search(re_signed_author,message)
+        if spec_m:
+            author = spec_m.group('author')
+        for name in names.splitlines():
+            name = name.strip()
+            # git log is ordered from the latest commit
+            if name and name not in authors:
+                authors[name] = author
+    return authors
 
 
-def make_entry(path, first_root):
+def get_blob_hashes():
+    """
+    Get the git blob hash of every file of the repository (current directory) 
+    that is not modified in the working tree.
+    
+    :rtype : dictionary
+    :return : path relative to the repository -> blob hash
+    """
+    hashes = dict()
+    status, output = commands.getstatusoutput("git -c core.quotepath=off ls-files -s")
+    if status:
+        return hashes
+    for line in output.splitlines():
+        try:
+            info, name = line.split('\t',1)
+            hashes[name] = info.split()[1]
+        except (ValueError, IndexError):
+            continue
+    # the index hash is not the content of the modified files
+    status, output = commands.getstatusoutput("git -c core.quotepath=off diff --name-only")
+    if not status:
+        for name in output.splitlines():
+            hashes.pop(name.strip(), None)
+    return hashes
+
+
+def load_cache(cache_path):
+    """
+    Load the cached descriptions of a previous :func:`parse_repository`. 
+    
+    :return : dictionary relative path -> {mtime, size, blob, description, dir_doc}
+    or an empty dictionary if the cache could not be read.
+    """
+    try:
+        return json.load(open(cache_path,'r'))
+    except:
+        return dict()
+
+
+def write_json(data, out_path):
+    """
+    Write the data to out_path as json. The file is written to a temporary 
+    file that replaces out_path at the end, so a failure never leaves a 
+    truncated file and the readers never see a partial file.
+    """
+    tmp_path = out_path + '.tmp'
+    out_file = open(tmp_path,'w')
+    json.dump(data, out_file, sort_keys=True,
+       indent=2, separators=(',', ': '))
+    out_file.close()
+    os.rename(tmp_path, out_path)
+
+
+
+
+def make_entry(path, first_root, authors=None, description=None):
     """
     Creates the python dictionary and key values necessary to describe
     each entry (file/folder) of the repository. 
@@ -223,6 +318,9 @@ def make_entry(path, first_root):
     :param first_root: The key should be related to the repository, and not its location in the specific machine,
     in order to be able to remove the location of the specific machine, the first_root, or repository root folder must
     be given.
+    :param authors: dictionary of the authors (:func:`get_authors`). If not given, :func:`get_author` is called.
+    :param description: the (description, dir_doc) tuple of the file, if already known. If not given, 
+    :func:`get_description` is called.
     
     :rtype : tuple with 
     :return : path related to repository, repository entry information, flag to indicate that it contains the directory documentation
@@ -243,15 +341,20 @@ def make_entry(path, first_root):
         if directory:
             return (path.replace(first_root,''),{'pub_date':pub_date, 'directory':directory, 'description':""}, False)
         relative_path = path[len(first_root):]
-        author = get_author(relative_path)
-        description,has_dir_desc = get_description(path)
+        if authors is None:
+            author = get_author(relative_path)
+        else:
+            author = authors.get(relative_path)
+        if description is None:
+            description = get_description(path)
+        description,has_dir_desc = description
         return (path.replace(first_root,''),{'pub_date':pub_date, 'directory':directory, 'description':description, 'author':author}, has_dir_desc)
     except:
         return ("",{"description":"failed"},False)
 
 
 
-def parse_repository(repository_path, out_directory):
+def parse_repository(repository_path, out_directory, nprocesses=None):
     """
     Parse through all the entries (file/folders) of the repository and creates
     the repository.json file. 
@@ -260,26 +363,80 @@ def parse_repository(repository_path, out_directory):
     the information and compose the python dictionary that can be passed to
     :mod:`json` in order to produce the repository.json file. 
     
+    The descriptions of the files whose modification time and size, or git blob 
+    hash, did not change since the last run are taken from the cache file 
+    (CACHE_FILE in out_directory). The other files are parsed by a pool of 
+    nprocesses processes (default: number of cpus).
+    
     This module require the right to override the repository.json file 
-    presented at the out_directory.
+    presented at the out_directory. The file is replaced at once (:func:`write_json`).
     
     :param repository_path: the system path that access the repository folder.
     :out_directory: folder where the repository.json file will be created (override)
+    :param nprocesses: number of processes to parse the files
     """    
     fdb = dict()
+    out_directory = os.path.abspath(out_directory)
     #change the system path to unix like
     first_root = repository_path.replace('\\','/')
     os.chdir(first_root)
     #directory requires the last slash
-    if first_root.endswith('/'):
+    if not first_root.endswith('/'):
         first_root += '/'
-    ## iterating through the folders/files
+
+    authors = get_authors()
+    blobs = get_blob_hashes()
+    cache_path = join(out_directory, CACHE_FILE)
+    cache = load_cache(cache_path)
+    new_cache = dict()
+
+    ## iterating through the folders/files, to find the files to parse
+    tree = []
+    to_parse = []
     for root, dirs, files in os.walk(first_root):
         #ignoring the git related entries
         if '.git/' in root: continue
-    
+        if '.git' in dirs: dirs.remove('.git')
+        names = []
+        for name in files:
+            if 'repository.json' in name or name == CACHE_FILE or name == CACHE_FILE + '.tmp': continue
+            path = join(root,name)
+            relative_path = path[len(first_root):]
+            names.append(name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            state = {'mtime':stat.st_mtime, 'size':stat.st_size, 'blob':blobs.get(relative_path)}
+            cached = cache.get(relative_path)
+            if cached and ((cached['mtime'] == state['mtime'] and cached['size'] == state['size']) or
+                           (state['blob'] is not None and cached['blob'] == state['blob'])):
+                state['description'] = cached['description']
+                state['dir_doc'] = cached['dir_doc']
+            else:
+                to_parse.append(path)
+            new_cache[relative_path] = state
+        tree.append((root, names))
+
+    ## parse the new and changed files
+    if nprocesses is None:
+        nprocesses = multiprocessing.cpu_count()
+    print 'parsing %d of %d files' % (len(to_parse), len(new_cache))
+    if nprocesses > 1 and len(to_parse) > 1:
+        pool = multiprocessing.Pool(nprocesses)
+        descriptions = pool.map(get_description, to_parse, chunksize=16)
+        pool.close()
+        pool.join()
+    else:
+        descriptions = map(get_description, to_parse)
+    for path, (description, dir_doc) in zip(to_parse, descriptions):
+        state = new_cache[path[len(first_root):]]
+        state['description'] = description
+        state['dir_doc'] = dir_doc
+
+    for root, names in tree:
         #create the entry for the current folder
-        key, value, d = make_entry(root, first_root)
+        key, value, d = make_entry(root, first_root, authors)
 
         #check that the path is not a .git related folder        
         if key and '.git' not in key:
@@ -289,10 +446,11 @@ def parse_repository(repository_path, out_directory):
         directory_key = key
     
         #iterating through all the files in this directory    
-        for name in files:
-            if 'repository.json' in name: continue
-            #print 'processing ', name
-            key,value,dir_doc = make_entry(join(root,name), first_root)
+        for name in names:
+            path = join(root,name)
+            state = new_cache.get(path[len(first_root):])
+            if state is None: continue
+            key,value,dir_doc = make_entry(path, first_root, authors, (state['description'], state['dir_doc']))
             #check the entry is not .git specific
             if key and '.git' not in key:
                 fdb[key] = value
@@ -309,15 +467,22 @@ def parse_repository(repository_path, out_directory):
     try:
         out_path = out_directory+'/'+'repository.json'
         print 'creating out_path',out_path
-        json.dump(fdb,open(out_path,'w'), sort_keys=True,
-           indent=2, separators=(',', ': '))
+        write_json(fdb, out_path)
     except: 
         print "PARSE REPOSITORY: Failed to create the repository.json file!"
         print sys.exc_info()
+    try:
+        write_json(new_cache, cache_path)
+    except:
+        print "PARSE REPOSITORY: Failed to write the cache", cache_path
 
 
 if __name__ == "__main__":
     import sys
     #First Parameter: path of the repository
     #Seccond Parameter: where to store the repository.json
-    parse_repository(sys.argv[1], sys.argv[2])
+    #Third Parameter (optional): number of processes to parse the files
+    if len(sys.argv) > 3:
+        parse_repository(sys.argv[1], sys.argv[2], int(sys.argv[3]))
+    else:
+        parse_repository(sys.argv[1], sys.argv[2])